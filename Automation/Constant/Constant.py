@@ -1,4 +1,71 @@
-YAML_FILE_TEMPLATE = '/Users/ritwik.raj/kubernetes/jupyterLab/Automation/Template/jupyterlab.yaml'
-OUTPUT_PATH = '/Users/ritwik.raj/kubernetes/jupyterLab/Automation/Output'
-LOG_OUTPUT_PATH = '/Users/ritwik.raj/kubernetes/jupyterLab/Automation/Output/app.log'
-FIVE_MINUTES = 5
\ No newline at end of file
+import os
+
+AUTOMATION_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+YAML_FILE_TEMPLATE = os.path.join(AUTOMATION_PATH, 'Template', 'jupyterlab.yaml')
+OUTPUT_PATH = os.path.join(AUTOMATION_PATH, 'Output')
+LOG_OUTPUT_PATH = os.path.join(AUTOMATION_PATH, 'Output', 'app.log')
+CLUSTER_READY_TIMEOUT_SECONDS = 60
+INFORMER_WATCH_TIMEOUT_SECONDS = 300
+INFORMER_RETRY_SECONDS = 2
+INFORMER_STALE_SECONDS = 600
+WHEELHOUSE_TEMPLATE = os.path.join(AUTOMATION_PATH, 'Template', 'wheelhouse.yaml')
+WHEELHOUSE_NAME = 'jupyterlab-wheelhouse'
+WHEELHOUSE_POD_PATH = '/opt/wheelhouse'
+WHEELHOUSE_PORT = 8080
+RECONCILE_INTERVAL_SECONDS = 30
+# The desired package set of a cluster is kept as a requirements file in a ConfigMap mounted into its pods. The
+# JupyterLab container installs it on every start (see Template/jupyterlab.yaml) and only then creates the file
+# its readinessProbe checks, so pods only get traffic once their packages are installed
+PACKAGES_REQUIREMENTS_KEY = 'requirements.txt'
+PACKAGES_READY_FILE = '/tmp/.jupyterlab-packages-ready'
+ASYNC_MAX_CONCURRENCY = 32
+API_CONNECTION_POOL_MAXSIZE = 64
+FLEET_GLOBAL_CONCURRENCY = 16
+FLEET_NAMESPACE_CONCURRENCY = 4
+FLEET_API_RATE_PER_SECOND = 50
+FLEET_API_BURST = 100
+FLEET_EXEC_RATE_PER_SECOND = 10
+FLEET_EXEC_BURST = 20
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BACKGROUND = 10
+WARM_POOL_LABEL = 'jupyterlab-warm-pool'
+WARM_POOL_CLAIMED_LABEL = 'jupyterlab-claimed-by'
+WARM_POOL_MIN_SIZE = 1
+WARM_POOL_MAX_SIZE = 20
+WARM_POOL_DEMAND_WINDOW_SECONDS = 3600
+WARM_POOL_REFILL_INTERVAL_SECONDS = 10
+FIELD_MANAGER = 'jupyterlab-as-a-service'
+ROLLOUT_MAX_SURGE = '25%'
+ROLLOUT_MAX_UNAVAILABLE = 0
+ROLLOUT_PROGRESS_DEADLINE_SECONDS = 300
+ROLLOUT_TIMEOUT_SECONDS = 900
+JUPYTERLAB_PORT = 8888
+POD_DELETION_COST_ANNOTATION = 'controller.kubernetes.io/pod-deletion-cost'
+AUTOSCALER_INTERVAL_SECONDS = 30
+AUTOSCALER_MIN_REPLICAS = 0
+AUTOSCALER_MAX_REPLICAS = 20
+AUTOSCALER_RESUME_REPLICAS = 1
+AUTOSCALER_TARGET_UTILIZATION = 0.75
+AUTOSCALER_IDLE_SECONDS = 900
+AUTOSCALER_ACTIVE_CPU_MILLICORES = 100
+AUTOSCALER_SCALE_UP_COOLDOWN_SECONDS = 30
+AUTOSCALER_SCALE_DOWN_COOLDOWN_SECONDS = 300
+AUTOSCALER_SCALE_DOWN_STABILIZATION_SECONDS = 600
+AUTOSCALER_SCALE_TO_ZERO_SECONDS = 3600
+AUTOSCALER_HTTP_TIMEOUT_SECONDS = 5
+AUTOSCALER_MAX_WORKERS = 16
+POD_DELETION_COST_REMOVE = -1000
+EXEC_MAX_WORKERS = 32
+EXEC_MAX_PER_NODE = 8
+EXEC_TIMEOUT_SECONDS = 600
+EXEC_RETRIES = 2
+EXEC_BACKOFF_SECONDS = 1
+EXEC_MAX_BACKOFF_SECONDS = 30
+EXEC_SLOT_POLL_SECONDS = 0.05
+STATE_STORE_PATH = os.path.join(AUTOMATION_PATH, 'Output', 'state.db')
+STATE_STORE_BUSY_TIMEOUT_SECONDS = 30
+INFORMER_SNAPSHOT_INTERVAL_SECONDS = 30
+INFORMER_SNAPSHOT_MAX_AGE_SECONDS = 300
+# Timeout of the first watch after a restore, the informer is live once it returns without a 410
+INFORMER_RESTORE_CATCHUP_SECONDS = 1
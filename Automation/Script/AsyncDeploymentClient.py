@@ -0,0 +1,583 @@
+import asyncio
+import contextlib
+import json
+import logging
+import shlex
+import time
+
+from kubernetes_asyncio import client, config, watch
+from kubernetes_asyncio.client.rest import ApiException
+from kubernetes_asyncio.stream import WsApiClient
+
+import ClientRegistry
+import ClusterCore
+import EnvironmentReconciler
+import KubernetesHelper
+import PodInformer
+import Utils
+from Automation.Constant.Constant import *
+
+EXIT_CODE_MARKER = "__exit_code="
+
+_config_loaded = False
+
+
+async def _load_config():
+    global _config_loaded
+    if not _config_loaded:
+        await config.load_kube_config()
+        _config_loaded = True
+
+
+# Function to use the given kubernetes_asyncio configuration instead of the kubeconfig, for clients created after
+def set_configuration(configuration):
+    global _config_loaded
+    client.Configuration.set_default(configuration)
+    _config_loaded = True
+
+
+# Function to get the API server the clients talk to, the one of the kubeconfig until a configuration is set
+def get_api_server() -> str:
+    if _config_loaded:
+        return client.Configuration.get_default_copy().host
+    return ClientRegistry.get_configuration().host
+
+
+# Function to split the output of a command run with the exit code marker into (exit code, output). Output
+# without the marker (the shell was killed or the stream cut) counts as a failure
+def parse_exec_output(output) -> tuple:
+    command_output, separator, exit_code = output.rpartition(EXIT_CODE_MARKER)
+    if not separator or not exit_code.strip().isdigit():
+        return 1, output
+    return int(exit_code.strip()), command_output
+
+
+# asyncio variant of DeploymentClient: every call is non-blocking, so one event loop can drive many clusters.
+# Pass the same semaphore to several clients to bound exec streams across all of them. The cluster state, desired
+# package set, wheelhouse requirements, warm pool claims, scale plan and reconcile bookkeeping come from
+# ClusterCore, shared with DeploymentClient; only the API calls and pod execs are asyncio. The state store,
+# warm pool and wheelhouse are synchronous and run in worker threads. Freezing an image stays with
+# DeploymentClient
+class AsyncDeploymentClient(ClusterCore.ClusterCore):
+    def __init__(self, deployment_name, namespace, replica_count, image, is_active=False, semaphore=None,
+                 wheelhouse=None, warm_pool=None, state_store=None):
+        super().__init__(deployment_name, namespace, replica_count, image, is_active=is_active, wheelhouse=wheelhouse,
+                         warm_pool=warm_pool, state_store=state_store, api_server=get_api_server())
+        self.semaphore = semaphore or asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+        self._reconcile_lock = asyncio.Lock()
+        # Held while scale_cluster changes the pod count, so lost claimed pods are not replaced halfway through
+        self._scaling_lock = asyncio.Lock()
+        self._reconcile_task = None
+        self._api_client = None
+        self._ws_api_client = None
+
+    async def _core_v1(self):
+        if self._api_client is None:
+            await _load_config()
+            self._api_client = client.ApiClient()
+        return client.CoreV1Api(self._api_client)
+
+    async def _apps_v1(self):
+        await self._core_v1()
+        return client.AppsV1Api(self._api_client)
+
+    async def close(self):
+        await self.stop()
+        if self._api_client is not None:
+            await self._api_client.close()
+        if self._ws_api_client is not None:
+            await self._ws_api_client.close()
+
+    # Function to create python custer deployment
+    async def create_cluster(self, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS) -> bool:
+        if self.desired_packages is None:
+            # The pods of a new cluster only have the image's packages
+            self.desired_packages = []
+        claimed_pods = await self.claim_warm_pods(int(self.replica_count))
+        self.claimed_pods.update(claimed_pods)
+        # Server-side apply like DeploymentClient, so re-creating an existing cluster updates it in place. The
+        # deployment only launches the pods the warm pool could not provide
+        k8s_objects = await asyncio.to_thread(self.render_cluster_yaml, int(self.replica_count) - len(claimed_pods))
+        if not await self._apply(k8s_objects):
+            logging.debug(f"Cluster {self.deployment_name} creation failed")
+            return False
+        if claimed_pods:
+            await self._set_pods_owner_to_deployment(claimed_pods)
+
+        logging.debug(f"Cluster {self.deployment_name} created, waiting for all pods to get into Running state")
+        if await self.wait_for_ready_pods(self.replica_count, timeout_seconds):
+            logging.debug(f"Cluster {self.deployment_name} created successful")
+            self.is_active = True
+            await asyncio.to_thread(self.save_state, is_active=True, replica_count=int(self.replica_count),
+                                    image=self.image, frozen_image=None, frozen_packages=[],
+                                    desired_packages=self.desired_packages)
+            return True
+        logging.debug(f"Timeout of {timeout_seconds} second(s) completed, cluster {self.deployment_name} creation failed")
+        await self.delete_cluster(skip_is_active_check=True)
+        return False
+
+    # Function to create or update objects with server-side apply, one request per object
+    async def _apply(self, k8s_objects) -> bool:
+        await self._core_v1()
+        try:
+            for k8s_object in k8s_objects:
+                await self._api_client.call_api(response_types_map={200: "object", 201: "object"},
+                                                **KubernetesHelper.get_apply_request(k8s_object, self.namespace))
+            return True
+        except ApiException as e:
+            logging.debug(f"Applying objects of cluster {self.deployment_name} failed: {e}")
+            return False
+
+    # Function to update the packages ConfigMap to the desired package set, pods starting from then on install it
+    async def save_packages_configmap(self) -> bool:
+        return await self._apply([await asyncio.to_thread(self.render_packages_configmap)])
+
+    # Function to read the deployment, as the dict returned by the API server
+    async def _read_deployment(self) -> dict:
+        apps_v1 = await self._apps_v1()
+        response = await apps_v1.read_namespaced_deployment(self.deployment_name, self.namespace,
+                                                            _preload_content=False)
+        return json.loads(await response.read())
+
+    # Function to claim warm pods for the cluster, returns the names of the claimed pods
+    async def claim_warm_pods(self, count) -> list:
+        if not self.can_claim_warm_pods(count):
+            return []
+        return await asyncio.to_thread(self.warm_pool.claim, deployment_name=self.deployment_name, count=count)
+
+    # Function to hand claimed pods over to the deployment, so they go with it
+    async def _set_pods_owner_to_deployment(self, pod_names):
+        deployment = await self._read_deployment()
+        owner_reference = {"apiVersion": "apps/v1", "kind": "Deployment", "name": self.deployment_name,
+                           "uid": deployment['metadata']['uid']}
+        core_v1 = await self._core_v1()
+        await asyncio.gather(*[core_v1.patch_namespaced_pod(pod_name, self.namespace, {
+            "metadata": {"ownerReferences": [owner_reference]}}) for pod_name in pod_names])
+
+    # Function to hand the share of claimed pods that went away to the deployment, see get_lost_claimed_pods.
+    # Returns the number of replicas added
+    async def replace_lost_claimed_pods(self) -> int:
+        if not self.is_active or self._scaling_lock.locked():
+            return 0
+        async with self._scaling_lock:
+            pods = await self.get_pods()
+            lost_pods = self.get_lost_claimed_pods(pods)
+            if not lost_pods:
+                return 0
+            core_v1 = await self._core_v1()
+            await asyncio.gather(*[core_v1.delete_namespaced_pod(pod['metadata']['name'], self.namespace)
+                                   for pod in pods if pod['metadata']['name'] in lost_pods
+                                   and not pod['metadata'].get('deletionTimestamp')])
+            replicas = (await self._read_deployment())['spec'].get('replicas', 1)
+            logging.debug(f"Claimed pods {lost_pods} of cluster {self.deployment_name} are gone, "
+                          f"scaling its deployment to {replicas + len(lost_pods)} replicas")
+            apps_v1 = await self._apps_v1()
+            await apps_v1.patch_namespaced_deployment_scale(self.deployment_name, self.namespace,
+                                                            {"spec": {"replicas": replicas + len(lost_pods)}})
+            self.claimed_pods.difference_update(lost_pods)
+            return len(lost_pods)
+
+    # Function to scale python custer deployment, on scale-down the pods in pods_to_remove are removed first
+    async def scale_cluster(self, new_replica_count, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS,
+                            pods_to_remove=()) -> bool:
+        async with self._scaling_lock:
+            return await self._scale_cluster(new_replica_count, timeout_seconds, pods_to_remove)
+
+    async def _scale_cluster(self, new_replica_count, timeout_seconds, pods_to_remove) -> bool:
+        logging.debug(f"Scaling cluster {self.deployment_name} to {new_replica_count} nodes")
+        # Read before the new pods exist, they start from the image's packages
+        await self.get_desired_packages()
+        claimed_pods = ClusterCore.get_claimed_pods(self.deployment_name, await self.get_pods())
+        new_claimed_pods = await self.claim_warm_pods(int(new_replica_count) - int(self.replica_count))
+        apps_v1, core_v1 = await self._apps_v1(), await self._core_v1()
+        try:
+            if new_claimed_pods:
+                await self._set_pods_owner_to_deployment(new_claimed_pods)
+            self.claimed_pods.update(new_claimed_pods)
+            pods_to_delete, pods_to_remove_first, replicas = ClusterCore.plan_scale(
+                new_replica_count, claimed_pods + new_claimed_pods, pods_to_remove)
+            self.claimed_pods.difference_update(pods_to_delete)
+            await asyncio.gather(
+                *[core_v1.delete_namespaced_pod(pod_name, self.namespace) for pod_name in pods_to_delete],
+                *[core_v1.patch_namespaced_pod(pod_name, self.namespace, {"metadata": {"annotations": {
+                    POD_DELETION_COST_ANNOTATION: str(POD_DELETION_COST_REMOVE)}}}) for pod_name in pods_to_remove_first])
+            await apps_v1.patch_namespaced_deployment_scale(self.deployment_name, self.namespace,
+                                                            {"spec": {"replicas": replicas}})
+        except ApiException as e:
+            logging.debug(f"Cluster {self.deployment_name} scaling failed: {e}")
+            return False
+        # New pods install the cluster's packages before they turn Ready
+        if not await self.wait_for_ready_pods(new_replica_count, timeout_seconds):
+            logging.debug(f"Timeout of {timeout_seconds} second(s) completed, cluster {self.deployment_name} scaling failed")
+            return False
+        self.replica_count = new_replica_count
+        await asyncio.to_thread(self.save_state, replica_count=int(new_replica_count))
+        logging.debug(f"Cluster {self.deployment_name} scaled successful")
+        return True
+
+    # Function to move the cluster to a new image without downtime, like DeploymentClient.update_image: new pods
+    # only turn ready once they installed the cluster's packages, and the deployment is rolled back to its
+    # previous image if the rollout stops progressing
+    async def update_image(self, image, max_surge=ROLLOUT_MAX_SURGE, max_unavailable=ROLLOUT_MAX_UNAVAILABLE,
+                           progress_deadline_seconds=ROLLOUT_PROGRESS_DEADLINE_SECONDS,
+                           timeout_seconds=ROLLOUT_TIMEOUT_SECONDS) -> bool:
+        await self.get_desired_packages()
+        deployment = await self._read_deployment()
+        previous_image = next(container['image'] for container in deployment['spec']['template']['spec']['containers']
+                              if container['name'] == self.deployment_name)
+        previous_replicas = deployment['spec'].get('replicas', 1)
+        # Claimed warm pods keep the old image, the deployment takes over their share and they go once it is done
+        claimed_pods = ClusterCore.get_claimed_pods(self.deployment_name, await self.get_pods())
+        container_fields, volumes = await asyncio.to_thread(self.get_rollout_pod_fields)
+        await self.save_packages_configmap()
+
+        logging.debug(f"Rolling cluster {self.deployment_name} from {previous_image} to {image}, "
+                      f"maxSurge {max_surge}, maxUnavailable {max_unavailable}")
+        apps_v1, core_v1 = await self._apps_v1(), await self._core_v1()
+        await apps_v1.patch_namespaced_deployment(self.deployment_name, self.namespace, KubernetesHelper.get_rollout_patch(
+            self.deployment_name, image, int(self.replica_count), max_surge, max_unavailable, progress_deadline_seconds,
+            container_fields=container_fields, volumes=volumes))
+        state = await self.wait_for_deployment_rollout(timeout_seconds)
+        if state == "complete":
+            await self.reconcile_once()
+            async with self._scaling_lock:
+                await asyncio.gather(*[core_v1.delete_namespaced_pod(pod_name, self.namespace)
+                                       for pod_name in claimed_pods])
+                self.claimed_pods.difference_update(claimed_pods)
+            if image != self.frozen_image:
+                # A frozen image was derived from the old image
+                self.frozen_image = None
+                self.frozen_packages = []
+            self.image = image
+            await asyncio.to_thread(self.save_state, image=image, frozen_image=self.frozen_image,
+                                    frozen_packages=self.frozen_packages)
+            logging.debug(f"Cluster {self.deployment_name} rolled out to {image}")
+            return True
+
+        logging.debug(f"Rollout of {image} on cluster {self.deployment_name} ended {state}, "
+                      f"rolling back to {previous_image}")
+        await apps_v1.patch_namespaced_deployment(self.deployment_name, self.namespace, KubernetesHelper.get_rollout_patch(
+            self.deployment_name, previous_image, previous_replicas, max_surge, max_unavailable,
+            progress_deadline_seconds, container_fields=container_fields, volumes=volumes))
+        rolled_back = await self.wait_for_deployment_rollout(timeout_seconds) == "complete"
+        logging.debug(f"Rollback of cluster {self.deployment_name} to {previous_image} "
+                      f"{'completed' if rolled_back else 'failed'}")
+        return False
+
+    # Function to follow the deployment rollout through watch events. Returns the final rollout state (see
+    # KubernetesHelper.get_rollout_state), or "timeout"
+    async def wait_for_deployment_rollout(self, timeout_seconds) -> str:
+        apps_v1 = await self._apps_v1()
+        deadline = time.monotonic() + timeout_seconds
+        deployment = await self._read_deployment()
+        while True:
+            state = KubernetesHelper.get_rollout_state(deployment)
+            remaining = deadline - time.monotonic()
+            if state != "progressing" or remaining <= 0:
+                return state if state != "progressing" else "timeout"
+            try:
+                async with watch.Watch() as w:
+                    async for event in w.stream(apps_v1.list_namespaced_deployment, namespace=self.namespace,
+                                                field_selector=f"metadata.name={self.deployment_name}",
+                                                resource_version=deployment['metadata']['resourceVersion'],
+                                                timeout_seconds=max(1, int(remaining))):
+                        if event['type'] == "DELETED":
+                            raise Exception(f"ERROR: Deployment {self.deployment_name} was deleted\n")
+                        if event['type'] == "ERROR":
+                            break
+                        deployment = event['raw_object']
+                        if KubernetesHelper.get_rollout_state(deployment) != "progressing":
+                            break
+            except ApiException as e:
+                if e.status != 410:
+                    raise
+            if KubernetesHelper.get_rollout_state(deployment) == "progressing":
+                # The watch ended or its resourceVersion is too old, start over from a fresh read
+                deployment = await self._read_deployment()
+
+    # Function to get the desired package set, seeded from the cluster's current packages on first use. Scale,
+    # install and update start here, so they also pick up the state other processes stored since
+    async def get_desired_packages(self) -> list:
+        if self.state_store is not None:
+            await asyncio.to_thread(self.refresh_state)
+        if self.desired_packages is None:
+            packages = await self.get_all_python_package_present_in_cluster()
+            if not packages:
+                # No ready pod to seed from (e.g. scaled to zero), seeded once the cluster has one
+                return []
+            await asyncio.to_thread(self.seed_desired_packages, packages)
+            await self.save_packages_configmap()
+        return self.desired_packages
+
+    # Function to install the desired packages each ready pod is missing, skipping pods converged since their
+    # containers last started. Returns pod name -> number of packages installed
+    async def reconcile_once(self) -> dict:
+        async with self._reconcile_lock:
+            return await self._reconcile_once()
+
+    async def _reconcile_once(self) -> dict:
+        if self.warm_pool is not None:
+            # Only clusters claiming from a warm pool have claimed pods
+            try:
+                await self.replace_lost_claimed_pods()
+            except Exception as e:
+                logging.debug(f"Replacing lost claimed pods of cluster {self.deployment_name} failed: {e}")
+        desired_packages = tuple(sorted(await self.get_desired_packages()))
+        # Pods not ready yet are still installing the desired set on their own
+        ready_pods = [pod for pod in await self.get_pods() if PodInformer.is_pod_ready(pod)]
+        pending_pods = self.reconcile_state.begin(ready_pods, desired_packages)
+        if not pending_pods:
+            return {}
+        deltas = self.get_known_deltas([pod for pod in ready_pods if pod['metadata']['name'] in pending_pods],
+                                       desired_packages)
+
+        pods_to_inventory = [name for name in pending_pods if name not in deltas]
+        inventories = await asyncio.gather(*[self.get_python_package_present_in_pod(name)
+                                             for name in pods_to_inventory], return_exceptions=True)
+        for name, inventory in zip(pods_to_inventory, inventories):
+            if isinstance(inventory, BaseException):
+                self.reconcile_state.record(name, pending_pods[name], None,
+                                            error=f"package inventory failed: {inventory}")
+            else:
+                deltas[name] = EnvironmentReconciler.compute_package_delta(desired_packages, inventory)
+        for name, delta in deltas.items():
+            if not delta:
+                self.reconcile_state.record(name, pending_pods[name], delta)
+        pods_to_install = {name: delta for name, delta in deltas.items() if delta}
+
+        results = {}
+        if pods_to_install and self.wheelhouse is not None:
+            all_missing = sorted({requirement for delta in pods_to_install.values() for requirement in delta})
+            if not await asyncio.to_thread(self.prepare_wheelhouse, all_missing):
+                logging.debug("Wheelhouse could not be prepared, pods keep their current packages")
+                for name in pods_to_install:
+                    self.reconcile_state.record(name, pending_pods[name], None,
+                                                error="wheelhouse could not be prepared")
+                pods_to_install = {}
+        installs = await asyncio.gather(*[self.install_python_packages_in_pod(name, delta)
+                                          for name, delta in pods_to_install.items()], return_exceptions=True)
+        for (name, delta), installed in zip(pods_to_install.items(), installs):
+            error = None
+            if isinstance(installed, BaseException):
+                error, installed = f"install failed: {installed}", 0
+            results[name] = installed
+            self.reconcile_state.record(name, pending_pods[name], delta, installed=installed, error=error)
+        return results
+
+    # Function to keep reconciling in a background task of the running event loop, so pods that started before
+    # packages were added converge without waiting for the next scale or update
+    def start(self, interval_seconds=RECONCILE_INTERVAL_SECONDS):
+        if self._reconcile_task is None:
+            self._reconcile_task = asyncio.get_running_loop().create_task(
+                self._run(interval_seconds), name=f"reconciler-{self.deployment_name}")
+        return self
+
+    async def stop(self):
+        task, self._reconcile_task = self._reconcile_task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    async def _run(self, interval_seconds):
+        while True:
+            try:
+                await self.reconcile_once()
+            except Exception as e:
+                logging.debug(f"Reconcile of cluster {self.deployment_name} failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    # Function to wait until the deployment has exactly target_count Ready pods. Pods install the desired package
+    # set before they turn Ready, the ready pods are then given the packages added since they started. Fails when
+    # some pod could not get its packages
+    async def wait_for_ready_pods(self, target_count, timeout_seconds) -> bool:
+        if not await self._wait_for_pods(target_count, timeout_seconds, PodInformer.is_pod_ready):
+            return False
+        results = await self.reconcile_once()
+        logging.debug(f"Python packages installed per pod: {results}")
+        if self.reconcile_state.failed_pods:
+            logging.debug(f"Pods of cluster {self.deployment_name} left without their packages: "
+                          f"{self.reconcile_state.failed_pods}")
+            return False
+        return True
+
+    # Function to wait until the deployment has exactly target_count pods is_counted(pod) is true for, using the
+    # watch stream
+    async def _wait_for_pods(self, target_count, timeout_seconds, is_counted) -> bool:
+        core_v1 = await self._core_v1()
+        label_selector = f"app={self.deployment_name}"
+        deadline = time.monotonic() + timeout_seconds
+        resource_version = None
+        counted_pods = {}
+        while True:
+            if resource_version is None:
+                pods = await core_v1.list_namespaced_pod(namespace=self.namespace, label_selector=label_selector,
+                                                         _preload_content=False)
+                data = json.loads(await pods.read())
+                counted_pods = {obj['metadata']['name']: is_counted(obj) for obj in data['items']}
+                resource_version = data['metadata']['resourceVersion']
+            if sum(counted_pods.values()) == int(target_count):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                async with watch.Watch() as w:
+                    async for event in w.stream(core_v1.list_namespaced_pod, namespace=self.namespace,
+                                                label_selector=label_selector, resource_version=resource_version,
+                                                timeout_seconds=max(1, int(remaining))):
+                        obj = event['raw_object']
+                        if event['type'] == "ERROR":
+                            resource_version = None
+                            break
+                        resource_version = obj['metadata']['resourceVersion']
+                        if event['type'] == "DELETED":
+                            counted_pods.pop(obj['metadata']['name'], None)
+                        else:
+                            counted_pods[obj['metadata']['name']] = is_counted(obj)
+                        if sum(counted_pods.values()) == int(target_count):
+                            return True
+            except ApiException as e:
+                if e.status != 410:
+                    raise
+                resource_version = None
+
+    # Function to run a shell command inside a pod, returns (exit code, output)
+    async def exec_in_pod(self, pod_name, command) -> tuple:
+        async with self.semaphore:
+            if self._ws_api_client is None:
+                await _load_config()
+                self._ws_api_client = WsApiClient()
+            core_v1 = client.CoreV1Api(self._ws_api_client)
+            # The exit code is echoed on stdout, the websocket response only carries the output
+            output = await core_v1.connect_get_namespaced_pod_exec(
+                pod_name, self.namespace, command=["/bin/sh", "-c", f"{command}; echo {EXIT_CODE_MARKER}$?"],
+                stderr=True, stdin=False, stdout=True, tty=False)
+        return parse_exec_output(output)
+
+    # Function to install a python package inside a pod
+    async def install_python_package_in_pod(self, pod_name, package) -> bool:
+        if self.wheelhouse is not None:
+            # Hash-pinned installs need a requirements file
+            return (await self.install_python_requirements_in_pod(pod_name, [package]))[package]
+        returncode, output = await self.exec_in_pod(pod_name, f"pip3 install {shlex.quote(package)}")
+        if returncode != 0:
+            logging.debug(f"Package {package} installation failed inside the pod {pod_name}: {output}")
+            return False
+        logging.debug(f"Package {package} installation succeeded inside the pod {pod_name}")
+        return True
+
+    # Function to install list of python packages inside a pod, in a single pip invocation
+    async def install_python_packages_in_pod(self, pod_name, packages_list) -> int:
+        if not packages_list:
+            return 0
+        results = await self.install_python_requirements_in_pod(pod_name, packages_list)
+        installed_packages = sum(results.values())
+        for package in [package for package, installed in results.items() if not installed]:
+            if await self.install_python_package_in_pod(pod_name, package):
+                installed_packages = installed_packages + 1
+        logging.debug(f"{installed_packages}/{len(packages_list)} python packages installed in pod {pod_name}")
+        return installed_packages
+
+    # Function to install a set of python packages inside a pod in a single pip invocation, returns package ->
+    # installed. With a wheelhouse the packages go through a requirements file pinning every wheel to its hash;
+    # exec streams here carry no stdin, so the file is written with printf
+    async def install_python_requirements_in_pod(self, pod_name, packages_list) -> dict:
+        if self.wheelhouse is None:
+            requirements = " ".join(shlex.quote(package) for package in packages_list)
+            _, output = await self.exec_in_pod(pod_name, f"pip3 install {requirements}")
+            return Utils.Utils.extract_pip_install_results(packages_list, output)
+        requirements = await asyncio.to_thread(self.get_install_requirements, packages_list)
+        if requirements is None:
+            return {package: False for package in packages_list}
+        _, output = await self.exec_in_pod(
+            pod_name, f"requirements_file=$(mktemp) && printf '%s' {shlex.quote(requirements)} > \"$requirements_file\" && "
+                      f"{self.get_pip_install_command()} -r \"$requirements_file\"; status=$?; "
+                      f"rm -f \"$requirements_file\"; test $status -eq 0")
+        return Utils.Utils.extract_pip_install_results(packages_list, output)
+
+    # Function to install python library in all running pods of a kubernetes deployment, adding it to the desired
+    # packages. A pod failing is logged and counted out, the other pods still get the package
+    async def install_python_package_in_cluster(self, package) -> tuple:
+        await self.get_desired_packages()
+        await asyncio.to_thread(self.add_desired_package, package)
+        pod_status_map = await self.get_pods_and_status_of_deployment()
+        running_pods = [pod_name for pod_name, status in pod_status_map.items() if status == "Running"]
+        if self.wheelhouse is not None and not await asyncio.to_thread(self.prepare_wheelhouse, [package]):
+            logging.debug(f"Wheelhouse could not be prepared for {package}")
+            return 0, len(pod_status_map)
+        # Pods started or restarted from now on install it themselves
+        await self.save_packages_configmap()
+        results = await asyncio.gather(*[self.install_python_package_in_pod(pod_name, package)
+                                         for pod_name in running_pods], return_exceptions=True)
+        pods_package_install_count = 0
+        for pod_name, result in zip(running_pods, results):
+            if isinstance(result, BaseException):
+                logging.debug(f"{package} package install failed in pod {pod_name}: {result}")
+            elif result:
+                pods_package_install_count = pods_package_install_count + 1
+        logging.debug(f"{package} package is installed in {pods_package_install_count}/{len(pod_status_map)} Pods")
+        return pods_package_install_count, len(pod_status_map)
+
+    # Function to list the pods of the deployment, as returned by the API server
+    async def get_pods(self) -> list:
+        core_v1 = await self._core_v1()
+        response = await core_v1.list_namespaced_pod(namespace=self.namespace,
+                                                     label_selector=f"app={self.deployment_name}",
+                                                     _preload_content=False)
+        return json.loads(await response.read())['items']
+
+    # Check pods and status of a kubernetes deployment
+    async def get_pods_and_status_of_deployment(self) -> dict:
+        return {obj['metadata']['name']: obj['status']['phase'] for obj in await self.get_pods()}
+
+    # Function to get python packages in a pod whose name starts with package
+    async def get_python_package_present_in_pod(self, pod_name, package="") -> dict:
+        returncode, output = await self.exec_in_pod(pod_name, "pip3 list --format=json --disable-pip-version-check")
+        if returncode != 0:
+            raise Exception(f"ERROR: pip3 list failed inside the pod {pod_name}\n")
+        prefix = Utils.Utils.canonicalize_package_name(package)
+        return {name: version for name, version in Utils.Utils.extract_python_packages_from_json(output).items()
+                if Utils.Utils.canonicalize_package_name(name).startswith(prefix)}
+
+    # Function to get python package in the cluster, based upon a package name, read from a ready pod.
+    # A cluster without ready pods has no packages
+    async def get_python_package_present_in_cluster(self, package="") -> dict:
+        ready_pods = [pod['metadata']['name'] for pod in await self.get_pods() if PodInformer.is_pod_ready(pod)]
+        if not ready_pods:
+            return {}
+        return await self.get_python_package_present_in_pod(ready_pods[0], package)
+
+    # Function to get all python packages in the cluster
+    async def get_all_python_package_present_in_cluster(self) -> list:
+        python_package_map = await self.get_python_package_present_in_cluster()
+        return [f"{name}=={version}" for name, version in python_package_map.items()]
+
+    # Function to delete the entire cluster
+    async def delete_cluster(self, skip_is_active_check=False) -> bool:
+        # Another process may have created or deleted the cluster since this client started
+        if self.state_store is not None:
+            cluster = await asyncio.to_thread(self.state_store.get_cluster, self.api_server, self.namespace,
+                                              self.deployment_name)
+            if cluster is not None:
+                self.is_active = cluster['is_active']
+        if not (self.is_active or skip_is_active_check):
+            logging.debug(f"Cluster {self.deployment_name} is already in inactive state")
+            return False
+        apps_v1, core_v1 = await self._apps_v1(), await self._core_v1()
+        try:
+            await asyncio.gather(apps_v1.delete_namespaced_deployment(self.deployment_name, self.namespace),
+                                 core_v1.delete_namespaced_service(self.deployment_name, self.namespace),
+                                 core_v1.delete_namespaced_config_map(f"{self.deployment_name}-packages",
+                                                                      self.namespace))
+        except ApiException as e:
+            logging.debug(f"Error while deleting the cluster {self.deployment_name}: {e}")
+            return False
+        await self.stop()
+        self.is_active = False
+        self.desired_packages = None
+        self.claimed_pods = set()
+        self.reconcile_state = EnvironmentReconciler.ReconcileState()
+        await asyncio.to_thread(self.save_state, is_active=False, desired_packages=None)
+        logging.debug(f"Cluster {self.deployment_name} is deleted successfully")
+        return True
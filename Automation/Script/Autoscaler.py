@@ -0,0 +1,241 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+import urllib3
+
+import ClientRegistry
+import KubernetesHelper
+import PodInformer
+import Telemetry
+from Automation.Constant.Constant import *
+
+autoscaler_scale_total = Telemetry.metrics.counter("jupyterlab_autoscaler_scale_total",
+                                                   "Scaling decisions of the autoscaler by direction")
+
+
+# Function to get the base URL of a pod's JupyterLab on its pod IP, an endpoint function for autoscalers running
+# inside the cluster
+def get_pod_endpoint(pod) -> str:
+    return f"http://{pod['status']['podIP']}:{JUPYTERLAB_PORT}"
+
+
+# Function to parse a JupyterLab timestamp like 2022-11-01T10:00:00.123456Z into epoch seconds
+def parse_jupyter_timestamp(timestamp) -> float:
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+# Scales a cluster on the activity of its pods: kernels and sessions from each pod's JupyterLab REST API, and
+# CPU/memory usage from metrics.k8s.io. A pod is active if a kernel is busy or was used within idle_seconds, or
+# its CPU usage is above active_cpu_millicores. The target keeps active pods at target_utilization of the
+# cluster. Scale-up is immediate (after the up cooldown), scale-down follows the highest target of the
+# stabilization window and only removes pods without active kernels. An idle cluster scales to zero after
+# scale_to_zero_seconds when min_replicas is 0, and resume() brings it back. The JupyterLab APIs are reached
+# through the API server's pod proxy, so the autoscaler also works from outside the cluster; pass an endpoint_fn
+# (e.g. get_pod_endpoint) to call them directly instead
+class Autoscaler:
+    def __init__(self, deployment_client, min_replicas=AUTOSCALER_MIN_REPLICAS, max_replicas=AUTOSCALER_MAX_REPLICAS,
+                 target_utilization=AUTOSCALER_TARGET_UTILIZATION, idle_seconds=AUTOSCALER_IDLE_SECONDS,
+                 active_cpu_millicores=AUTOSCALER_ACTIVE_CPU_MILLICORES,
+                 scale_up_cooldown_seconds=AUTOSCALER_SCALE_UP_COOLDOWN_SECONDS,
+                 scale_down_cooldown_seconds=AUTOSCALER_SCALE_DOWN_COOLDOWN_SECONDS,
+                 scale_down_stabilization_seconds=AUTOSCALER_SCALE_DOWN_STABILIZATION_SECONDS,
+                 scale_to_zero_seconds=AUTOSCALER_SCALE_TO_ZERO_SECONDS, resume_replicas=AUTOSCALER_RESUME_REPLICAS,
+                 endpoint_fn=None, token=None, max_workers=AUTOSCALER_MAX_WORKERS):
+        self.deployment_client = deployment_client
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.target_utilization = target_utilization
+        self.idle_seconds = idle_seconds
+        self.active_cpu_millicores = active_cpu_millicores
+        self.scale_up_cooldown_seconds = scale_up_cooldown_seconds
+        self.scale_down_cooldown_seconds = scale_down_cooldown_seconds
+        self.scale_down_stabilization_seconds = scale_down_stabilization_seconds
+        self.scale_to_zero_seconds = scale_to_zero_seconds
+        self.resume_replicas = resume_replicas
+        # Optional pod -> base URL of its JupyterLab, to call it directly instead of through the pod proxy. The
+        # token is only sent on direct calls, through the proxy the request authenticates to the API server
+        self.endpoint_fn = endpoint_fn
+        self.max_workers = max_workers
+        self._headers = {"Authorization": f"token {token}"} if token else {}
+        self._http = urllib3.PoolManager(maxsize=max_workers)
+        self._lock = threading.Lock()
+        # (monotonic time, target) of recent evaluations, for the scale-down stabilization window
+        self._recommendations = collections.deque()
+        self._last_active = time.monotonic()
+        self._last_scale = float("-inf")
+        self._stopped = threading.Event()
+        self._thread = None
+        self.last_samples = {}
+        self.scale_ups = 0
+        self.scale_downs = 0
+
+    def _get_json(self, url):
+        response = self._http.request("GET", url, headers=self._headers, retries=False,
+                                      timeout=AUTOSCALER_HTTP_TIMEOUT_SECONDS)
+        if response.status != 200:
+            raise Exception(f"ERROR: GET {url} returned {response.status}\n")
+        return json.loads(response.data)
+
+    # Function to get a resource of a pod's JupyterLab REST API, e.g. "kernels"
+    def _get_api(self, pod, resource):
+        if self.endpoint_fn is not None:
+            return self._get_json(f"{self.endpoint_fn(pod)}/api/{resource}")
+        response = ClientRegistry.get_core_v1().connect_get_namespaced_pod_proxy_with_path(
+            f"{pod['metadata']['name']}:{JUPYTERLAB_PORT}", self.deployment_client.namespace, f"api/{resource}",
+            _preload_content=False, _request_timeout=AUTOSCALER_HTTP_TIMEOUT_SECONDS)
+        return json.loads(response.data)
+
+    # Function to get a pod's kernel and session activity from its JupyterLab REST API
+    def get_pod_activity(self, pod) -> dict:
+        try:
+            kernels = self._get_api(pod, "kernels")
+            sessions = self._get_api(pod, "sessions")
+        except Exception as e:
+            logging.debug(f"JupyterLab API of pod {pod['metadata']['name']} unreachable: {e}")
+            return {'reachable': False, 'kernels': 0, 'busy_kernels': 0, 'sessions': 0, 'last_activity': None}
+        activity = [parse_jupyter_timestamp(kernel['last_activity']) for kernel in kernels
+                    if kernel.get('last_activity')]
+        return {'reachable': True, 'kernels': len(kernels),
+                'busy_kernels': sum(1 for kernel in kernels if kernel.get('execution_state') == "busy"),
+                'sessions': len(sessions), 'last_activity': max(activity) if activity else None}
+
+    # Function to check if a pod sample counts as active. Pods whose API cannot be reached count as active, so
+    # they are never picked for removal on missing data
+    def is_active(self, sample) -> bool:
+        if not sample['reachable'] or sample['busy_kernels'] > 0:
+            return True
+        if sample['last_activity'] is not None and time.time() - sample['last_activity'] < self.idle_seconds:
+            return True
+        return sample['cpu_millicores'] >= self.active_cpu_millicores
+
+    # Function to sample the activity and usage of every ready pod of the cluster, pod name -> sample
+    def collect(self) -> dict:
+        dc = self.deployment_client
+        label_selector = f"app={dc.deployment_name}"
+        informer = PodInformer.get_pod_informer(namespace=dc.namespace, label_selector=label_selector)
+        pods = [pod for pod in informer.get_pods() if PodInformer.is_pod_ready(pod)]
+        if not pods:
+            return {}
+        usage = KubernetesHelper.get_pod_usage(dc.namespace, label_selector)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(pods))) as executor:
+            activities = dict(zip([pod['metadata']['name'] for pod in pods],
+                                  executor.map(self.get_pod_activity, pods)))
+        samples = {}
+        for name, activity in activities.items():
+            cpu_millicores, memory_bytes = usage.get(name, (0.0, 0))
+            sample = dict(activity, cpu_millicores=cpu_millicores, memory_bytes=memory_bytes)
+            sample['active'] = self.is_active(sample)
+            if not sample['reachable'] and sample['cpu_millicores'] < self.active_cpu_millicores:
+                logging.warning(f"Pod {name} of cluster {dc.deployment_name} counts as active only because its "
+                                f"JupyterLab API is unreachable, it is kept on scale-down")
+            samples[name] = sample
+        return samples
+
+    # Function to compute the replica count the samples call for, before cooldowns and stabilization
+    def compute_target(self, samples, now) -> int:
+        active_pods = sum(1 for sample in samples.values() if sample['active'])
+        if active_pods:
+            self._last_active = now
+        target = math.ceil(active_pods / self.target_utilization)
+        if target == 0 and now - self._last_active < self.scale_to_zero_seconds:
+            # Idle, but not for long enough to scale to zero
+            target = 1
+        return max(self.min_replicas, min(self.max_replicas, target))
+
+    # Function to pick up to count pods to remove: pods without kernels first, then the longest idle, then the
+    # ones using the least memory. Active pods are never picked
+    @staticmethod
+    def get_pods_to_remove(samples, count) -> list:
+        idle_pods = [(sample['kernels'] + sample['sessions'], sample['last_activity'] or 0.0, sample['memory_bytes'],
+                      name) for name, sample in samples.items() if not sample['active']]
+        return [name for *_, name in sorted(idle_pods)[:max(0, count)]]
+
+    # Function to evaluate the cluster once and scale it if needed, returns the replica count afterwards
+    def evaluate_once(self) -> int:
+        with self._lock:
+            dc = self.deployment_client
+            current = int(dc.replica_count)
+            if current == 0:
+                # A cluster scaled to zero has nothing to sample, it comes back through resume()
+                return 0
+            now = time.monotonic()
+            samples = self.collect()
+            self.last_samples = samples
+            target = self.compute_target(samples, now)
+            self._recommendations.append((now, target))
+            while self._recommendations[0][0] < now - self.scale_down_stabilization_seconds:
+                self._recommendations.popleft()
+            logging.debug(f"Autoscaler of cluster {dc.deployment_name}: {current} replicas, target {target}, "
+                          f"{sum(1 for s in samples.values() if s['active'])}/{len(samples)} pods active")
+
+            if target > current:
+                if now - self._last_scale < self.scale_up_cooldown_seconds:
+                    return current
+                return self._scale(target, "up")
+            stabilized = max(recommendation for _, recommendation in self._recommendations)
+            if stabilized >= current or now - self._last_scale < self.scale_down_cooldown_seconds:
+                return current
+            pods_to_remove = self.get_pods_to_remove(samples, current - stabilized)
+            if not pods_to_remove:
+                return current
+            return self._scale(current - len(pods_to_remove), "down", pods_to_remove)
+
+    def _scale(self, replicas, direction, pods_to_remove=()) -> int:
+        dc = self.deployment_client
+        logging.debug(f"Autoscaler scaling cluster {dc.deployment_name} {direction} to {replicas} replicas, "
+                      f"removing {list(pods_to_remove)}")
+        with Telemetry.span("autoscale", cluster=dc.deployment_name, direction=direction) as span:
+            span['result'] = dc.scale_cluster(replicas, pods_to_remove=pods_to_remove)
+        self._last_scale = time.monotonic()
+        autoscaler_scale_total.inc(direction=direction, result="ok" if span['result'] else "failed")
+        if direction == "up":
+            self.scale_ups += 1
+        else:
+            self.scale_downs += 1
+        return int(dc.replica_count)
+
+    # Function to bring a cluster scaled to zero back, skipping the cooldowns. Warm pool pods and the
+    # cluster's stored desired packages make this much faster than a create_cluster
+    def resume(self, replicas=None) -> bool:
+        with self._lock:
+            dc = self.deployment_client
+            replicas = max(1, self.min_replicas, replicas or self.resume_replicas)
+            if int(dc.replica_count) >= replicas:
+                return True
+            self._recommendations.clear()
+            self._last_active = time.monotonic()
+            self._scale(replicas, "up")
+            return int(dc.replica_count) >= replicas
+
+    def stats(self) -> dict:
+        return {'cluster': self.deployment_client.deployment_name,
+                'replicas': int(self.deployment_client.replica_count),
+                'active_pods': sum(1 for sample in self.last_samples.values() if sample['active']),
+                'sampled_pods': len(self.last_samples), 'scale_ups': self.scale_ups,
+                'scale_downs': self.scale_downs}
+
+    def start(self, interval_seconds=AUTOSCALER_INTERVAL_SECONDS):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, args=[interval_seconds], daemon=True,
+                                            name=f"autoscaler-{self.deployment_client.deployment_name}")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def _run(self, interval_seconds):
+        while not self._stopped.is_set():
+            try:
+                self.evaluate_once()
+            except Exception as e:
+                logging.debug(f"Autoscaling of cluster {self.deployment_client.deployment_name} failed: {e}")
+            self._stopped.wait(interval_seconds)
@@ -0,0 +1,132 @@
+import argparse
+import json
+import logging
+import math
+import tempfile
+import threading
+import time
+
+import ClientRegistry
+import DeploymentClient
+import FakeApiServer
+
+
+def _percentile(samples, percent) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(len(ordered) * percent / 100) - 1)] if ordered else 0.0
+
+
+# Samples the number of client-side threads (fake API server threads excluded) while an operation runs
+class ThreadSampler:
+    def __init__(self, interval_seconds=0.01):
+        self.interval_seconds = interval_seconds
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="benchmark-thread-sampler")
+
+    @staticmethod
+    def client_thread_count() -> int:
+        return sum(1 for t in threading.enumerate()
+                   if not t.name.startswith(("fake-api", "benchmark-")) and "process_request_thread" not in t.name)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, self.client_thread_count())
+            self._stopped.wait(self.interval_seconds)
+
+
+# Runs the cluster lifecycle against a FakeApiServer and records latency, API requests and threads per operation.
+# Cluster yaml files go to output_path, not to the repository's Output directory
+class Benchmark:
+    def __init__(self, server, output_path):
+        self.server = server
+        self.output_path = output_path
+        self.results = {}
+
+    def measure(self, operation, fn, *args, **kwargs):
+        requests_before = self.server.total_requests()
+        with ThreadSampler() as sampler:
+            start_time = time.perf_counter()
+            try:
+                result, failed = fn(*args, **kwargs), False
+            except Exception as e:
+                logging.warning(f"{operation} failed: {e}")
+                result, failed = None, True
+            elapsed = time.perf_counter() - start_time
+        samples = self.results.setdefault(operation, {'latency': [], 'requests': [], 'threads': [], 'failures': 0})
+        samples['latency'].append(elapsed)
+        samples['requests'].append(self.server.total_requests() - requests_before)
+        samples['threads'].append(sampler.peak)
+        samples['failures'] += int(failed or result is False)
+        return result
+
+    def run_lifecycle(self, namespace, deployment_name, pod_count, timeout_seconds):
+        dc = DeploymentClient.DeploymentClient(deployment_name, namespace, pod_count, "jupyterlab:benchmark",
+                                               output_path=self.output_path)
+        self.measure("create_cluster", dc.create_cluster, timeout_seconds=timeout_seconds)
+        self.measure("install_python_package_in_cluster", dc.install_python_package_in_cluster, "pandas==1.5.1")
+        self.measure("get_python_package_present_in_cluster", dc.get_python_package_present_in_cluster, "pandas")
+        self.measure("scale_cluster", dc.scale_cluster, pod_count * 2, timeout_seconds=timeout_seconds)
+        self.measure("delete_cluster", dc.delete_cluster)
+
+    def report(self) -> dict:
+        return {operation: {'p50_seconds': _percentile(samples['latency'], 50),
+                            'p95_seconds': _percentile(samples['latency'], 95),
+                            'p99_seconds': _percentile(samples['latency'], 99),
+                            'api_requests_mean': sum(samples['requests']) / len(samples['requests']),
+                            'peak_threads': max(samples['threads']),
+                            'failures': samples['failures'], 'runs': len(samples['latency'])}
+                for operation, samples in self.results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster lifecycle benchmark against a local fake API server")
+    parser.add_argument("--pods", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--pending-seconds", type=float, default=0.5)
+    parser.add_argument("--exec-latency-seconds", type=float, default=0.01)
+    parser.add_argument("--pip-seconds-per-package", type=float, default=0.01)
+    parser.add_argument("--exec-failure-rate", type=float, default=0.0)
+    parser.add_argument("--api-failure-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=int, default=120)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    report = {}
+    for pod_count in args.pods:
+        server = FakeApiServer.FakeApiServer(pending_seconds=args.pending_seconds,
+                                             exec_latency_seconds=args.exec_latency_seconds,
+                                             pip_seconds_per_package=args.pip_seconds_per_package,
+                                             exec_failure_rate=args.exec_failure_rate,
+                                             api_failure_rate=args.api_failure_rate, seed=args.seed).start()
+        ClientRegistry.set_configuration(server.client_configuration())
+        with tempfile.TemporaryDirectory(prefix="jupyterlab-benchmark-") as output_path:
+            benchmark = Benchmark(server, output_path)
+            for iteration in range(args.iterations):
+                benchmark.run_lifecycle(f"bench-{pod_count}", f"jupyterlab-{iteration}", pod_count,
+                                        args.timeout_seconds)
+        report[pod_count] = benchmark.report()
+        server.stop()
+
+        print(f"\n{pod_count} pods, {args.iterations} iteration(s)")
+        print(f"{'operation':<40}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'requests':>10}{'threads':>9}{'failed':>8}")
+        for operation, row in report[pod_count].items():
+            print(f"{operation:<40}{row['p50_seconds']:>9.3f}{row['p95_seconds']:>9.3f}{row['p99_seconds']:>9.3f}"
+                  f"{row['api_requests_mean']:>10.1f}{row['peak_threads']:>9}{row['failures']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import contextlib
+import contextvars
+import threading
+
+from kubernetes import client, config
+
+from Automation.Constant.Constant import *
+
+_lock = threading.Lock()
+_configuration = None
+_api_client = None
+_core_v1 = None
+_apps_v1 = None
+_custom_objects = None
+_exec_clients = threading.local()
+_exec_client_count = 0
+_generation = 0
+# (API rate limiter, exec rate limiter) of the code running in the current context, see rate_limited
+_rate_limiters = contextvars.ContextVar("rate_limiters", default=(None, None))
+
+
+# API client that takes a token from the current context's rate limiter before every request. Exec streams go
+# through call_api too (stream() only swaps the transport underneath), so they are limited separately here
+class RateLimitedApiClient(client.ApiClient):
+    def call_api(self, resource_path, method, *args, **kwargs):
+        api_rate_limiter, exec_rate_limiter = _rate_limiters.get()
+        limiter = exec_rate_limiter if resource_path.endswith("/exec") else api_rate_limiter
+        if limiter is not None:
+            limiter.acquire()
+        return super().call_api(resource_path, method, *args, **kwargs)
+
+
+# Context manager limiting the API calls and exec streams made within it with the given rate limiters (objects
+# with an acquire() method). Other threads are not limited, except tasks started with a copy of this context
+# (ExecEngine does that)
+@contextlib.contextmanager
+def rate_limited(api_rate_limiter=None, exec_rate_limiter=None):
+    token = _rate_limiters.set((api_rate_limiter, exec_rate_limiter))
+    try:
+        yield
+    finally:
+        _rate_limiters.reset(token)
+
+
+# Function to load the kubeconfig once per process, with a connection pool sized for our fan-out
+def get_configuration() -> client.Configuration:
+    global _configuration
+    with _lock:
+        if _configuration is None:
+            configuration = client.Configuration()
+            config.load_kube_config(client_configuration=configuration)
+            configuration.connection_pool_maxsize = API_CONNECTION_POOL_MAXSIZE
+            _configuration = configuration
+        return _configuration
+
+
+# Function to use the given configuration instead of the kubeconfig, e.g. to point every client at a local
+# stand-in API server. Clients handed out before keep their old configuration
+def set_configuration(configuration):
+    global _configuration, _api_client, _core_v1, _apps_v1, _custom_objects, _generation
+    with _lock:
+        configuration.connection_pool_maxsize = API_CONNECTION_POOL_MAXSIZE
+        _configuration = configuration
+        _api_client, _core_v1, _apps_v1, _custom_objects = None, None, None, None
+        _generation += 1
+
+
+# Function to get the process-wide API client, whose urllib3 pool is shared by every caller
+def get_api_client() -> client.ApiClient:
+    global _api_client
+    configuration = get_configuration()
+    with _lock:
+        if _api_client is None:
+            _api_client = RateLimitedApiClient(configuration)
+        return _api_client
+
+
+def get_core_v1() -> client.CoreV1Api:
+    global _core_v1
+    api_client = get_api_client()
+    with _lock:
+        if _core_v1 is None:
+            _core_v1 = client.CoreV1Api(api_client)
+        return _core_v1
+
+
+def get_apps_v1() -> client.AppsV1Api:
+    global _apps_v1
+    api_client = get_api_client()
+    with _lock:
+        if _apps_v1 is None:
+            _apps_v1 = client.AppsV1Api(api_client)
+        return _apps_v1
+
+
+def get_custom_objects() -> client.CustomObjectsApi:
+    global _custom_objects
+    api_client = get_api_client()
+    with _lock:
+        if _custom_objects is None:
+            _custom_objects = client.CustomObjectsApi(api_client)
+        return _custom_objects
+
+
+# Function to get a CoreV1Api for kubernetes.stream.stream exec calls, one per thread. stream() swaps the
+# api client's request method for the duration of the call, so it must not share a client across threads
+def get_exec_core_v1() -> client.CoreV1Api:
+    global _exec_client_count
+    core_v1 = getattr(_exec_clients, 'core_v1', None)
+    if core_v1 is None or _exec_clients.generation != _generation:
+        core_v1 = client.CoreV1Api(RateLimitedApiClient(get_configuration()))
+        _exec_clients.core_v1 = core_v1
+        _exec_clients.generation = _generation
+        with _lock:
+            _exec_client_count += 1
+    return core_v1
+
+
+# Function to get connection pool usage of the shared API client
+def get_pool_stats() -> dict:
+    pools = []
+    if _api_client is not None:
+        pool_manager = _api_client.rest_client.pool_manager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({'host': pool.host, 'port': pool.port, 'maxsize': pool.pool.maxsize if pool.pool else 0,
+                          'idle_connections': pool.pool.qsize() if pool.pool else 0,
+                          'connections_opened': pool.num_connections, 'requests': pool.num_requests})
+    return {'pool_maxsize': API_CONNECTION_POOL_MAXSIZE, 'exec_clients': _exec_client_count, 'pools': pools}
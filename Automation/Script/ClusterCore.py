@@ -0,0 +1,197 @@
+import logging
+
+import ClientRegistry
+import EnvironmentReconciler
+import KubernetesHelper
+import PodInformer
+import StateStore
+from Automation.Constant.Constant import *
+
+
+# Function to get the warm pool pods claimed by a cluster among its pods. Pods that terminated (e.g. evicted) are
+# not counted, nothing restarts them
+def get_claimed_pods(deployment_name, pods) -> list:
+    return [pod['metadata']['name'] for pod in pods
+            if pod['metadata']['labels'].get(WARM_POOL_CLAIMED_LABEL) == deployment_name
+            and not pod['metadata'].get('deletionTimestamp') and not PodInformer.is_pod_terminated(pod)]
+
+
+# Function to plan a scale to new_replica_count of a cluster running claimed_pods next to its deployment's pods.
+# Claimed pods picked for removal, and those beyond the new count, are deleted; the deployment's own pods picked
+# for removal get the lowest deletion cost. Returns (claimed pods to delete, pods to remove first, deployment
+# replicas)
+def plan_scale(new_replica_count, claimed_pods, pods_to_remove=()) -> tuple:
+    claimed_pods = list(claimed_pods)
+    pods_to_delete, pods_to_remove_first = [], []
+    for pod_name in pods_to_remove:
+        if pod_name in claimed_pods:
+            pods_to_delete.append(pod_name)
+            claimed_pods.remove(pod_name)
+        else:
+            pods_to_remove_first.append(pod_name)
+    pods_to_delete.extend(claimed_pods[int(new_replica_count):])
+    claimed_pods = claimed_pods[:int(new_replica_count)]
+    return pods_to_delete, pods_to_remove_first, int(new_replica_count) - len(claimed_pods)
+
+
+# State of one cluster and the decisions shared by DeploymentClient and AsyncDeploymentClient: the stored
+# cluster state, the desired package set and the packages ConfigMap pods install it from, the requirements pods
+# install from the wheelhouse, warm pool claims and the bookkeeping of reconcile passes. The clients only differ
+# in how they reach the API server and the pods
+class ClusterCore:
+    def __init__(self, deployment_name, namespace, replica_count, image, is_active=False, wheelhouse=None,
+                 warm_pool=None, state_store=None, api_server=None):
+        # API server the cluster runs on, the cluster state is stored under it
+        self.api_server = api_server or ClientRegistry.get_configuration().host
+        self.deployment_name = deployment_name
+        self.namespace = namespace
+        self.replica_count = replica_count
+        self.image = image
+        self.is_active = is_active
+        # Optional Wheelhouse.Wheelhouse, pods then install offline from its in-cluster index
+        self.wheelhouse = wheelhouse
+        # Image derived from self.image with the cluster's packages baked in, set by freeze_cluster. The
+        # reconciler takes the frozen packages as the inventory of pods running it
+        self.frozen_image = None
+        self.frozen_packages = []
+        # Package set every pod of the cluster should have, pods install it when they start (see
+        # save_packages_configmap) and reconcile passes catch up running ones. None until it is read from the
+        # cluster, see get_desired_packages
+        self.desired_packages = None
+        # Optional WarmPool.WarmPool of self.image, create and scale claim pre-started pods from it
+        self.warm_pool = warm_pool
+        # Names of the warm pool pods claimed by the cluster, see get_lost_claimed_pods
+        self.claimed_pods = set()
+        self.reconcile_state = EnvironmentReconciler.ReconcileState()
+        # StateStore.StateStore the cluster state is kept in, by default the process-wide one if configured
+        self.state_store = state_store or StateStore.get_state_store()
+        self.restore_state()
+
+    # Function to start from the stored state of an active cluster, instead of rediscovering it from the pods
+    def restore_state(self) -> bool:
+        if not self.refresh_state():
+            return False
+        logging.debug(f"Cluster {self.deployment_name} restored from the state store: {self.replica_count} replicas "
+                      f"of {self.image}, desired packages {self.desired_packages}")
+        return True
+
+    # Function to take the stored state of an active cluster, so long-lived clients pick up what other processes
+    # changed since (scaling, installs, image updates). Returns False when there is none
+    def refresh_state(self) -> bool:
+        if self.state_store is None:
+            return False
+        cluster = self.state_store.get_cluster(self.api_server, self.namespace, self.deployment_name)
+        if cluster is None or not cluster['is_active']:
+            return False
+        self.is_active = True
+        self.replica_count = cluster['replica_count']
+        self.image = cluster['image']
+        self.frozen_image = cluster['frozen_image']
+        self.frozen_packages = cluster['frozen_packages'] or []
+        self.desired_packages = cluster['desired_packages']
+        return True
+
+    # Function to record the given cluster fields in the state store, when there is one
+    def save_state(self, **fields):
+        if self.state_store is not None:
+            self.state_store.save_cluster(self.api_server, self.namespace, self.deployment_name, **fields)
+
+    # Function to use packages, read from the cluster's pods, as the desired package set
+    def seed_desired_packages(self, packages):
+        self.desired_packages = packages
+        self.save_state(desired_packages=self.desired_packages)
+
+    # Function to add a package to the desired package set, returns the new set
+    def add_desired_package(self, package) -> list:
+        if self.state_store is None:
+            self.desired_packages = EnvironmentReconciler.add_desired_package(self.desired_packages or [], package)
+        else:
+            # Atomic in the store, so packages added by other processes meanwhile are kept
+            self.desired_packages = self.state_store.update_desired_packages(
+                self.api_server, self.namespace, self.deployment_name,
+                lambda stored: EnvironmentReconciler.add_desired_package(
+                    (self.desired_packages or []) if stored is None else stored, package))
+        return self.desired_packages
+
+    # Function to build the packages into the wheelhouse, once for all the pods installing them
+    def prepare_wheelhouse(self, packages_list) -> bool:
+        if not self.wheelhouse.build(packages_list):
+            logging.debug(f"Unable to build wheels for {packages_list}")
+            return False
+        return True
+
+    # Function to get the pip install command, installing from the wheelhouse when one is configured
+    def get_pip_install_command(self) -> str:
+        if self.wheelhouse is None:
+            return "pip3 install"
+        return self.wheelhouse.pip_install_command()
+
+    # Function to get the requirements file installing packages_list in a pod. With a wheelhouse it pins every
+    # wheel to its hash, None when the wheelhouse has no wheels for them
+    def get_install_requirements(self, packages_list):
+        if self.wheelhouse is None:
+            return EnvironmentReconciler.get_requirements_file(packages_list)
+        requirements = self.wheelhouse.requirements_for(packages_list)
+        if requirements is None:
+            logging.debug(f"Wheelhouse has no wheels for {packages_list}")
+        return requirements
+
+    # Function to get the requirements file of the desired package set, the pods install it on every start
+    def get_packages_requirements(self) -> str:
+        packages_list = self.desired_packages or []
+        if not packages_list:
+            return ""
+        requirements = self.get_install_requirements(packages_list)
+        if requirements is None:
+            logging.debug(f"Pods of cluster {self.deployment_name} install {packages_list} from the index")
+            return EnvironmentReconciler.get_requirements_file(packages_list)
+        return requirements
+
+    # Function to render the cluster's objects from the template, with the desired package set in its packages
+    # ConfigMap
+    def render_cluster_yaml(self, replica_count) -> list:
+        properties_map = {'deployment_name': str(self.deployment_name), 'namespace': str(self.namespace),
+                          'replica_count': str(replica_count), 'image': str(self.image)}
+        logging.debug(f"Inputs to generate cluster k8s yaml: {properties_map}")
+        k8s_objects = KubernetesHelper.create_k8s_yaml(yaml_template_file=YAML_FILE_TEMPLATE,
+                                                       properties_map=properties_map)
+        KubernetesHelper.set_packages_requirements(k8s_objects, self.get_packages_requirements())
+        return k8s_objects
+
+    # Function to get the container fields and volumes of the cluster's pods a rollout carries along with the
+    # new image, so deployments created before pods installed their packages on start get it
+    def get_rollout_pod_fields(self) -> tuple:
+        pod_spec = next(obj for obj in self.render_cluster_yaml(self.replica_count)
+                        if obj['kind'] == "Deployment")['spec']['template']['spec']
+        container_fields = {key: pod_spec['containers'][0][key]
+                            for key in ("command", "args", "readinessProbe", "volumeMounts")}
+        return container_fields, pod_spec['volumes']
+
+    # Function to get the packages ConfigMap with the desired package set
+    def render_packages_configmap(self) -> dict:
+        return next(obj for obj in self.render_cluster_yaml(self.replica_count) if obj['kind'] == "ConfigMap")
+
+    # Function to check if count pods can be claimed from the warm pool. Pool pods started without the cluster's
+    # packages and are ready already, so they are only claimed while the cluster has none
+    def can_claim_warm_pods(self, count) -> bool:
+        return self.warm_pool is not None and count > 0 and self.warm_pool.image == self.image \
+            and self.warm_pool.namespace == self.namespace and not self.desired_packages
+
+    # Function to get the claimed pods that went away (evicted, deleted, node lost) among the cluster's pods.
+    # Claimed pods are bare pods, so nothing else replaces them. Claimed pods running now are tracked from here
+    # on, those claimed by other clients of the cluster included
+    def get_lost_claimed_pods(self, pods) -> list:
+        pods = {pod['metadata']['name']: pod for pod in pods}
+        self.claimed_pods.update(get_claimed_pods(self.deployment_name, pods.values()))
+        return sorted(name for name in self.claimed_pods
+                      if name not in pods or PodInformer.is_pod_terminated(pods[name]))
+
+    # Function to get the delta of the given ready pods known without their inventory: pods of the frozen image
+    # start with its packages, even after a restart, and only need their inventory when packages were added
+    # since the freeze. Returns pod name -> delta of the pods it is known for
+    def get_known_deltas(self, pods, desired_packages) -> dict:
+        if self.frozen_image is None or EnvironmentReconciler.compute_package_delta(
+                desired_packages, EnvironmentReconciler.get_frozen_package_map(self.frozen_packages)):
+            return {}
+        return {pod['metadata']['name']: [] for pod in pods
+                if pod['spec']['containers'][0].get('image') == self.frozen_image}
@@ -1,187 +1,437 @@
 import concurrent.futures
-import json
+import contextvars
 import logging
+import shlex
 import threading
 import time
+from datetime import datetime
 
-from kubernetes import client, config
-from kubernetes.stream import stream
-
+import ClusterCore
+import EnvironmentReconciler
+import ExecEngine
+import ImageFreezer
 import KubernetesHelper
+import PackageInventory
+import PodInformer
+import Telemetry
 import Utils
 from Automation.Constant.Constant import *
 
-logging.basicConfig(
-    filename=LOG_OUTPUT_PATH,
-    level=logging.DEBUG,
-    format='%(asctime)s %(lineno)d [%(threadName)s] %(levelname)s %(filename)s [%(funcName)s] %(message)s'
-)
-
-
-# Todo: 1) Require function to update deployment image
-
-class DeploymentClient:
-    def __init__(self, deployment_name, namespace, replica_count, image, is_active=False):
-        config.load_kube_config()
-        self.deployment_name = deployment_name
-        self.namespace = namespace
-        self.replica_count = replica_count
-        self.image = image
-        self.is_active = is_active
+rollout_pod_ready_seconds = Telemetry.metrics.histogram("jupyterlab_rollout_pod_ready_seconds",
+                                                        "Seconds from creation to Ready of pods started by a rollout")
+
+
+class DeploymentClient(ClusterCore.ClusterCore):
+    def __init__(self, deployment_name, namespace, replica_count, image, is_active=False, wheelhouse=None,
+                 warm_pool=None, state_store=None, output_path=OUTPUT_PATH):
+        super().__init__(deployment_name, namespace, replica_count, image, is_active=is_active, wheelhouse=wheelhouse,
+                         warm_pool=warm_pool, state_store=state_store)
+        self.reconciler = EnvironmentReconciler.EnvironmentReconciler(self)
+        # Held while scale_cluster changes the pod count, so lost claimed pods are not replaced halfway through
+        # (not even by the reconcile pass of the scaling itself)
+        self._scaling_lock = threading.Lock()
+        # Report of the last update_image: image, state, rolled_back, duration_seconds and pod_ready_seconds
+        self.last_rollout = None
+        # Directory the yaml of the created cluster is written to
+        self.output_path = output_path
+
+    # Function to get the JupyterLab container of a pod, the first one
+    def get_notebook_container(self, pod_name):
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        pod = informer.get_pod(pod_name)
+        return None if pod is None else pod['spec']['containers'][0]['name']
+
+    # Function to update the packages ConfigMap to the desired package set, pods starting from then on install it
+    def save_packages_configmap(self) -> bool:
+        if not KubernetesHelper.create_using_yaml([self.render_packages_configmap()], self.namespace):
+            logging.debug(f"Packages of cluster {self.deployment_name} could not be saved, restarted pods miss them")
+            return False
+        return True
+
+    # Function to wait until the deployment has exactly target_count Ready pods. Pods install the desired package
+    # set before they turn Ready, the ready pods are then given the packages added since they started. Fails when
+    # some pod could not get its packages
+    def wait_for_ready_pods(self, target_count, timeout_seconds) -> bool:
+        if not KubernetesHelper.wait_for_ready_pods(deployment_name=self.deployment_name, namespace=self.namespace,
+                                                    target_count=target_count, timeout_seconds=timeout_seconds):
+            return False
+        with Telemetry.span("install") as span:
+            self.install_python_package_after_scaling()
+            span['failed_pods'] = len(self.reconciler.failed_pods)
+            span['result'] = not self.reconciler.failed_pods
+        return span['result']
+
+    # Function to get the desired package set, seeded from the cluster's current packages on first use. Scale,
+    # install and update start here, so they also pick up the state other processes stored since
+    def get_desired_packages(self) -> list:
+        self.refresh_state()
+        if self.desired_packages is None:
+            packages = self.get_all_python_package_present_in_cluster()
+            if not packages:
+                # No ready pod to seed from (e.g. scaled to zero), seeded once the cluster has one
+                return []
+            self.seed_desired_packages(packages)
+            self.save_packages_configmap()
+        return self.desired_packages
+
+    # Function to get the warm pool pods claimed by the cluster, they run next to the deployment's own pods
+    def get_claimed_pods(self) -> list:
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        return ClusterCore.get_claimed_pods(self.deployment_name, informer.get_pods())
+
+    # Function to claim warm pods for the cluster, returns the names of the claimed pods
+    def claim_warm_pods(self, count) -> list:
+        if not self.can_claim_warm_pods(count):
+            return []
+        return self.warm_pool.claim(deployment_name=self.deployment_name, count=count)
+
+    # Function to hand the share of claimed pods that went away to the deployment, see get_lost_claimed_pods.
+    # Returns the number of replicas added
+    def replace_lost_claimed_pods(self) -> int:
+        if not self.is_active or not self._scaling_lock.acquire(blocking=False):
+            return 0
+        try:
+            informer = PodInformer.get_pod_informer(namespace=self.namespace,
+                                                    label_selector=f"app={self.deployment_name}")
+            pods = informer.get_pods()
+            lost_pods = self.get_lost_claimed_pods(pods)
+            if not lost_pods:
+                return 0
+            for pod in pods:
+                if pod['metadata']['name'] in lost_pods and not pod['metadata'].get('deletionTimestamp'):
+                    KubernetesHelper.delete_pod(pod['metadata']['name'], self.namespace)
+            replicas = KubernetesHelper.read_deployment(self.deployment_name, self.namespace)['spec'].get('replicas', 1)
+            logging.debug(f"Claimed pods {lost_pods} of cluster {self.deployment_name} are gone, "
+                          f"scaling its deployment to {replicas + len(lost_pods)} replicas")
+            KubernetesHelper.scale_deployment(deployment_name=self.deployment_name, namespace=self.namespace,
+                                              new_replica_count=replicas + len(lost_pods))
+            self.claimed_pods.difference_update(lost_pods)
+            return len(lost_pods)
+        finally:
+            self._scaling_lock.release()
 
     # Function to create python custer deployment
-    def create_cluster(self) -> bool:
-        # Both k8s deployment and service will get created from a single yaml file
-        properties_map = {'deployment_name': str(self.deployment_name), 'namespace': str(self.namespace),
-                          'replica_count': str(self.replica_count), 'image': str(self.image)}
-        logging.debug(f"Inputs to generate cluster k8s yaml: {properties_map}")
-
-        k8s_obj_yaml = KubernetesHelper.create_k8s_yaml(
-            yaml_template_file=YAML_FILE_TEMPLATE,
-            properties_map=properties_map
-        )
+    def create_cluster(self, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS) -> bool:
+        with Telemetry.span("create_cluster", cluster=self.deployment_name) as span:
+            span['result'] = self._create_cluster(timeout_seconds)
+            return span['result']
+
+    def _create_cluster(self, timeout_seconds) -> bool:
+        if self.desired_packages is None:
+            # The pods of a new cluster only have the image's packages
+            self.desired_packages = []
+        claimed_pods = self.claim_warm_pods(int(self.replica_count))
+        self.claimed_pods.update(claimed_pods)
+        # The packages config map, deployment and service will get created from a single yaml file, the
+        # deployment only launches the pods the warm pool could not provide
+        with Telemetry.span("render"):
+            k8s_obj_yaml = self.render_cluster_yaml(int(self.replica_count) - len(claimed_pods))
         logging.debug(f"Generated k8s yaml for the cluster creation: {str(k8s_obj_yaml)}")
 
-        if KubernetesHelper.create_using_yaml(k8s_obj_yaml, self.namespace):
+        with Telemetry.span("apply") as span:
+            span['result'] = KubernetesHelper.create_using_yaml(k8s_obj_yaml, self.namespace)
+        if span['result']:
+            if claimed_pods:
+                KubernetesHelper.set_pods_owner_to_deployment(self.deployment_name, self.namespace, claimed_pods)
             logging.debug(
                 f"Cluster {self.deployment_name} created, waiting for all pods to get into Running state")
-            timeout_minutes = 1
-            timeout = time.time() + 60 * timeout_minutes
-            start_time = time.perf_counter()
-
-            logging.debug(f"Timeout of {timeout_minutes} minute(s) before marking the cluster creation fail")
-            while True:
-                running_pods = self.get_running_pods_in_cluster()
-                logging.debug(f"Number of pods running: {running_pods}")
-                if running_pods == int(self.replica_count):
-                    logging.debug(f"Cluster {self.deployment_name} created successful")
-                    Utils.Utils.write_to_yaml_file(output_path=OUTPUT_PATH, output_file_name='jupyterlab.yaml',
-                                                   k8s_object_yaml=k8s_obj_yaml)
-                    logging.debug("Cluster creation yaml file is written to file")
-                    self.is_active = True
-                    return True
-                if time.time() > timeout:
-                    # Delete the wrongly created cluster
-                    logging.debug(f"Timeout of {timeout_minutes} completed, marking the cluster creation as failed")
-                    logging.debug(f"Cluster {self.deployment_name} creation failed")
-                    # Creating another thread apart from main thread, to delete the wrongly created cluster
-                    logging.debug("Launching another thread to delete wrongly created cluster")
-                    t = threading.Thread(target=self.delete_cluster, args=[True])
-                    t.start()
-                    t.join()
-                    return False
-                end_time = time.perf_counter()
-                logging.debug(
-                    f"Waiting for Deployment to become ready, {int(end_time - start_time)} seconds(s) elapsed, timeout is {1 * 60} seconds(s)...")
-                time.sleep(5)
+            logging.debug(f"Timeout of {timeout_seconds} second(s) before marking the cluster creation fail")
+            with Telemetry.span("wait_for_ready", target=self.replica_count) as span:
+                span['result'] = self.wait_for_ready_pods(self.replica_count, timeout_seconds)
+            if span['result']:
+                logging.debug(f"Cluster {self.deployment_name} created successful")
+                Utils.Utils.write_to_yaml_file(output_path=self.output_path, output_file_name='jupyterlab.yaml',
+                                               k8s_object_yaml=k8s_obj_yaml)
+                logging.debug("Cluster creation yaml file is written to file")
+                self.is_active = True
+                self.save_state(is_active=True, replica_count=int(self.replica_count), image=self.image,
+                                frozen_image=None, frozen_packages=[], desired_packages=self.desired_packages)
+                return True
+            # Delete the wrongly created cluster
+            logging.debug(f"Timeout of {timeout_seconds} second(s) completed, marking the cluster creation as failed")
+            logging.debug(f"Cluster {self.deployment_name} creation failed")
+            # Creating another thread apart from main thread, to delete the wrongly created cluster
+            logging.debug("Launching another thread to delete wrongly created cluster")
+            t = threading.Thread(target=self.delete_cluster, args=[True])
+            t.start()
+            t.join()
+            return False
         else:
             logging.debug(f"Cluster {self.deployment_name} creation failed")
             return False
 
-    # Function to scale python custer deployment
-    def scale_cluster(self, new_replica_count) -> bool:
+    # Function to scale python custer deployment, on scale-down the pods in pods_to_remove are removed first
+    def scale_cluster(self, new_replica_count, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS,
+                      pods_to_remove=()) -> bool:
+        with Telemetry.span("scale_cluster", cluster=self.deployment_name, replicas=new_replica_count) as span, \
+                self._scaling_lock:
+            span['result'] = self._scale_cluster(new_replica_count, timeout_seconds, pods_to_remove)
+            return span['result']
+
+    def _scale_cluster(self, new_replica_count, timeout_seconds, pods_to_remove) -> bool:
         logging.debug(f"Scaling cluster to {new_replica_count} nodes")
-        packages_list = self.get_all_python_package_present_in_cluster()
-        if KubernetesHelper.scale_deployment(
+        with Telemetry.span("inventory"):
+            self.get_desired_packages()
+        claimed_pods = self.get_claimed_pods()
+        new_claimed_pods = self.claim_warm_pods(int(new_replica_count) - int(self.replica_count))
+        if new_claimed_pods:
+            KubernetesHelper.set_pods_owner_to_deployment(self.deployment_name, self.namespace, new_claimed_pods)
+        self.claimed_pods.update(new_claimed_pods)
+        pods_to_delete, pods_to_remove_first, replicas = ClusterCore.plan_scale(
+            new_replica_count, claimed_pods + new_claimed_pods, pods_to_remove)
+        for pod_name in pods_to_delete:
+            KubernetesHelper.delete_pod(pod_name, self.namespace)
+            self.claimed_pods.discard(pod_name)
+        for pod_name in pods_to_remove_first:
+            KubernetesHelper.set_pod_deletion_cost(pod_name, self.namespace, POD_DELETION_COST_REMOVE)
+        with Telemetry.span("apply") as span:
+            span['result'] = KubernetesHelper.scale_deployment(
                 deployment_name=self.deployment_name,
                 namespace=self.namespace,
-                new_replica_count=new_replica_count):
-            # Timeout in the while loop
+                new_replica_count=replicas)
+        if span['result']:
             logging.debug(
                 f"Cluster {self.deployment_name} scaled, waiting for all new pods to get into Running state")
-            timeout_minutes = 1
-            timeout = time.time() + 60 * timeout_minutes
-            start_time = time.perf_counter()
-
-            logging.debug(f"Waiting for {timeout_minutes} minute(s) before marking the cluster scaling fail")
-            while True:
-                running_pods = self.get_running_pods_in_cluster()
-                logging.debug(f"Number of pods running: {running_pods}")
-                if running_pods == int(new_replica_count):
-                    logging.debug(f"Cluster {self.deployment_name} scaled successful")
-                    self.replica_count = new_replica_count
-                    # After successful scaling, install all python libraries in newly created pods
-                    self.install_python_package_after_scaling(packages_list=packages_list)
-                    return True
-                if time.time() > timeout:
-                    logging.debug(f"Timeout of {timeout_minutes} completed, marking the cluster scaling as failed")
-                    logging.debug(f"Cluster {self.deployment_name} scaling failed")
-                    return False
-                end_time = time.perf_counter()
-                logging.debug(
-                    f"Waiting to scale cluster {self.deployment_name}, {int(end_time - start_time)} seconds(s) elapsed, timeout is {1 * 60} seconds(s)...")
-                time.sleep(5)
+            logging.debug(f"Waiting for {timeout_seconds} second(s) before marking the cluster scaling fail")
+            # New pods install the cluster's python libraries before they turn Ready
+            with Telemetry.span("wait_for_ready", target=new_replica_count) as span:
+                span['result'] = self.wait_for_ready_pods(new_replica_count, timeout_seconds)
+            if span['result']:
+                logging.debug(f"Cluster {self.deployment_name} scaled successful")
+                self.replica_count = new_replica_count
+                self.save_state(replica_count=int(new_replica_count))
+                return True
+            logging.debug(f"Timeout of {timeout_seconds} second(s) completed, marking the cluster scaling as failed")
+            logging.debug(f"Cluster {self.deployment_name} scaling failed")
+            return False
         else:
             logging.debug(f"Cluster {self.deployment_name} scaling failed")
             return False
 
-    # Function to install list of python packages inside a pod
-    def install_python_packages_in_pod(self, pod_name, packages_list):
+    # Function to move the cluster to a new image without downtime. New pods are surged in next to the old ones
+    # and only turn ready once they installed the cluster's packages, old pods only go once enough
+    # replacements are available. The deployment is rolled back to its previous image if the rollout stops
+    # progressing
+    def update_image(self, image, max_surge=ROLLOUT_MAX_SURGE, max_unavailable=ROLLOUT_MAX_UNAVAILABLE,
+                     progress_deadline_seconds=ROLLOUT_PROGRESS_DEADLINE_SECONDS,
+                     timeout_seconds=ROLLOUT_TIMEOUT_SECONDS) -> bool:
+        with Telemetry.span("update_image", cluster=self.deployment_name, image=image) as span:
+            span['result'] = self._update_image(image, max_surge, max_unavailable, progress_deadline_seconds,
+                                                timeout_seconds)
+            return span['result']
+
+    def _update_image(self, image, max_surge, max_unavailable, progress_deadline_seconds, timeout_seconds) -> bool:
+        start_time = time.monotonic()
+        with Telemetry.span("inventory"):
+            self.get_desired_packages()
+        deployment = KubernetesHelper.read_deployment(self.deployment_name, self.namespace)
+        previous_image = next(container['image'] for container in deployment['spec']['template']['spec']['containers']
+                              if container['name'] == self.deployment_name)
+        previous_replicas = deployment['spec'].get('replicas', 1)
+        # Claimed warm pods keep the old image, the deployment takes over their share and they go once it is done
+        claimed_pods = self.get_claimed_pods()
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        pod_ready_seconds = {}
+
+        container_fields, volumes = self.get_rollout_pod_fields()
+        self.save_packages_configmap()
+
+        def is_rolled_out(pod) -> bool:
+            return PodInformer.is_pod_ready(pod) and any(container['image'] == image
+                                                         for container in pod['spec']['containers'])
+
+        # Called on every deployment change: records how long the new pods took to turn ready, which includes
+        # installing their packages
+        def on_update(_deployment):
+            for pod in informer.get_pods():
+                name = pod['metadata']['name']
+                if name in pod_ready_seconds or not is_rolled_out(pod):
+                    continue
+                created = datetime.strptime(pod['metadata']['creationTimestamp'], '%Y-%m-%dT%H:%M:%S%z')
+                pod_ready_seconds[name] = max(0.0, time.time() - created.timestamp())
+                rollout_pod_ready_seconds.observe(pod_ready_seconds[name])
+
+        logging.debug(f"Rolling cluster {self.deployment_name} from {previous_image} to {image}, "
+                      f"maxSurge {max_surge}, maxUnavailable {max_unavailable}")
+        with Telemetry.span("apply") as span:
+            span['result'] = KubernetesHelper.patch_deployment_rollout(
+                deployment_name=self.deployment_name, namespace=self.namespace, container_name=self.deployment_name,
+                image=image, replicas=int(self.replica_count), max_surge=max_surge, max_unavailable=max_unavailable,
+                progress_deadline_seconds=progress_deadline_seconds, container_fields=container_fields,
+                volumes=volumes)
+        with Telemetry.span("rollout") as span:
+            state = KubernetesHelper.wait_for_deployment_rollout(
+                deployment_name=self.deployment_name, namespace=self.namespace, timeout_seconds=timeout_seconds,
+                on_update=on_update)
+            span['result'] = state == "complete"
+        self.last_rollout = {'image': image, 'state': state, 'rolled_back': state != "complete",
+                             'duration_seconds': time.monotonic() - start_time, 'pod_ready_seconds': pod_ready_seconds}
+
+        if state == "complete":
+            # The pod cache can be an event behind the deployment status that completed the rollout
+            informer.wait_for(lambda pods: sum(map(is_rolled_out, pods)) >= int(self.replica_count),
+                              timeout_seconds=INFORMER_RETRY_SECONDS)
+            on_update(None)
+            with Telemetry.span("install"):
+                self.install_python_package_after_scaling()
+            with self._scaling_lock:
+                for pod_name in claimed_pods:
+                    KubernetesHelper.delete_pod(pod_name, self.namespace)
+                    self.claimed_pods.discard(pod_name)
+            if image != self.frozen_image:
+                # A frozen image was derived from the old image
+                self.frozen_image = None
+                self.frozen_packages = []
+            self.image = image
+            self.save_state(image=image, frozen_image=self.frozen_image, frozen_packages=self.frozen_packages)
+            logging.debug(f"Cluster {self.deployment_name} rolled out to {image} in "
+                          f"{self.last_rollout['duration_seconds']:.1f}s, pod ready seconds: {pod_ready_seconds}")
+            return True
+
+        logging.debug(f"Rollout of {image} on cluster {self.deployment_name} ended {state}, "
+                      f"rolling back to {previous_image}")
+        with Telemetry.span("rollback") as span:
+            KubernetesHelper.patch_deployment_rollout(
+                deployment_name=self.deployment_name, namespace=self.namespace, container_name=self.deployment_name,
+                image=previous_image, replicas=previous_replicas, max_surge=max_surge,
+                max_unavailable=max_unavailable, progress_deadline_seconds=progress_deadline_seconds,
+                container_fields=container_fields, volumes=volumes)
+            span['result'] = KubernetesHelper.wait_for_deployment_rollout(
+                deployment_name=self.deployment_name, namespace=self.namespace,
+                timeout_seconds=timeout_seconds) == "complete"
+        logging.debug(f"Rollback of cluster {self.deployment_name} to {previous_image} "
+                      f"{'completed' if span['result'] else 'failed'}")
+        return False
+
+    # Function to freeze the cluster's current packages into an image derived from self.image. The cluster keeps
+    # its image until update_image(frozen_image) rolls it over, after which new pods start with the packages
+    def freeze_cluster(self, image_builder, repository, context_dir) -> str:
+        packages_list = self.get_all_python_package_present_in_cluster()
+        logging.debug(f"Freezing {len(packages_list)} packages of cluster {self.deployment_name} into an image")
+        tag = ImageFreezer.freeze_image(image_builder=image_builder, repository=repository, base_image=self.image,
+                                        packages_list=packages_list, context_dir=context_dir)
+        if tag is None:
+            logging.debug(f"Cluster {self.deployment_name} freeze failed")
+            return None
+        self.frozen_image = tag
+        self.frozen_packages = packages_list
+        self.save_state(frozen_image=tag, frozen_packages=packages_list)
+        logging.debug(f"Cluster {self.deployment_name} frozen into image {tag}")
+        return tag
+
+    # Function to install list of python packages inside a pod, in a single pip invocation
+    def install_python_packages_in_pod(self, pod_name, packages_list) -> int:
         total_packages = len(packages_list)
-        installed_packages = 0
         logging.debug(f"{total_packages} packages needs to be installed in newly added pod {pod_name}")
-
-        for package in packages_list:
-            r = self.install_python_package_in_pod(pod_name=pod_name, package=package)
-            if r:
-                installed_packages = installed_packages + 1
+        if total_packages == 0:
+            return 0
+        with Telemetry.span("pod_install", pod=pod_name, packages=total_packages) as span:
+            span['installed'] = self._install_python_packages_in_pod(pod_name, packages_list)
+            span['result'] = span['installed'] == total_packages
+            return span['installed']
+
+    def _install_python_packages_in_pod(self, pod_name, packages_list) -> int:
+        total_packages = len(packages_list)
+        package_results = self.install_python_requirements_in_pod(pod_name=pod_name, packages_list=packages_list)
+        failed_packages = [package for package, installed in package_results.items() if not installed]
+        installed_packages = total_packages - len(failed_packages)
+        if failed_packages:
+            # Retry one by one only what the batched install could not confirm
+            logging.debug(f"Falling back to per-package install in pod {pod_name} for {failed_packages}")
+            for package in failed_packages:
+                if self.install_python_package_in_pod(pod_name=pod_name, package=package):
+                    installed_packages = installed_packages + 1
         logging.debug(f"{installed_packages}/{total_packages} python packages installed in pod {pod_name}")
+        return installed_packages
+
+    # Function to install a set of python packages inside a pod, sent as a requirements file over stdin. With a
+    # wheelhouse the file pins every wheel to its hash
+    def install_python_requirements_in_pod(self, pod_name, packages_list) -> dict:
+        requirements = self.get_install_requirements(packages_list)
+        if requirements is None:
+            return {package: False for package in packages_list}
+        # The file is created in the pod with mktemp, so installs from other threads, processes or hosts into the
+        # same pod never share it. head -c reads exactly the requirements from stdin, so the exec does not depend
+        # on stdin being closed
+        command = (f"requirements_file=$(mktemp) && head -c {len(requirements.encode())} > \"$requirements_file\" && "
+                   f"{self.get_pip_install_command()} -r \"$requirements_file\"; status=$?; "
+                   f"rm -f \"$requirements_file\"; exit $status")
+        logging.debug(f"Executing batched pip3 install of {len(packages_list)} packages inside the {pod_name}")
+        try:
+            stdout, stderr, returncode = ExecEngine.exec_in_pod(pod_name, self.namespace, ["/bin/sh", "-c", command],
+                                                                stdin=requirements,
+                                                                container=self.get_notebook_container(pod_name))
+        finally:
+            PackageInventory.get_package_inventory().invalidate(pod_name, self.namespace)
+
+        if stderr:
+            logging.debug(f"pip3 install stderr in pod {pod_name}: {stderr}")
+        package_results = Utils.Utils.extract_pip_install_results(packages_list, stdout)
+        logging.debug(f"Batched install in pod {pod_name} exited with {returncode}, results: {package_results}")
+        return package_results
 
     # Function to install a python package inside a pod
     def install_python_package_in_pod(self, pod_name, package) -> bool:
-        command = f"pip3 install {package}"
+        with Telemetry.span("pod_install", pod=pod_name, packages=1) as span:
+            span['result'] = self._install_python_package_in_pod(pod_name, package)
+            return span['result']
+
+    def _install_python_package_in_pod(self, pod_name, package) -> bool:
+        if self.wheelhouse is not None:
+            # Hash-pinned installs need a requirements file
+            return self.install_python_requirements_in_pod(pod_name=pod_name, packages_list=[package])[package]
+        command = f"{self.get_pip_install_command()} {shlex.quote(package)}"
         logging.debug(f"Executing {command} inside the {pod_name}")
-        v1 = client.CoreV1Api()
-        exec_command = ["/bin/sh", "-c", command]
-        resp = stream(v1.connect_get_namespaced_pod_exec,
-                      pod_name,
-                      self.namespace,
-                      command=exec_command,
-                      stderr=True, stdin=False,
-                      stdout=True, tty=False,
-                      _preload_content=False)
-
-        while resp.is_open():
-            resp.update(timeout=10)
-            if resp.peek_stdout():
-                # print(f"STDOUT: {resp.read_stdout()}")
-                pass
-            if resp.peek_stderr():
-                logging.debug(f"{resp.read_stderr()}")
-                if "ERROR" in resp.read_stderr():
-                    logging.debug(f"Package installation failed inside the pod {pod_name}")
-                    return False
-
-        resp.close()
-
-        if resp.returncode != 0:
+        try:
+            _, stderr, returncode = ExecEngine.exec_in_pod(pod_name, self.namespace, ["/bin/sh", "-c", command],
+                                                           container=self.get_notebook_container(pod_name))
+        finally:
+            PackageInventory.get_package_inventory().invalidate(pod_name, self.namespace)
+
+        if stderr:
+            logging.debug(stderr)
+        if "ERROR" in stderr:
+            logging.debug(f"Package installation failed inside the pod {pod_name}")
+            return False
+        if returncode != 0:
             logging.debug(f"Package {package} installation failed inside the pod {pod_name}")
             return False
         else:
             logging.debug(f"Package {package} installation succeeded inside the pod {pod_name}")
             return True
 
-    # Function to install python library in all pods of a kubernetes deployment
-    def install_python_package_in_cluster(self, package) -> tuple:
+    # Function to install python library in all running pods of a kubernetes deployment, yielding an
+    # ExecEngine.ExecResult per pod as soon as that pod is done. Pods not started when the iteration stops are skipped
+    def iter_install_python_package_in_cluster(self, package):
         logging.debug(f"Installing python package {package} in the cluster {self.deployment_name}")
-        pod_status_map = self.get_pods_and_status_of_deployment()
-        total_pods_count = len(pod_status_map)
-        pods_package_install_count = 0
-
-        logging.debug(f"Package needs to be installed in {total_pods_count} pods")
-        logging.debug(f"Creating multiple threads to install package for each pods")
+        self.get_desired_packages()
+        self.add_desired_package(package)
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        pod_nodes = {}
+        for pod in informer.get_pods():
+            if pod['status'].get('phase') == "Running":
+                pod_nodes[pod['metadata']['name']] = pod['spec'].get('nodeName')
+            else:
+                logging.debug(f"Pod {pod['metadata']['name']} is not in running status")
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            results = []
-            for pod_name in pod_status_map:
-                if pod_status_map[pod_name] == "Running":
-                    logging.debug(f"{pod_name} is in running state, installing python package inside it")
-                    results.append(executor.submit(self.install_python_package_in_pod, pod_name, package))
-                else:
-                    logging.debug(f"Pod {pod_name} is not in running status")
+        logging.debug(f"Package needs to be installed in {len(pod_nodes)} pods")
+        if self.wheelhouse is not None and not self.prepare_wheelhouse([package]):
+            logging.debug(f"Wheelhouse could not be prepared for {package}")
+            return
+        # Pods started or restarted from now on install it themselves
+        self.save_packages_configmap()
+        yield from ExecEngine.get_exec_engine().run(self.install_python_package_in_pod, list(pod_nodes), package,
+                                                    pod_nodes=pod_nodes)
 
-            for f in concurrent.futures.as_completed(results):
-                if f.result(): pods_package_install_count = pods_package_install_count + 1
+    # Function to install python library in all pods of a kubernetes deployment
+    def install_python_package_in_cluster(self, package) -> tuple:
+        total_pods_count = len(self.get_pods_and_status_of_deployment())
+        pods_package_install_count = 0
+        for result in self.iter_install_python_package_in_cluster(package):
+            if not result.ok:
+                logging.debug(f"{package} package install failed in pod {result.pod}: {result.error}")
+            elif result.value:
+                pods_package_install_count = pods_package_install_count + 1
 
         if pods_package_install_count == 0:
             logging.debug(
@@ -191,44 +441,19 @@ class DeploymentClient:
                 f"{package} package is installed in {pods_package_install_count}/{total_pods_count} Pods")
         return pods_package_install_count, total_pods_count
 
-    # Function to install python packages on newly launched pods after cluster scaling
-    def install_python_package_after_scaling(self, packages_list) -> None:
-        logging.debug(f"Python packages to be installed: {packages_list}")
-        newly_launched_pods = KubernetesHelper.get_newly_launched_pods(
-            deployment_name=self.deployment_name,
-            namespace=self.namespace)
-
-        logging.debug(f"Installing python packages in {len(newly_launched_pods)} newly launched pods")
-        logging.debug(f"Creating multiple threads to install packages in each pods")
-
-        with concurrent.futures.ThreadPoolExecutor() as executorPool:
-            for pod_name in newly_launched_pods:
-                executorPool.submit(self.install_python_packages_in_pod, pod_name, packages_list)
-
-        logging.debug(f"Python packages are installed in {newly_launched_pods} newly launched pods")
+    # Function to install the missing python packages on pods out of sync with the cluster, after cluster scaling
+    def install_python_package_after_scaling(self) -> dict:
+        logging.debug(f"Python packages desired in the cluster: {self.desired_packages}")
+        results = self.reconciler.reconcile_once()
+        logging.debug(f"Python packages installed per pod after scaling: {results}")
+        if self.reconciler.failed_pods:
+            logging.debug(f"Pods left out of sync after scaling: {self.reconciler.failed_pods}")
+        return results
 
     # Check pods and status of a kubernetes deployment
     def get_pods_and_status_of_deployment(self) -> dict:
-        pod_status_map = {}
-        response = client.CoreV1Api().list_namespaced_pod(
-            namespace=self.namespace,
-            label_selector=f"app={self.deployment_name}",
-            _preload_content=False
-        )
-        data = json.loads(response.data)
-        for obj in data['items']:
-            name = obj['metadata']['name']
-            status = obj['status']['phase']
-            pod_status_map[name] = status
-        return pod_status_map
-
-    # Function to get count of running pods in the deployment/cluster
-    def get_running_pods_in_cluster(self) -> int:
-        running_pods_count = 0
-        pod_status_map = self.get_pods_and_status_of_deployment()
-        for pod, status in pod_status_map.items():
-            if status == "Running": running_pods_count = running_pods_count + 1
-        return running_pods_count
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        return informer.get_pod_phases()
 
     # Function to get python package in the cluster, based upon a package name
     def get_python_package_present_in_cluster(self, package="") -> dict:
@@ -236,35 +461,24 @@ class DeploymentClient:
             logging.debug(f"Searching for all python packages in the cluster {self.deployment_name}")
         else:
             logging.debug(f"Searching for python package {package} in the cluster {self.deployment_name}")
-        pod_status_map = self.get_pods_and_status_of_deployment()
-        pod_name = list(pod_status_map.keys())[0]
-        if package == "":
-            logging.debug(f"All packages to be searched in pod {pod_name}")
-        else:
-            logging.debug(f"{package} to be searched in pod {pod_name}")
-        v1 = client.CoreV1Api()
-        command = f"pip3 list | grep -i '{package}'"
-        exec_command = ["/bin/sh", "-c", command]
-        resp = stream(v1.connect_get_namespaced_pod_exec,
-                      pod_name,
-                      self.namespace,
-                      command=exec_command,
-                      stderr=True, stdin=False,
-                      stdout=True, tty=False,
-                      _preload_content=False)
-
-        python_package_map = {}
-        while resp.is_open():
-            resp.update(timeout=10)
-            if resp.peek_stdout():
-                data = resp.read_stdout()
-                Utils.Utils.extract_python_packages_details(data, python_package_map)
-
-        resp.close()
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        ready_pods = [pod['metadata']['name'] for pod in informer.get_pods() if PodInformer.is_pod_ready(pod)]
+        if not ready_pods:
+            logging.debug(f"No ready pods in the cluster {self.deployment_name}")
+            return {}
+        return self.get_python_package_present_in_pod(pod_name=ready_pods[0], package=package)
+
+    # Function to get python packages in a pod whose name starts with package, from the package inventory
+    def get_python_package_present_in_pod(self, pod_name, package="") -> dict:
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
+        pod = informer.get_pod(pod_name)
+        if pod is None:
+            raise Exception(f"ERROR: Pod {pod_name} not found in the cluster {self.deployment_name}\n")
+        python_package_map = PackageInventory.get_package_inventory().find_packages(pod, self.namespace, package)
         if package == "":
-            logging.debug(f"Packages found: {python_package_map}")
+            logging.debug(f"Packages found in pod {pod_name}: {len(python_package_map)}")
         else:
-            logging.debug(f"Package searched: {package}, Matching packages found: {python_package_map}")
+            logging.debug(f"Package searched: {package}, Matching packages found in pod {pod_name}: {python_package_map}")
         return python_package_map
 
     # Function to get all python packages in the cluster
@@ -277,14 +491,32 @@ class DeploymentClient:
 
     # Function to delete the entire cluster
     def delete_cluster(self, skip_is_active_check=False) -> bool:
+        # Another process may have created or deleted the cluster since this client started
+        if self.state_store is not None:
+            cluster = self.state_store.get_cluster(self.api_server, self.namespace, self.deployment_name)
+            if cluster is not None:
+                self.is_active = cluster['is_active']
         if self.is_active or skip_is_active_check:
             logging.debug("Cluster is active, deleting it!!")
-            response_dep, response_svc = False, False
+            informer = PodInformer.get_pod_informer(namespace=self.namespace,
+                                                    label_selector=f"app={self.deployment_name}")
+            pod_names = list(informer.get_pod_phases())
+            response_dep, response_svc, response_cm = False, False, False
             with concurrent.futures.ThreadPoolExecutor() as executor:
-                response_dep = executor.submit(KubernetesHelper.delete_deployment, self.deployment_name, self.namespace)
-                response_svc = executor.submit(KubernetesHelper.delete_service, self.deployment_name, self.namespace)
-            if response_dep and response_svc:
+                response_dep = executor.submit(contextvars.copy_context().run, KubernetesHelper.delete_deployment,
+                                               self.deployment_name, self.namespace)
+                response_svc = executor.submit(contextvars.copy_context().run, KubernetesHelper.delete_service,
+                                               self.deployment_name, self.namespace)
+                response_cm = executor.submit(contextvars.copy_context().run, KubernetesHelper.delete_config_map,
+                                              f"{self.deployment_name}-packages", self.namespace)
+            if response_dep and response_svc and response_cm:
+                self.reconciler.stop()
+                for pod_name in pod_names:
+                    PackageInventory.get_package_inventory().invalidate(pod_name, self.namespace)
+                PodInformer.remove_pod_informer(namespace=self.namespace, label_selector=f"app={self.deployment_name}")
                 self.is_active = False
+                self.claimed_pods = set()
+                self.save_state(is_active=False, desired_packages=None)
                 logging.debug(f"Cluster {self.deployment_name} is deleted successfully")
                 return True
             else:
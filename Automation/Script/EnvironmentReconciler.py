@@ -0,0 +1,215 @@
+import logging
+import threading
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.version import InvalidVersion, Version
+
+import ExecEngine
+import PackageInventory
+import PodInformer
+import Utils
+from Automation.Constant.Constant import *
+
+
+# Function to get the requirements of the desired package set that are missing in a pod inventory, or whose
+# installed version the requirement's specifier does not allow (e.g. pandas>=1.5 with 1.0 installed)
+def compute_package_delta(desired_packages, python_package_map) -> list:
+    installed = {Utils.Utils.canonicalize_package_name(name): version for name, version in python_package_map.items()}
+    delta = []
+    for requirement in desired_packages:
+        try:
+            parsed_requirement = Requirement(requirement)
+        except InvalidRequirement:
+            # Not a plain specifier (e.g. a URL), only its presence can be checked
+            if Utils.Utils.requirement_name(requirement) not in installed:
+                delta.append(requirement)
+            continue
+        version = installed.get(Utils.Utils.canonicalize_package_name(parsed_requirement.name))
+        if version is None or not is_version_allowed(parsed_requirement.specifier, version):
+            delta.append(requirement)
+    return delta
+
+
+# Function to check if an installed version satisfies a specifier, versions pip cannot parse only satisfy an
+# empty one
+def is_version_allowed(specifier, version) -> bool:
+    try:
+        return specifier.contains(Version(version), prereleases=True)
+    except InvalidVersion:
+        return not specifier
+
+
+# Function to get the package inventory of an image a package list like ["pandas==1.5.3"] was frozen into
+def get_frozen_package_map(packages_list) -> dict:
+    return {name: version for name, _, version in (package.partition("==") for package in packages_list)}
+
+
+# Function to get the requirements file installing a package list, empty for an empty list
+def get_requirements_file(packages_list) -> str:
+    return "".join(f"{package}\n" for package in packages_list)
+
+
+# Function to get the desired package set with package added, replacing any requirement of the same package
+def add_desired_package(desired_packages, package) -> list:
+    package_name = Utils.Utils.requirement_name(package)
+    return [p for p in desired_packages if Utils.Utils.requirement_name(p) != package_name] + [package]
+
+
+# Function to get what identifies one run of a pod's containers: a new pod or a container restart starts over
+# from the image's packages
+def get_pod_generation(pod) -> tuple:
+    statuses = pod['status'].get('containerStatuses') or []
+    return pod['metadata']['uid'], sum(status.get('restartCount', 0) for status in statuses)
+
+
+# Bookkeeping of reconcile passes over the ready pods of a cluster, shared by the EnvironmentReconciler of
+# DeploymentClient and by AsyncDeploymentClient. A pod is re-checked only when it is new or its containers
+# restarted since it last converged
+class ReconcileState:
+    def __init__(self):
+        # pod name -> (uid, restart count, desired package set) the pod was last converged with
+        self.converged = {}
+        # pod name -> why the pod is not converged, from the last pass
+        self.failed_pods = {}
+        # pod name -> (uid, restart count) the last pass checked the pod at
+        self.checked = {}
+
+    # Function to start a pass over the ready pods, returns pod name -> state of the pods to check. Without
+    # desired packages there is nothing to check
+    def begin(self, ready_pods, desired_packages) -> dict:
+        pods = {pod['metadata']['name']: get_pod_generation(pod) + (desired_packages,) for pod in ready_pods}
+        self.failed_pods = {}
+        self.converged = {name: state for name, state in self.converged.items() if name in pods}
+        pending_pods = {name: state for name, state in pods.items() if self.converged.get(name) != state}
+        self.checked = {name: state[:2] for name, state in pending_pods.items()}
+        if not desired_packages:
+            self.converged.update(pending_pods)
+            return {}
+        return pending_pods
+
+    # Function to record the outcome of a pod: the number of packages of its delta installed, or the error that
+    # stopped it
+    def record(self, pod_name, state, delta, installed=0, error=None):
+        if error is not None:
+            self.failed_pods[pod_name] = error
+        elif installed == len(delta):
+            self.converged[pod_name] = state
+        else:
+            self.failed_pods[pod_name] = f"{installed}/{len(delta)} packages installed"
+
+    # Function to check if a ready pod has not converged since its containers last started. Pods that just
+    # failed are left to the next interval, unless their containers restarted since
+    def is_pending(self, pod) -> bool:
+        name, generation = pod['metadata']['name'], get_pod_generation(pod)
+        return PodInformer.is_pod_ready(pod) and self.converged.get(name, ())[:2] != generation \
+            and (name not in self.failed_pods or self.checked.get(name) != generation)
+
+
+# Converges every ready pod of a cluster to the cluster's desired package set, installing only the delta. Pods
+# install the desired set themselves whenever their containers start (see PACKAGES_REQUIREMENTS_KEY), so this only
+# catches up pods with packages added since. Passes run one at a time, whether they come from the background
+# thread or from scale, update or fleet operations
+class EnvironmentReconciler:
+    def __init__(self, deployment_client):
+        self.deployment_client = deployment_client
+        self.state = deployment_client.reconcile_state
+        # Names of the cluster's pods at the last pass, the inventories of pods gone since are dropped
+        self._pod_names = set()
+        self._lock = threading.Lock()
+        self._stopped = None
+        self._thread = None
+
+    # pod name -> why the pod is not converged, from the last reconcile
+    @property
+    def failed_pods(self) -> dict:
+        return self.state.failed_pods
+
+    # Function to reconcile all ready pods once, returns pod name -> number of packages installed
+    def reconcile_once(self) -> dict:
+        with self._lock:
+            return self._reconcile_once()
+
+    def _reconcile_once(self) -> dict:
+        dc = self.deployment_client
+        if dc.warm_pool is not None:
+            # Only clusters claiming from a warm pool have claimed pods
+            try:
+                dc.replace_lost_claimed_pods()
+            except Exception as e:
+                logging.debug(f"Replacing lost claimed pods of cluster {dc.deployment_name} failed: {e}")
+        desired_packages = tuple(sorted(dc.get_desired_packages()))
+        informer = PodInformer.get_pod_informer(namespace=dc.namespace, label_selector=f"app={dc.deployment_name}")
+        pods = informer.get_pods()
+        pod_names = {pod['metadata']['name'] for pod in pods}
+        for pod_name in self._pod_names - pod_names:
+            PackageInventory.get_package_inventory().invalidate(pod_name, dc.namespace)
+        self._pod_names = pod_names
+        # Pods not ready yet are still installing the desired set on their own
+        ready_pods = [pod for pod in pods if PodInformer.is_pod_ready(pod)]
+        pending_pods = self.state.begin(ready_pods, desired_packages)
+        if not pending_pods:
+            return {}
+        pod_nodes = {pod['metadata']['name']: pod['spec'].get('nodeName') for pod in ready_pods}
+        deltas = dc.get_known_deltas([pod for pod in ready_pods if pod['metadata']['name'] in pending_pods],
+                                     desired_packages)
+
+        pods_to_inventory = [name for name in pending_pods if name not in deltas]
+        logging.debug(f"Collecting package inventory of {len(pods_to_inventory)} pods in cluster {dc.deployment_name}")
+        engine = ExecEngine.get_exec_engine()
+        for result in engine.run(dc.get_python_package_present_in_pod, pods_to_inventory, pod_nodes=pod_nodes):
+            if result.ok:
+                deltas[result.pod] = compute_package_delta(desired_packages, result.value)
+            else:
+                self.state.record(result.pod, pending_pods[result.pod], None,
+                                  error=f"package inventory failed: {result.error}")
+        for name, delta in deltas.items():
+            if not delta:
+                self.state.record(name, pending_pods[name], delta)
+        pods_to_install = {name: delta for name, delta in deltas.items() if delta}
+
+        results = {}
+        if pods_to_install:
+            logging.debug(f"Package delta per pod in cluster {dc.deployment_name}: {pods_to_install}")
+            if dc.wheelhouse is not None:
+                all_missing = sorted({requirement for delta in pods_to_install.values() for requirement in delta})
+                if not dc.prepare_wheelhouse(all_missing):
+                    logging.debug("Wheelhouse could not be prepared, pods keep their current packages")
+                    for name in pods_to_install:
+                        self.state.record(name, pending_pods[name], None, error="wheelhouse could not be prepared")
+                    pods_to_install = {}
+            for result in engine.run(lambda name: dc.install_python_packages_in_pod(name, pods_to_install[name]),
+                                     list(pods_to_install), pod_nodes=pod_nodes):
+                name = result.pod
+                results[name] = result.value if result.ok else 0
+                self.state.record(name, pending_pods[name], pods_to_install[name], installed=results[name],
+                                  error=None if result.ok else f"install failed: {result.error}")
+        return results
+
+    # Function to keep reconciling in the background, so pods that started before packages were added converge
+    # without waiting for the next scale or update. A pass runs as soon as such a pod shows up, and at least every
+    # interval_seconds
+    def start(self, interval_seconds=RECONCILE_INTERVAL_SECONDS):
+        if self._thread is None:
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=[self._stopped, interval_seconds], daemon=True,
+                                            name=f"reconciler-{self.deployment_client.deployment_name}")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+        self._thread = None
+
+    def _run(self, stopped, interval_seconds):
+        dc = self.deployment_client
+        informer = PodInformer.get_pod_informer(namespace=dc.namespace, label_selector=f"app={dc.deployment_name}")
+        while not stopped.is_set():
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                logging.debug(f"Reconcile of cluster {dc.deployment_name} failed: {e}")
+                stopped.wait(interval_seconds)
+                continue
+            informer.wait_for(lambda pods: stopped.is_set() or any(self.state.is_pending(pod) for pod in pods),
+                              timeout_seconds=interval_seconds)
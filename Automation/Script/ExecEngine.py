@@ -0,0 +1,237 @@
+import collections
+import concurrent.futures
+import contextvars
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from kubernetes.stream import stream
+
+import ClientRegistry
+import Telemetry
+from Automation.Constant.Constant import *
+
+_local = threading.local()
+
+
+# Function to get the seconds left before the deadline of the engine task running on this thread, None when
+# the thread is not running one
+def time_left():
+    deadline = getattr(_local, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# Function to run a command in a pod over exec, returns (stdout, stderr, returncode). The exec is closed with a
+# TimeoutError after timeout_seconds, by default the time left of the engine task running it. container is
+# required for pods with more than one container
+def exec_in_pod(pod_name, namespace, command, stdin=None, timeout_seconds=None, container=None) -> tuple:
+    if timeout_seconds is None:
+        timeout_seconds = time_left()
+    deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+    kwargs = {} if container is None else {'container': container}
+    resp = stream(ClientRegistry.get_exec_core_v1().connect_get_namespaced_pod_exec,
+                  pod_name,
+                  namespace,
+                  command=command,
+                  stderr=True, stdin=stdin is not None,
+                  stdout=True, tty=False,
+                  _preload_content=False, **kwargs)
+    stdout, stderr = [], []
+    try:
+        if stdin is not None:
+            resp.write_stdin(stdin)
+        while resp.is_open():
+            remaining = 10 if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"ERROR: Exec in pod {pod_name} timed out after {timeout_seconds:.0f}s\n")
+            resp.update(timeout=min(10, remaining))
+            if resp.peek_stdout():
+                stdout.append(resp.read_stdout())
+            if resp.peek_stderr():
+                stderr.append(resp.read_stderr())
+    finally:
+        resp.close()
+    return "".join(stdout), "".join(stderr), resp.returncode
+
+
+# Outcome of one pod's task: the function's return value, or the exception of its last attempt
+class ExecResult:
+    def __init__(self, pod, value=None, error=None, attempts=1, seconds=0.0):
+        self.pod = pod
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        outcome = f"value={self.value!r}" if self.ok else f"error={self.error!r}"
+        return f"ExecResult(pod={self.pod!r}, {outcome}, attempts={self.attempts}, seconds={self.seconds:.3f})"
+
+
+# Fans a function out over pods with bounded parallelism: at most max_workers tasks in flight across every
+# caller of the engine, and at most max_per_node on the pods of one node (pods of unknown node are only held
+# to max_workers). A task that raises is retried with exponential backoff, and a task still running after
+# timeout_seconds is reported as timed out (functions using exec_in_pod stop on their own at that point), its
+# retry waits for it to finish. Results are yielded as each pod finishes
+class ExecEngine:
+    def __init__(self, max_workers=EXEC_MAX_WORKERS, max_per_node=EXEC_MAX_PER_NODE,
+                 timeout_seconds=EXEC_TIMEOUT_SECONDS, retries=EXEC_RETRIES, backoff_seconds=EXEC_BACKOFF_SECONDS,
+                 max_backoff_seconds=EXEC_MAX_BACKOFF_SECONDS):
+        self.max_workers = max_workers
+        self.max_per_node = max_per_node
+        self.timeout_seconds = timeout_seconds
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="exec-engine")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._node_in_flight = collections.Counter()
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.timed_out = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'in_flight': self._in_flight, 'peak_in_flight': self.peak_in_flight,
+                    'completed': self.completed, 'failed': self.failed, 'retried': self.retried,
+                    'timed_out': self.timed_out}
+
+    def _reserve(self, node) -> bool:
+        with self._lock:
+            if self._in_flight >= self.max_workers or \
+                    (node is not None and self._node_in_flight[node] >= self.max_per_node):
+                return False
+            self._in_flight += 1
+            if node is not None:
+                self._node_in_flight[node] += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            return True
+
+    def _release(self, node):
+        with self._lock:
+            self._in_flight -= 1
+            if node is not None:
+                self._node_in_flight[node] -= 1
+
+    @staticmethod
+    def _call(fn, pod, deadline, args, kwargs):
+        _local.deadline = deadline
+        try:
+            return fn(pod, *args, **kwargs)
+        finally:
+            _local.deadline = None
+
+    # Function to run fn(pod, *args, **kwargs) for every pod, yielding an ExecResult per pod as soon as it
+    # finishes. pod_nodes maps pods to nodes for the per-node limit. Closing the generator early cancels the
+    # pods not started yet
+    def run(self, fn, pods, *args, pod_nodes=None, timeout_seconds=None, retries=None, **kwargs):
+        pod_nodes = pod_nodes or {}
+        timeout_seconds = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        retries = self.retries if retries is None else retries
+        finished = queue.Queue()
+        # (time the pod may start, sequence, pod, attempt, start of its first attempt)
+        waiting = [(0.0, index, pod, 1, None) for index, pod in enumerate(pods)]
+        sequence = itertools.count(len(waiting))
+        # pod -> (future, attempt, deadline, start of its first attempt)
+        running = {}
+        # pod -> future of an attempt that timed out but has not finished yet
+        timed_out = {}
+        remaining = len(waiting)
+        try:
+            while remaining:
+                now = time.monotonic()
+                blocked = []
+                while waiting and waiting[0][0] <= now:
+                    entry = heapq.heappop(waiting)
+                    node = pod_nodes.get(entry[2])
+                    if entry[2] in timed_out or not self._reserve(node):
+                        blocked.append(entry)
+                        continue
+                    _, _, pod, attempt, first_start = entry
+                    deadline = now + timeout_seconds
+                    # Run in a copy of the caller's context, so the task keeps the caller's rate limiters
+                    future = self._executor.submit(contextvars.copy_context().run, self._call, fn, pod, deadline,
+                                                   args, kwargs)
+                    running[pod] = (future, attempt, deadline, first_start or now)
+                    future.add_done_callback(lambda f, pod=pod, node=node: (self._release(node),
+                                                                             finished.put((pod, f))))
+                for entry in blocked:
+                    heapq.heappush(waiting, entry)
+
+                # Sleep until a task finishes, the next deadline or retry is due, or a slot may have freed
+                wake_at = min([now + 60] + [deadline for _, _, deadline, _ in running.values()])
+                if blocked:
+                    wake_at = min(wake_at, now + EXEC_SLOT_POLL_SECONDS)
+                elif waiting:
+                    wake_at = min(wake_at, waiting[0][0])
+                try:
+                    pod, future = finished.get(timeout=max(0.0, wake_at - time.monotonic()))
+                    if pod not in running or running[pod][0] is not future:
+                        if timed_out.get(pod) is future:
+                            del timed_out[pod]
+                        continue
+                    _, attempt, _, first_start = running.pop(pod)
+                    error = future.exception()
+                    value = None if error is not None else future.result()
+                except queue.Empty:
+                    now = time.monotonic()
+                    expired = [pod for pod, (_, _, deadline, _) in running.items() if deadline <= now]
+                    if not expired:
+                        continue
+                    pod = expired[0]
+                    future, attempt, _, first_start = running.pop(pod)
+                    timed_out[pod] = future
+                    value, error = None, TimeoutError(f"ERROR: Task on pod {pod} timed out after {timeout_seconds}s\n")
+                    with self._lock:
+                        self.timed_out += 1
+
+                if error is not None and attempt <= retries:
+                    backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))
+                    logging.debug(f"Task on pod {pod} failed (attempt {attempt}), retrying in {backoff}s: {error}")
+                    heapq.heappush(waiting, (time.monotonic() + backoff, next(sequence), pod, attempt + 1,
+                                             first_start))
+                    with self._lock:
+                        self.retried += 1
+                    continue
+                remaining -= 1
+                with self._lock:
+                    self.completed += 1
+                    self.failed += int(error is not None)
+                yield ExecResult(pod, value=value, error=error, attempts=attempt,
+                                 seconds=time.monotonic() - first_start)
+        finally:
+            for future, _, _, _ in running.values():
+                future.cancel()
+
+
+_exec_engine = None
+_exec_engine_lock = threading.Lock()
+
+
+# Function to get the process-wide exec engine, so the limits hold across every cluster of the process
+def get_exec_engine() -> ExecEngine:
+    global _exec_engine
+    with _exec_engine_lock:
+        if _exec_engine is None:
+            _exec_engine = ExecEngine()
+        return _exec_engine
+
+
+def _engine_gauge(stat):
+    return lambda: _exec_engine.stats()[stat] if _exec_engine is not None else 0
+
+
+Telemetry.metrics.gauge("jupyterlab_exec_in_flight", "Pod tasks running in the exec engine", _engine_gauge('in_flight'))
+Telemetry.metrics.gauge("jupyterlab_exec_failed", "Pod tasks that failed after their retries", _engine_gauge('failed'))
+Telemetry.metrics.gauge("jupyterlab_exec_timed_out", "Pod task attempts that timed out", _engine_gauge('timed_out'))
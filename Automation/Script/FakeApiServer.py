@@ -0,0 +1,1068 @@
+import base64
+import collections
+import copy
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import queue
+import random
+import re
+import shlex
+import struct
+import tarfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from packaging.requirements import Requirement
+from packaging.version import Version
+
+from Automation.Constant.Constant import *
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+EVENT_HISTORY = 100000
+DEFAULT_PACKAGES = {'jupyterlab': '3.4.8', 'pip': '22.3', 'setuptools': '65.5.0', 'wheel': '0.37.1'}
+
+STDIN_CHANNEL, STDOUT_CHANNEL, STDERR_CHANNEL, ERROR_CHANNEL = 0, 1, 2, 3
+
+
+# Function to parse an equality-based label selector like "app=jupyterlab,tier=notebook"
+def parse_label_selector(label_selector) -> dict:
+    selector = {}
+    for requirement in filter(None, (label_selector or "").split(",")):
+        key, _, value = requirement.partition("=")
+        selector[key.strip()] = value.strip()
+    return selector
+
+
+# Function to get the name a "metadata.name=<name>" field selector asks for, None for any other selector
+def parse_name_field_selector(field_selector):
+    key, _, value = (field_selector or "").partition("=")
+    return value.strip() if key.strip() == "metadata.name" else None
+
+
+def _matches(obj, namespace, selector, name=None) -> bool:
+    labels = obj['metadata'].get('labels') or {}
+    return (obj['metadata']['namespace'] == namespace and name in (None, obj['metadata']['name'])
+            and all(labels.get(k) == v for k, v in selector.items()))
+
+
+def _template_hash(template) -> str:
+    return hashlib.sha256(json.dumps(template, sort_keys=True).encode()).hexdigest()[:10]
+
+
+# Function to resolve a rolling update maxSurge/maxUnavailable value, an integer or a percentage of replicas
+def _resolve_int_or_percent(value, replicas, round_up) -> int:
+    if isinstance(value, str) and value.endswith("%"):
+        scaled = replicas * int(value[:-1]) / 100
+        return math.ceil(scaled) if round_up else math.floor(scaled)
+    return int(value)
+
+
+def _deletion_cost(pod) -> int:
+    annotations = pod['metadata'].get('annotations') or {}
+    return int(annotations.get("controller.kubernetes.io/pod-deletion-cost", 0))
+
+
+def _is_running(pod) -> bool:
+    return pod['status']['phase'] == "Running"
+
+
+def _is_ready(pod) -> bool:
+    return any(condition['type'] == "Ready" and condition['status'] == "True"
+               for condition in pod['status'].get('conditions') or [])
+
+
+# Function to get the file a pod's readinessProbe checks with ["test", "-f", path], None without such a probe
+def _readiness_file(pod):
+    for container in pod['spec'].get('containers', []):
+        command = ((container.get('readinessProbe') or {}).get('exec') or {}).get('command') or []
+        if command[:2] == ["test", "-f"] and len(command) == 3:
+            return command[2]
+    return None
+
+
+def _canonical_name(name) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+# Function to get the version a fake pip install picks for a specifier: the lowest of the versions it mentions
+# (or just above them) and 1.0.0 that it allows
+def _pick_version(specifier) -> str:
+    mentioned = [spec.version for spec in specifier if "*" not in spec.version]
+    candidates = sorted(set(mentioned + [f"{version}.1" for version in mentioned] + ["1.0.0"]), key=Version)
+    return next((version for version in candidates if specifier.contains(version, prereleases=True)), "1.0.0")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Function to apply a JSON merge patch (null deletes a key), which also covers our strategic merge patches
+def merge_patch(target, patch):
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    target = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+    return target
+
+
+class ApiError(Exception):
+    def __init__(self, code, reason, message):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+
+
+# In-process stand-in for the parts of the Kubernetes API server the automation uses: pods (list, watch,
+# create, patch, delete, exec), services, config maps, deployments (create, read, patch, scale, delete) and pod
+# metrics from metrics.k8s.io. Deployments
+# launch pods that turn Running/Ready after pending_seconds (pods of unready_images never do), roll template
+# changes out within maxSurge/maxUnavailable and progressDeadlineSeconds, and pod execs run a scripted pip, ls
+# and tar. Containers started with the command of Template/jupyterlab.yaml install the requirements file of
+# their config map volume before their readinessProbe passes. Installs from a wheelhouse index (--find-links http://<service>.<namespace>.svc) only succeed with the
+# hash-pinned wheels that service's pods serve
+class FakeApiServer:
+    def __init__(self, pending_seconds=0.5, exec_latency_seconds=0.01, pip_seconds_per_package=0.01,
+                 exec_failure_rate=0.0, api_failure_rate=0.0, unavailable_packages=(), unready_images=(), node_count=4, seed=None):
+        self.pending_seconds = pending_seconds
+        self.exec_latency_seconds = exec_latency_seconds
+        self.pip_seconds_per_package = pip_seconds_per_package
+        self.exec_failure_rate = exec_failure_rate
+        self.api_failure_rate = api_failure_rate
+        self.unavailable_packages = set(unavailable_packages)
+        self.unready_images = set(unready_images)
+        self.node_count = node_count
+        self.random = random.Random(seed)
+        self.request_counts = collections.Counter()
+        self.pods = {}
+        self.deployments = {}
+        self.services = {}
+        self.config_maps = {}
+        self.pod_packages = {}
+        # image -> name -> version of the packages installed in the image on top of DEFAULT_PACKAGES, e.g. for
+        # images frozen in a test
+        self.image_packages = {}
+        # pod uid -> path -> content of the files created in the pod at runtime (touched by the container command,
+        # extracted from a tar or built by pip wheel), readinessProbes of the ["test", "-f"] kind check them
+        self.pod_files = {}
+        # (namespace, pod name) -> (cpu, memory) quantities reported by metrics.k8s.io, see set_pod_usage
+        self.pod_usage = {}
+        # FakeJupyterLabServer serving the JupyterLab of every pod, pods/{name}/proxy/{path} requests on the
+        # JupyterLab port go to it. Without one the proxy cannot reach any pod
+        self.jupyterlab = None
+        # (namespace, deployment name) -> (rollout state, monotonic time the state last changed)
+        self._rollout_progress = {}
+        self._lock = threading.RLock()
+        self._resource_version = itertools.count(1)
+        self._last_resource_version = 0
+        self._history = collections.deque(maxlen=EVENT_HISTORY)
+        self._watchers = []
+        self._timers = []
+        self._timer_sequence = itertools.count()
+        self._timer_condition = threading.Condition(self._lock)
+        self._stopped = False
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._threads = [threading.Thread(target=self._httpd.serve_forever, daemon=True, name="fake-api-server"),
+                         threading.Thread(target=self._run_timers, daemon=True, name="fake-api-timers")]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._timer_condition.notify_all()
+            for watcher in self._watchers:
+                watcher[2].put(None)
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # Function to get a kubernetes client Configuration pointing at this server
+    def client_configuration(self):
+        from kubernetes import client
+        configuration = client.Configuration()
+        configuration.host = self.url
+        return configuration
+
+    def total_requests(self) -> int:
+        return sum(self.request_counts.values())
+
+    # ---- object store and watch fan-out, callers hold self._lock ----
+
+    def _next_resource_version(self) -> str:
+        self._last_resource_version = next(self._resource_version)
+        return str(self._last_resource_version)
+
+    def _emit(self, kind, event_type, obj, previous=None):
+        obj['metadata']['resourceVersion'] = self._next_resource_version()
+        event = (int(obj['metadata']['resourceVersion']), kind, event_type, copy.deepcopy(obj), previous)
+        self._history.append(event)
+        for watcher in self._watchers:
+            self._deliver(watcher, event)
+
+    @staticmethod
+    def _deliver(watcher, event):
+        watch_kind, namespace, events, selector, name = watcher
+        _, kind, event_type, obj, previous = event
+        if kind != watch_kind:
+            return
+        now_matches = _matches(obj, namespace, selector, name)
+        was_matching = previous is not None and _matches(previous, namespace, selector, name)
+        if event_type == "DELETED":
+            if now_matches:
+                events.put(("DELETED", obj))
+        elif now_matches:
+            if previous is None:
+                events.put((event_type, obj))
+            else:
+                # A modified object that just entered the selector is new to the watcher
+                events.put(("MODIFIED" if was_matching else "ADDED", obj))
+        elif was_matching:
+            # The object left the selector, watchers see it as deleted
+            events.put(("DELETED", obj))
+
+    def _schedule(self, delay, action, *args):
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_sequence), action, args))
+        self._timer_condition.notify_all()
+
+    def _run_timers(self):
+        with self._lock:
+            while not self._stopped:
+                if not self._timers:
+                    self._timer_condition.wait()
+                    continue
+                due, _, action, args = self._timers[0]
+                remaining = due - time.monotonic()
+                if remaining > 0:
+                    self._timer_condition.wait(remaining)
+                    continue
+                heapq.heappop(self._timers)
+                action(*args)
+
+    def _create_pod(self, namespace, pod):
+        metadata = pod.setdefault('metadata', {})
+        if not metadata.get('name'):
+            metadata['name'] = f"{metadata.get('generateName', 'pod-')}{uuid.uuid4().hex[:5]}"
+        if (namespace, metadata['name']) in self.pods:
+            raise ApiError(409, "AlreadyExists", f"pods \"{metadata['name']}\" already exists")
+        metadata.update({'namespace': namespace, 'uid': str(uuid.uuid4()), 'creationTimestamp': _now()})
+        metadata.setdefault('labels', {})
+        spec = pod.setdefault('spec', {})
+        spec['nodeName'] = f"node-{self.random.randrange(self.node_count)}"
+        pod['status'] = {'phase': "Pending", 'conditions': [{'type': "Ready", 'status': "False"}],
+                         'containerStatuses': [{'name': c['name'], 'image': c.get('image', ""), 'imageID': "",
+                                                'restartCount': 0, 'started': False, 'ready': False}
+                                               for c in spec.get('containers', [])]}
+        self.pods[(namespace, metadata['name'])] = pod
+        self.pod_packages[metadata['uid']] = self._get_image_packages(pod)
+        self.pod_files[metadata['uid']] = {}
+        self._emit("Pod", "ADDED", pod)
+        if not self.unready_images.intersection(c.get('image') for c in spec.get('containers', [])):
+            self._schedule(self.pending_seconds, self._start_pod, namespace, metadata['name'], metadata['uid'])
+        return pod
+
+    def _start_pod(self, namespace, name, uid):
+        pod = self.pods.get((namespace, name))
+        if pod is None or pod['metadata']['uid'] != uid:
+            return
+        previous = copy.deepcopy(pod)
+        pod['status'].update({'phase': "Running", 'podIP': f"10.0.{self.random.randrange(256)}.{self.random.randrange(256)}"})
+        for status in pod['status']['containerStatuses']:
+            status['started'] = True
+        self._update_readiness(pod)
+        self._emit("Pod", "MODIFIED", pod, previous)
+        self._reconcile_owner_of(pod)
+        self._run_container_command(pod)
+
+    # Function to emulate the container command of Template/jupyterlab.yaml, which installs the requirements file
+    # of the pod's config map volume and then creates the file its readinessProbe checks. The install takes
+    # pip_seconds_per_package per requirement
+    def _run_container_command(self, pod):
+        readiness_file = _readiness_file(pod)
+        if readiness_file is None or f"touch {readiness_file}" not in " ".join(
+                pod['spec']['containers'][0].get('args') or []):
+            return
+        requirements_file = ""
+        for volume in pod['spec'].get('volumes') or []:
+            config_map = self.config_maps.get((pod['metadata']['namespace'], (volume.get('configMap') or {}).get('name')))
+            if config_map is not None:
+                requirements_file = "".join((config_map.get('data') or {}).values())
+        requirements = [line for line in requirements_file.split("\n") if line.strip() and not line.startswith("-")]
+        self._schedule(self.pip_seconds_per_package * len(requirements), self._finish_container_command,
+                       pod['metadata']['namespace'], pod['metadata']['name'], self._get_generation(pod),
+                       requirements_file, readiness_file)
+
+    def _finish_container_command(self, namespace, name, generation, requirements_file, readiness_file):
+        pod = self.pods.get((namespace, name))
+        if pod is None or self._get_generation(pod) != generation or not _is_running(pod):
+            return
+        _, _, exit_code = self._install_requirements(self.pod_packages[pod['metadata']['uid']], requirements_file,
+                                                     sleep=False)
+        if exit_code == 0:
+            self._touch(pod, [readiness_file])
+
+    @staticmethod
+    def _get_generation(pod) -> tuple:
+        return pod['metadata']['uid'], sum(status['restartCount'] for status in pod['status']['containerStatuses'])
+
+    # Function to set the Ready condition of a pod: Running, and the file its readinessProbe checks exists
+    def _update_readiness(self, pod):
+        readiness_file = _readiness_file(pod)
+        ready = _is_running(pod) and (readiness_file is None
+                                      or readiness_file in self.pod_files.get(pod['metadata']['uid'], ()))
+        pod['status']['conditions'] = [{'type': "Ready", 'status': "True" if ready else "False"}]
+        for status in pod['status']['containerStatuses']:
+            status['ready'] = ready
+
+    # Function to get the packages a pod's first container starts with
+    def _get_image_packages(self, pod) -> dict:
+        containers = pod['spec'].get('containers') or [{}]
+        return dict(DEFAULT_PACKAGES, **self.image_packages.get(containers[0].get('image'), {}))
+
+    def _delete_pod(self, namespace, name):
+        pod = self.pods.pop((namespace, name), None)
+        if pod is None:
+            raise ApiError(404, "NotFound", f"pods \"{name}\" not found")
+        self.pod_packages.pop(pod['metadata']['uid'], None)
+        self.pod_files.pop(pod['metadata']['uid'], None)
+        self._emit("Pod", "DELETED", pod)
+        self._reconcile_owner_of(pod)
+        return pod
+
+    # Function to set the CPU/memory usage metrics.k8s.io reports for a pod, e.g. ("250m", "512Mi")
+    def set_pod_usage(self, namespace, name, cpu, memory):
+        with self._lock:
+            self.pod_usage[(namespace, name)] = (cpu, memory)
+
+    # Function to restart the containers of a pod, the pod loses everything installed or created at runtime
+    def restart_pod(self, namespace, name):
+        with self._lock:
+            pod = self.pods[(namespace, name)]
+            previous = copy.deepcopy(pod)
+            for status in pod['status']['containerStatuses']:
+                status['restartCount'] += 1
+            self.pod_packages[pod['metadata']['uid']] = self._get_image_packages(pod)
+            self.pod_files[pod['metadata']['uid']] = {}
+            self._update_readiness(pod)
+            self._emit("Pod", "MODIFIED", pod, previous)
+            self._reconcile_owner_of(pod)
+            self._run_container_command(pod)
+
+    # Function to evict a pod as the kubelet would under node pressure: it stays around as Failed, never restarts
+    def evict_pod(self, namespace, name):
+        with self._lock:
+            pod = self.pods[(namespace, name)]
+            previous = copy.deepcopy(pod)
+            pod['status'].update({'phase': "Failed", 'reason': "Evicted"})
+            for status in pod['status']['containerStatuses']:
+                status['started'] = False
+            self._update_readiness(pod)
+            self._emit("Pod", "MODIFIED", pod, previous)
+            self._reconcile_owner_of(pod)
+
+    def _owned_pods(self, deployment):
+        uid = deployment['metadata']['uid']
+        return [pod for pod in self.pods.values()
+                if any(ref.get('uid') == uid and ref.get('controller') for ref in
+                       pod['metadata'].get('ownerReferences') or [])]
+
+    def _reconcile_owner_of(self, pod):
+        for ref in pod['metadata'].get('ownerReferences') or []:
+            if ref.get('controller') and ref.get('kind') == "Deployment":
+                deployment = self.deployments.get((pod['metadata']['namespace'], ref['name']))
+                if deployment is not None and deployment['metadata']['uid'] == ref['uid']:
+                    self._schedule(0, self._reconcile_deployment, pod['metadata']['namespace'], ref['name'])
+
+    # Function to converge a deployment's pods to its replica count and template, as the Deployment and
+    # ReplicaSet controllers would. Pods of an older template are replaced within maxSurge/maxUnavailable
+    def _reconcile_deployment(self, namespace, name):
+        deployment = self.deployments.get((namespace, name))
+        if deployment is None:
+            return
+        spec = deployment['spec']
+        replicas = int(spec.get('replicas', 1))
+        template = spec['template']
+        template_hash = _template_hash(template)
+        rolling_update = (spec.get('strategy') or {}).get('rollingUpdate') or {}
+        max_surge = _resolve_int_or_percent(rolling_update.get('maxSurge', "25%"), replicas, round_up=True)
+        max_unavailable = _resolve_int_or_percent(rolling_update.get('maxUnavailable', "25%"), replicas,
+                                                  round_up=False)
+        if max_surge == 0 and max_unavailable == 0:
+            max_surge = 1
+
+        pods = self._owned_pods(deployment)
+        new_pods = [pod for pod in pods if pod['metadata']['labels'].get('pod-template-hash') == template_hash]
+        for _ in range(min(replicas - len(new_pods), replicas + max_surge - len(pods))):
+            self._create_pod(namespace, {
+                'metadata': {'generateName': f"{name}-{template_hash}-",
+                             'labels': dict(template['metadata'].get('labels') or {},
+                                            **{'pod-template-hash': template_hash}),
+                             'ownerReferences': [{'apiVersion': "apps/v1", 'kind': "Deployment", 'name': name,
+                                                  'uid': deployment['metadata']['uid'], 'controller': True}]},
+                'spec': copy.deepcopy(template['spec'])})
+        pods = self._owned_pods(deployment)
+        new_pods = [pod for pod in pods if pod['metadata']['labels'].get('pod-template-hash') == template_hash]
+        old_pods = [pod for pod in pods if pod not in new_pods]
+        # Old pods go unready ones first, ready ones only while enough pods stay available
+        removable = sum(1 for pod in pods if _is_ready(pod)) - (replicas - max_unavailable)
+        for pod in sorted(old_pods, key=_is_ready):
+            if _is_ready(pod):
+                if removable <= 0:
+                    break
+                removable -= 1
+            self._delete_pod(namespace, pod['metadata']['name'])
+        # Excess pods go lowest pod-deletion-cost first, then newest first
+        for pod in sorted(new_pods, key=lambda p: (-_deletion_cost(p), p['metadata']['creationTimestamp']))[replicas:]:
+            self._delete_pod(namespace, pod['metadata']['name'])
+
+        pods = self._owned_pods(deployment)
+        updated = [pod for pod in pods if pod['metadata']['labels'].get('pod-template-hash') == template_hash]
+        ready = sum(1 for pod in pods if _is_ready(pod))
+        updated_ready = sum(1 for pod in updated if _is_ready(pod))
+        now = time.monotonic()
+        state = (template_hash, len(pods), len(updated), updated_ready)
+        last_state, since = self._rollout_progress.get((namespace, name), (None, now))
+        if state != last_state:
+            since = now
+            self._schedule(int(spec.get('progressDeadlineSeconds', 600)) + 0.01, self._reconcile_deployment,
+                           namespace, name)
+        self._rollout_progress[(namespace, name)] = (state, since)
+        if len(pods) == len(updated) == updated_ready == replicas:
+            progressing = {'type': "Progressing", 'status': "True", 'reason': "NewReplicaSetAvailable"}
+        elif now - since > int(spec.get('progressDeadlineSeconds', 600)):
+            progressing = {'type': "Progressing", 'status': "False", 'reason': "ProgressDeadlineExceeded"}
+        else:
+            progressing = {'type': "Progressing", 'status': "True", 'reason': "ReplicaSetUpdated"}
+        status = {'replicas': len(pods), 'readyReplicas': ready, 'availableReplicas': ready,
+                  'unavailableReplicas': max(0, replicas - ready), 'updatedReplicas': len(updated),
+                  'observedGeneration': deployment['metadata'].get('generation', 1), 'conditions': [progressing]}
+        if status != deployment.get('status'):
+            previous = copy.deepcopy(deployment)
+            deployment['status'] = status
+            self._emit("Deployment", "MODIFIED", deployment, previous)
+
+    def _collect_garbage(self, owner_uid):
+        for (namespace, name), pod in list(self.pods.items()):
+            if any(ref.get('uid') == owner_uid for ref in pod['metadata'].get('ownerReferences') or []):
+                self._delete_pod(namespace, name)
+
+    # ---- request handling ----
+
+    def handle(self, method, path, query, body):
+        if self.api_failure_rate and self.random.random() < self.api_failure_rate:
+            raise ApiError(500, "InternalError", "injected failure")
+        metrics_match = re.match(r"^/apis/metrics.k8s.io/v1beta1/namespaces/([^/]+)/pods$", path)
+        if metrics_match and method == "GET":
+            with self._lock:
+                return 200, self._list_pod_metrics(metrics_match.group(1), query)
+        proxy_match = re.match(r"^/api/v1/namespaces/([^/]+)/pods/([^/:]+)(?::(\d+))?/proxy/(.*)$", unquote(path))
+        if proxy_match and method == "GET":
+            return self._proxy_pod(*proxy_match.groups())
+        namespace_match = re.match(r"^/(?:api/v1|apis/apps/v1)/namespaces/([^/]+)/([^/]+)(?:/([^/]+))?(?:/([^/]+))?$",
+                                   path)
+        if namespace_match is None:
+            raise ApiError(404, "NotFound", f"{path} not found")
+        namespace, resource, name, subresource = namespace_match.groups()
+        with self._lock:
+            if resource == "pods":
+                return self._handle_pods(method, namespace, name, query, body)
+            if resource == "deployments":
+                return self._handle_deployments(method, namespace, name, subresource, body)
+            if resource == "services":
+                return self._handle_services(method, namespace, name, body)
+            if resource == "configmaps":
+                return self._handle_config_maps(method, namespace, name, body)
+        raise ApiError(404, "NotFound", f"{path} not found")
+
+    # Function to emulate the API server's pod proxy, forwarding the request to the pod's port
+    def _proxy_pod(self, namespace, name, port, path):
+        with self._lock:
+            self.request_counts["proxy Pod"] += 1
+            pod = self.pods.get((namespace, name))
+            if pod is None:
+                raise ApiError(404, "NotFound", f'pods "{name}" not found')
+            running = _is_running(pod)
+        if not running or self.jupyterlab is None or int(port or 80) != JUPYTERLAB_PORT:
+            raise ApiError(503, "ServiceUnavailable", f"error trying to reach service: dial tcp {name}:{port}")
+        return self.jupyterlab.get(name, f"/{path}")
+
+    def _list_pod_metrics(self, namespace, query):
+        selector = parse_label_selector(query.get('labelSelector', [""])[0])
+        self.request_counts["list PodMetrics"] += 1
+        items = []
+        for (pod_namespace, name), pod in self.pods.items():
+            if not _matches(pod, namespace, selector) or not _is_running(pod):
+                continue
+            cpu, memory = self.pod_usage.get((pod_namespace, name), ("1m", "100Mi"))
+            items.append({'metadata': {'name': name, 'namespace': namespace}, 'timestamp': _now(), 'window': "30s",
+                          'containers': [{'name': container['name'], 'usage': {'cpu': cpu, 'memory': memory}}
+                                         for container in pod['spec'].get('containers', [])][:1]})
+        return {'kind': "PodMetricsList", 'apiVersion': "metrics.k8s.io/v1beta1", 'metadata': {}, 'items': items}
+
+    # Server-side apply: creates the object if it does not exist yet, otherwise patches it
+    def apply(self, path, query, body):
+        namespace_match = re.match(
+            r"^(/(?:api/v1|apis/apps/v1)/namespaces/([^/]+)/(deployments|services|configmaps))/([^/]+)$", path)
+        if namespace_match is None:
+            raise ApiError(404, "NotFound", f"{path} not found")
+        collection_path, namespace, resource, name = namespace_match.groups()
+        with self._lock:
+            self.request_counts[f"apply {resource}"] += 1
+            exists = (namespace, name) in {'deployments': self.deployments, 'services': self.services,
+                                           'configmaps': self.config_maps}[resource]
+        if exists and resource == "services":
+            return 200, copy.deepcopy(self.services[(namespace, name)])
+        return self.handle("PATCH" if exists else "POST", path if exists else collection_path, query, body)
+
+    def _list(self, kind, objects, namespace, query):
+        selector = parse_label_selector(query.get('labelSelector', [""])[0])
+        name = parse_name_field_selector(query.get('fieldSelector', [""])[0])
+        self.request_counts[f"list {kind}"] += 1
+        return {'kind': f"{kind}List", 'apiVersion': "v1",
+                'metadata': {'resourceVersion': str(self._last_resource_version)},
+                'items': [copy.deepcopy(obj) for obj in objects if _matches(obj, namespace, selector, name)]}
+
+    def _handle_pods(self, method, namespace, name, query, body):
+        if name is None and method == "GET":
+            return 200, self._list("Pod", self.pods.values(), namespace, query)
+        if name is None and method == "POST":
+            self.request_counts["create Pod"] += 1
+            return 201, copy.deepcopy(self._create_pod(namespace, body))
+        pod = self.pods.get((namespace, name))
+        if pod is None:
+            raise ApiError(404, "NotFound", f"pods \"{name}\" not found")
+        if method == "GET":
+            self.request_counts["get Pod"] += 1
+            return 200, copy.deepcopy(pod)
+        if method == "PATCH":
+            self.request_counts["patch Pod"] += 1
+            expected_version = (body.get('metadata') or {}).get('resourceVersion')
+            if expected_version and expected_version != pod['metadata']['resourceVersion']:
+                raise ApiError(409, "Conflict", f"pods \"{name}\" has been modified")
+            previous = copy.deepcopy(pod)
+            patched = merge_patch(pod, body)
+            pod.clear()
+            pod.update(patched)
+            self._emit("Pod", "MODIFIED", pod, previous)
+            return 200, copy.deepcopy(pod)
+        if method == "DELETE":
+            self.request_counts["delete Pod"] += 1
+            return 200, copy.deepcopy(self._delete_pod(namespace, name))
+        raise ApiError(405, "MethodNotAllowed", method)
+
+    def _handle_deployments(self, method, namespace, name, subresource, body):
+        if name is None and method == "POST":
+            self.request_counts["create Deployment"] += 1
+            if (namespace, body['metadata']['name']) in self.deployments:
+                raise ApiError(409, "AlreadyExists", f"deployments \"{body['metadata']['name']}\" already exists")
+            body['metadata'].update({'namespace': namespace, 'uid': str(uuid.uuid4()), 'generation': 1,
+                                     'creationTimestamp': _now()})
+            self.deployments[(namespace, body['metadata']['name'])] = body
+            self._emit("Deployment", "ADDED", body)
+            self._reconcile_deployment(namespace, body['metadata']['name'])
+            return 201, copy.deepcopy(body)
+        deployment = self.deployments.get((namespace, name))
+        if deployment is None:
+            raise ApiError(404, "NotFound", f"deployments \"{name}\" not found")
+        if method == "GET":
+            self.request_counts["get Deployment"] += 1
+            return 200, copy.deepcopy(deployment)
+        if method == "PATCH":
+            self.request_counts[f"patch Deployment{'/' + subresource if subresource else ''}"] += 1
+            previous = copy.deepcopy(deployment)
+            patched = merge_patch(deployment, {'spec': body['spec']} if subresource == "scale" else body)
+            if 'template' in (body.get('spec') or {}):
+                # A strategic merge patch merges containers by name, keep the untouched container fields
+                containers = {c['name']: c for c in previous['spec']['template']['spec']['containers']}
+                for container in body['spec']['template'].get('spec', {}).get('containers', []):
+                    containers[container['name']] = merge_patch(containers.get(container['name']), container)
+                patched['spec']['template']['spec']['containers'] = list(containers.values())
+                patched['metadata']['generation'] = previous['metadata'].get('generation', 1) + 1
+            deployment.clear()
+            deployment.update(patched)
+            self._emit("Deployment", "MODIFIED", deployment, previous)
+            self._reconcile_deployment(namespace, name)
+            if subresource == "scale":
+                return 200, {'kind': "Scale", 'apiVersion': "autoscaling/v1", 'metadata': deployment['metadata'],
+                             'spec': {'replicas': deployment['spec']['replicas']}}
+            return 200, copy.deepcopy(deployment)
+        if method == "DELETE":
+            self.request_counts["delete Deployment"] += 1
+            del self.deployments[(namespace, name)]
+            self._rollout_progress.pop((namespace, name), None)
+            self._emit("Deployment", "DELETED", deployment)
+            self._collect_garbage(deployment['metadata']['uid'])
+            return 200, {'kind': "Status", 'apiVersion': "v1", 'status': "Success"}
+        raise ApiError(405, "MethodNotAllowed", method)
+
+    def _handle_services(self, method, namespace, name, body):
+        if name is None and method == "POST":
+            self.request_counts["create Service"] += 1
+            if (namespace, body['metadata']['name']) in self.services:
+                raise ApiError(409, "AlreadyExists", f"services \"{body['metadata']['name']}\" already exists")
+            body['metadata'].update({'namespace': namespace, 'uid': str(uuid.uuid4())})
+            self.services[(namespace, body['metadata']['name'])] = body
+            return 201, copy.deepcopy(body)
+        if method == "DELETE":
+            self.request_counts["delete Service"] += 1
+            if self.services.pop((namespace, name), None) is None:
+                raise ApiError(404, "NotFound", f"services \"{name}\" not found")
+            return 200, {'kind': "Status", 'apiVersion': "v1", 'status': "Success"}
+        raise ApiError(405, "MethodNotAllowed", method)
+
+    def _handle_config_maps(self, method, namespace, name, body):
+        if name is None and method == "POST":
+            self.request_counts["create ConfigMap"] += 1
+            if (namespace, body['metadata']['name']) in self.config_maps:
+                raise ApiError(409, "AlreadyExists", f"configmaps \"{body['metadata']['name']}\" already exists")
+            body['metadata'].update({'namespace': namespace, 'uid': str(uuid.uuid4())})
+            self.config_maps[(namespace, body['metadata']['name'])] = body
+            return 201, copy.deepcopy(body)
+        config_map = self.config_maps.get((namespace, name))
+        if config_map is None:
+            raise ApiError(404, "NotFound", f"configmaps \"{name}\" not found")
+        if method == "GET":
+            self.request_counts["get ConfigMap"] += 1
+            return 200, copy.deepcopy(config_map)
+        if method == "PATCH":
+            self.request_counts["patch ConfigMap"] += 1
+            patched = merge_patch(config_map, body)
+            config_map.clear()
+            config_map.update(patched)
+            return 200, copy.deepcopy(config_map)
+        if method == "DELETE":
+            self.request_counts["delete ConfigMap"] += 1
+            del self.config_maps[(namespace, name)]
+            return 200, {'kind': "Status", 'apiVersion': "v1", 'status': "Success"}
+        raise ApiError(405, "MethodNotAllowed", method)
+
+    # Function to register a watch, replaying the events after resource_version. Returns None if that
+    # resourceVersion is older than the retained history (the client has to re-list)
+    def open_watch(self, kind, namespace, query):
+        selector = parse_label_selector(query.get('labelSelector', [""])[0])
+        name = parse_name_field_selector(query.get('fieldSelector', [""])[0])
+        events = queue.Queue()
+        watcher = (kind, namespace, events, selector, name)
+        with self._lock:
+            self.request_counts[f"watch {kind}"] += 1
+            resource_version = int(query.get('resourceVersion', ["0"])[0] or 0)
+            if resource_version and self._history and resource_version < self._history[0][0] - 1:
+                return None
+            if resource_version:
+                for event in self._history:
+                    if event[0] > resource_version:
+                        self._deliver(watcher, event)
+            else:
+                for obj in (self.pods if kind == "Pod" else self.deployments).values():
+                    if _matches(obj, namespace, selector, name):
+                        events.put(("ADDED", copy.deepcopy(obj)))
+            self._watchers.append(watcher)
+        return watcher
+
+    def close_watch(self, watcher):
+        with self._lock:
+            if watcher in self._watchers:
+                self._watchers.remove(watcher)
+
+    # ---- scripted pod exec ----
+
+    def run_exec(self, namespace, pod_name, command, read_stdin) -> tuple:
+        self.request_counts["exec Pod"] += 1
+        with self._lock:
+            pod = self.pods.get((namespace, pod_name))
+            if pod is None or pod['status']['phase'] != "Running":
+                return "", f"error: unable to upgrade connection: pod {pod_name} not running", 1
+            packages = self.pod_packages[pod['metadata']['uid']]
+            files = self.pod_files[pod['metadata']['uid']]
+        time.sleep(self.exec_latency_seconds)
+        script = command[2] if command[:2] == ["/bin/sh", "-c"] else " ".join(command)
+        exit_code_marker = None
+        marker_match = re.search(r"; echo (\S+)\$\?$", script)
+        if marker_match:
+            exit_code_marker = marker_match.group(1)
+            script = script[:marker_match.start()]
+
+        stdin = b""
+        head_match = re.search(r"head -c (\d+)", script)
+        printf_match = re.search(r"printf '%s' ", script)
+        if head_match:
+            stdin = read_stdin(int(head_match.group(1)))
+        elif printf_match:
+            # Files written with printf take the place of stdin
+            stdin = shlex.split(script[printf_match.end():])[0].encode()
+
+        if self.exec_failure_rate and self.random.random() < self.exec_failure_rate:
+            stdout, stderr, exit_code = "", "ERROR: injected exec failure\n", 1
+        elif script.startswith("ls "):
+            directory = shlex.split(script)[1].rstrip("/") + "/"
+            with self._lock:
+                names = sorted(path[len(directory):] for path in files
+                               if path.startswith(directory) and "/" not in path[len(directory):])
+            stdout, stderr, exit_code = "".join(f"{name}\n" for name in names), "", 0
+        elif "tar xf -" in script:
+            directory = shlex.split(script[script.index(" -C ") + 4:])[0].rstrip("/")
+            with tarfile.open(fileobj=io.BytesIO(stdin)) as tar, self._lock:
+                for member in tar.getmembers():
+                    files[f"{directory}/{member.name}"] = tar.extractfile(member).read()
+            stdout, stderr, exit_code = "", "", 0
+        elif "pip3 wheel" in script:
+            stdout, stderr, exit_code = self._pip_wheel(files, script, stdin.decode())
+        elif "pip3 list --format=json" in script:
+            stdout, stderr, exit_code = json.dumps([{'name': n, 'version': v} for n, v in sorted(packages.items())]), "", 0
+        elif "pip3 list" in script:
+            grep_match = re.search(r"grep -i '([^']*)'", script)
+            needle = grep_match.group(1).lower() if grep_match else ""
+            lines = [f"{n:<30} {v}" for n, v in sorted(packages.items()) if needle in f"{n} {v}".lower()]
+            if not needle:
+                lines = ["Package                        Version", "-" * 30 + " " + "-" * 7] + lines
+            stdout, stderr, exit_code = "\n".join(lines) + "\n", "", 0
+        elif "pip3 install" in script:
+            install_args = shlex.split(script[script.index("pip3 install") + len("pip3 install"):].split(";")[0])
+            if "-r" in install_args:
+                stdout, stderr, exit_code = self._install_requirements(packages, stdin.decode())
+            else:
+                requirements = [arg for i, arg in enumerate(install_args)
+                                if not arg.startswith("-") and (i == 0 or install_args[i - 1] != "--find-links")]
+                stdout, stderr, exit_code = self._pip_install(packages, requirements)
+        else:
+            stdout, stderr, exit_code = "", "", 0
+        if exit_code_marker is not None:
+            stdout = f"{stdout}{exit_code_marker}{exit_code}\n"
+        return stdout, stderr, exit_code
+
+    def _touch(self, pod, paths):
+        if self.pods.get((pod['metadata']['namespace'], pod['metadata']['name'])) is not pod:
+            return
+        previous = copy.deepcopy(pod)
+        self.pod_files[pod['metadata']['uid']].update(dict.fromkeys(paths, b""))
+        self._update_readiness(pod)
+        if pod['status'] != previous['status']:
+            self._emit("Pod", "MODIFIED", pod, previous)
+            self._reconcile_owner_of(pod)
+
+    # Function to emulate pip wheel: requirements resolve to the wheels of the --find-links directory, or without
+    # --no-index to new wheels created there. Prints the sha256sum of every wheel the requirements resolved to
+    def _pip_wheel(self, files, script, requirements_file) -> tuple:
+        args = shlex.split(script[script.index("pip3 wheel"):].split(" && ")[0])
+        find_links = args[args.index("--find-links") + 1].rstrip("/")
+        lines = []
+        for requirement in filter(None, (line.strip() for line in requirements_file.split("\n"))):
+            name, _, version = requirement.partition("==")
+            name = re.split(r"[<>=!~\[ ]", name.strip())[0]
+            with self._lock:
+                wheels = sorted(path for path in files if path.startswith(find_links + "/") and path.endswith(".whl")
+                                and _canonical_name(path[len(find_links) + 1:].split("-")[0]) == _canonical_name(name)
+                                and version in ("", path[len(find_links) + 1:].split("-")[1]))
+                if not wheels and ("--no-index" in args or name.lower() in self.unavailable_packages):
+                    return "", (f"ERROR: Could not find a version that satisfies the requirement {requirement}\n"
+                                f"ERROR: No matching distribution found for {name}\n"), 1
+                if not wheels:
+                    wheels = [f"{find_links}/{name.replace('-', '_')}-{version or '1.0.0'}-py3-none-any.whl"]
+                    files[wheels[0]] = f"{name}-{version or '1.0.0'}".encode()
+                path = wheels[-1]
+                lines.append(f"{hashlib.sha256(files[path]).hexdigest()}  {path.rsplit('/', 1)[1]}")
+        return "\n".join(lines) + "\n", "", 0
+
+    # Function to check that hash-pinned requirements are served by the wheelhouse at a --find-links URL: the
+    # ready pods selected by the service of its host name. Returns pip's error, None if every wheel is there
+    def _check_wheelhouse(self, url, requirements):
+        service_name, namespace = urlparse(url).hostname.split(".")[:2]
+        with self._lock:
+            self.request_counts["wheelhouse index"] += 1
+            service = self.services.get((namespace, service_name))
+            if service is None:
+                return f"WARNING: Could not reach {url}\nERROR: No matching distribution found\n"
+            selector = service['spec'].get('selector') or {}
+            wheels = {path.rsplit("/", 1)[-1]: content for pod in self.pods.values()
+                      if _matches(pod, namespace, selector) and _is_ready(pod)
+                      for path, content in self.pod_files[pod['metadata']['uid']].items() if path.endswith(".whl")}
+        for words in requirements:
+            name, _, version = words[0].partition("==")
+            hashes = [word.split(":", 1)[1] for word in words[1:] if word.startswith("--hash=sha256:")]
+            matches = [content for wheel, content in wheels.items()
+                       if _canonical_name(wheel.split("-")[0]) == _canonical_name(name) and wheel.split("-")[1] == version]
+            if not matches:
+                return f"ERROR: No matching distribution found for {words[0]}\n"
+            if hashes and hashlib.sha256(matches[0]).hexdigest() not in hashes:
+                return f"ERROR: THESE PACKAGES DO NOT MATCH THE HASHES FROM THE REQUIREMENTS FILE.\n    {words[0]}\n"
+        return None
+
+    # Function to emulate pip install -r of a requirements file. Lines are options like "--find-links <url>" or
+    # requirements, hash-pinned ones look like "name==version --hash=sha256:..."
+    def _install_requirements(self, packages, requirements_file, sleep=True) -> tuple:
+        lines = [line.split() for line in requirements_file.split("\n") if line.strip()]
+        options = {words[0]: words[1:] for words in lines if words[0].startswith("-")}
+        requirements = [words for words in lines if not words[0].startswith("-")]
+        if (options.get("--find-links") or [""])[0].startswith("http://"):
+            index_error = self._check_wheelhouse(options["--find-links"][0], requirements)
+            if index_error is not None:
+                return "", index_error, 1
+        return self._pip_install(packages, [words[0] for words in requirements], sleep=sleep)
+
+    def _pip_install(self, packages, requirements, sleep=True) -> tuple:
+        parsed = []
+        for requirement in requirements:
+            parsed_requirement = Requirement(requirement)
+            name, specifier = parsed_requirement.name, parsed_requirement.specifier
+            if name.lower() in self.unavailable_packages:
+                # pip resolves the whole set before installing, one missing package fails the whole invocation
+                return "", (f"ERROR: Could not find a version that satisfies the requirement {requirement}\n"
+                            f"ERROR: No matching distribution found for {name}\n"), 1
+            parsed.append((requirement, name, specifier))
+        if sleep:
+            time.sleep(self.pip_seconds_per_package * len(parsed))
+        lines, installed = [], []
+        with self._lock:
+            for requirement, name, specifier in parsed:
+                if name in packages and specifier.contains(packages[name], prereleases=True):
+                    lines.append(f"Requirement already satisfied: {requirement} in /usr/local/lib/python3.10/dist-packages")
+                else:
+                    packages[name] = _pick_version(specifier)
+                    installed.append(f"{name}-{packages[name]}")
+        if installed:
+            lines.append(f"Successfully installed {' '.join(installed)}")
+        return "\n".join(lines) + "\n", "", 0
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, code, obj):
+            data = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_error(self, error):
+            self._send_json(error.code, {'kind': "Status", 'apiVersion': "v1", 'status': "Failure",
+                                         'message': str(error), 'reason': error.reason, 'code': error.code})
+
+        def _dispatch(self, method):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"null") if length else None
+            try:
+                if method == "GET" and url.path.endswith("/exec"):
+                    return self._exec(url.path, query)
+                if method == "GET" and query.get('watch', ["false"])[0] in ("true", "True", "1"):
+                    return self._watch(url.path, query)
+                if method == "PATCH" and "apply-patch" in (self.headers.get("Content-Type") or ""):
+                    code, obj = server.apply(url.path, query, body)
+                else:
+                    code, obj = server.handle(method, url.path, query, body)
+                self._send_json(code, obj)
+            except ApiError as e:
+                self._send_error(e)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+        def do_DELETE(self):
+            self._dispatch("DELETE")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _watch(self, path, query):
+            match = re.match(r"^/(?:api/v1|apis/apps/v1)/namespaces/([^/]+)/(pods|deployments)$", path)
+            if match is None:
+                raise ApiError(404, "NotFound", f"{path} not found")
+            kind = "Pod" if match.group(2) == "pods" else "Deployment"
+            watcher = server.open_watch(kind, match.group(1), query)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                if watcher is None:
+                    self._write_chunk(json.dumps({'type': "ERROR", 'object': {
+                        'kind': "Status", 'apiVersion': "v1", 'metadata': {}, 'status': "Failure",
+                        'message': "too old resource version", 'reason': "Expired", 'code': 410}}).encode() + b"\n")
+                    return
+                deadline = time.monotonic() + int(query.get('timeoutSeconds', ["300"])[0])
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        event = watcher[2].get(timeout=min(remaining, 1))
+                    except queue.Empty:
+                        continue
+                    if event is None:
+                        break
+                    self._write_chunk(json.dumps({'type': event[0], 'object': event[1]}).encode() + b"\n")
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            finally:
+                if watcher is not None:
+                    server.close_watch(watcher)
+            try:
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        # ---- minimal websocket server for the v4.channel.k8s.io exec protocol ----
+
+        def _exec(self, path, query):
+            match = re.match(r"^/api/v1/namespaces/([^/]+)/pods/([^/]+)/exec$", path)
+            key = self.headers.get("Sec-WebSocket-Key")
+            accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.send_header("Sec-WebSocket-Protocol", "v4.channel.k8s.io")
+            self.end_headers()
+            self.wfile.flush()
+            self.close_connection = True
+
+            pending_stdin = bytearray()
+
+            def read_stdin(size):
+                while len(pending_stdin) < size:
+                    opcode, payload = self._read_frame()
+                    if opcode == 8 or opcode is None:
+                        break
+                    if payload and payload[0] == STDIN_CHANNEL:
+                        pending_stdin.extend(payload[1:])
+                return bytes(pending_stdin[:size])
+
+            stdout, stderr, exit_code = server.run_exec(match.group(1), match.group(2), query.get('command', []),
+                                                        read_stdin)
+            try:
+                if stdout:
+                    self._write_frame(bytes([STDOUT_CHANNEL]) + stdout.encode())
+                if stderr:
+                    self._write_frame(bytes([STDERR_CHANNEL]) + stderr.encode())
+                status = {'metadata': {}, 'status': "Success"} if exit_code == 0 else {
+                    'metadata': {}, 'status': "Failure", 'reason': "NonZeroExitCode",
+                    'message': f"command terminated with non-zero exit code: {exit_code}",
+                    'details': {'causes': [{'reason': "ExitCode", 'message': str(exit_code)}]}}
+                self._write_frame(bytes([ERROR_CHANNEL]) + json.dumps(status).encode())
+                self._write_frame(struct.pack("!H", 1000), opcode=8)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def _write_frame(self, payload, opcode=2):
+            header = bytes([0x80 | opcode])
+            if len(payload) < 126:
+                header += bytes([len(payload)])
+            elif len(payload) < 65536:
+                header += bytes([126]) + struct.pack("!H", len(payload))
+            else:
+                header += bytes([127]) + struct.pack("!Q", len(payload))
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+        def _read_frame(self):
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return None, b""
+            opcode, length = header[0] & 0x0F, header[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if header[1] & 0x80 else b"\x00\x00\x00\x00"
+            payload = self.rfile.read(length)
+            return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    return Handler
+
+
+# Stand-in for the JupyterLab REST API of many pods, the API of a pod is served under /<pod name>/api
+class FakeJupyterLabServer:
+    def __init__(self):
+        # pod name -> list of kernel models, as returned by /api/kernels
+        self.kernels = {}
+        self.request_counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _make_jupyterlab_handler(self))
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True, name="fake-api-jupyterlab").start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # Function to get the base URL of a pod's JupyterLab, to be used as the autoscaler's endpoint function
+    def endpoint(self, pod) -> str:
+        return f"{self.url}/{pod['metadata']['name']}"
+
+    # Function to set a pod's kernels, each with a session, last active the given seconds ago
+    def set_kernels(self, pod_name, busy=0, idle=0, idle_seconds=0):
+        last_activity = datetime.fromtimestamp(time.time() - idle_seconds, timezone.utc)
+        kernels = []
+        for index in range(busy + idle):
+            kernels.append({'id': str(uuid.uuid4()), 'name': "python3", 'connections': 1,
+                            'execution_state': "busy" if index < busy else "idle",
+                            'last_activity': last_activity.strftime('%Y-%m-%dT%H:%M:%S.%fZ')})
+        with self._lock:
+            self.kernels[pod_name] = kernels
+
+    def sessions(self, pod_name) -> list:
+        return [{'id': str(uuid.uuid4()), 'path': f"notebook-{index}.ipynb", 'type': "notebook", 'kernel': kernel}
+                for index, kernel in enumerate(self.kernels.get(pod_name, []))]
+
+    # Function to answer a GET of a pod's JupyterLab API path, returns (status code, object)
+    def get(self, pod_name, path) -> tuple:
+        match = re.match(r"^/api/(kernels|sessions)$", urlparse(path).path)
+        if match is None:
+            return 404, {'message': "Not Found"}
+        with self._lock:
+            self.request_counts[match.group(1)] += 1
+            return 200, self.kernels.get(pod_name, []) if match.group(1) == "kernels" else self.sessions(pod_name)
+
+
+def _make_jupyterlab_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            pod_name, _, path = self.path.lstrip("/").partition("/")
+            code, obj = server.get(pod_name, f"/{path}")
+            data = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
@@ -0,0 +1,172 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import ClientRegistry
+from Automation.Constant.Constant import *
+
+LATENCY_SAMPLES = 1000
+
+
+# Thread-safe token bucket: rate tokens per second, up to burst tokens saved up
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled_seconds = 0.0
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+
+class _Operation:
+    def __init__(self, name, namespace, priority, fn, args, kwargs):
+        self.name = name
+        self.namespace = namespace
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.monotonic()
+
+
+def _percentiles(samples) -> dict:
+    if not samples:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    ordered = sorted(samples)
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in (50, 95, 99)}
+
+
+# Runs cluster operations of many DeploymentClients from one priority queue, with global and per-namespace
+# concurrency limits, and token-bucket rate limits on the API calls and exec streams they issue. The limits only
+# apply to this manager's operations, other callers and other managers in the process keep their own
+class FleetManager:
+    def __init__(self, global_concurrency=FLEET_GLOBAL_CONCURRENCY, namespace_concurrency=FLEET_NAMESPACE_CONCURRENCY,
+                 api_rate=FLEET_API_RATE_PER_SECOND, api_burst=FLEET_API_BURST,
+                 exec_rate=FLEET_EXEC_RATE_PER_SECOND, exec_burst=FLEET_EXEC_BURST):
+        self.global_concurrency = global_concurrency
+        self.namespace_concurrency = namespace_concurrency
+        self.api_rate_limiter = TokenBucket(api_rate, api_burst)
+        self.exec_rate_limiter = TokenBucket(exec_rate, exec_burst)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running_per_namespace = collections.Counter()
+        self._stopped = False
+        self._queue_wait_seconds = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._run_seconds = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+        self.completed = 0
+        self.failed = 0
+        self._workers = [threading.Thread(target=self._work, daemon=True, name=f"fleet-worker-{i}")
+                         for i in range(global_concurrency)]
+        for worker in self._workers:
+            worker.start()
+
+    # Function to queue an operation, returns a future with its result
+    def submit(self, name, namespace, fn, *args, priority=PRIORITY_DEFAULT, **kwargs) -> concurrent.futures.Future:
+        operation = _Operation(name, namespace, priority, fn, args, kwargs)
+        with self._condition:
+            if self._stopped:
+                raise Exception("ERROR: Fleet manager is shut down\n")
+            heapq.heappush(self._queue, (priority, next(self._sequence), operation))
+            self._condition.notify()
+        return operation.future
+
+    def create_cluster(self, deployment_client, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.submit("create_cluster", deployment_client.namespace, deployment_client.create_cluster,
+                           priority=priority, **kwargs)
+
+    def scale_cluster(self, deployment_client, new_replica_count, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return self.submit("scale_cluster", deployment_client.namespace, deployment_client.scale_cluster,
+                           new_replica_count, priority=priority, **kwargs)
+
+    def install_python_package_in_cluster(self, deployment_client, package, priority=PRIORITY_DEFAULT):
+        return self.submit("install_python_package_in_cluster", deployment_client.namespace,
+                           deployment_client.install_python_package_in_cluster, package, priority=priority)
+
+    def sync_packages(self, deployment_client, priority=PRIORITY_BACKGROUND):
+        return self.submit("sync_packages", deployment_client.namespace,
+                           deployment_client.reconciler.reconcile_once, priority=priority)
+
+    def delete_cluster(self, deployment_client, priority=PRIORITY_DEFAULT):
+        return self.submit("delete_cluster", deployment_client.namespace, deployment_client.delete_cluster,
+                           priority=priority)
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def stats(self) -> dict:
+        with self._condition:
+            queued_per_priority = collections.Counter(priority for priority, _, _ in self._queue)
+            return {'queue_depth': len(self._queue), 'queue_depth_per_priority': dict(queued_per_priority),
+                    'running_per_namespace': dict(+self._running_per_namespace),
+                    'completed': self.completed, 'failed': self.failed,
+                    'queue_wait_seconds': _percentiles(self._queue_wait_seconds),
+                    'run_seconds': {name: _percentiles(samples) for name, samples in self._run_seconds.items()},
+                    'api_throttled_seconds': self.api_rate_limiter.throttled_seconds,
+                    'exec_throttled_seconds': self.exec_rate_limiter.throttled_seconds}
+
+    # Function to pop the highest priority operation whose namespace is below its concurrency limit
+    def _next_operation(self):
+        for entry in sorted(self._queue):
+            operation = entry[2]
+            if self._running_per_namespace[operation.namespace] < self.namespace_concurrency:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                return operation
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                operation = self._next_operation()
+                while operation is None:
+                    if self._stopped:
+                        return
+                    self._condition.wait()
+                    operation = self._next_operation()
+                self._running_per_namespace[operation.namespace] += 1
+                self._queue_wait_seconds.append(time.monotonic() - operation.enqueued_at)
+
+            start_time = time.monotonic()
+            try:
+                with ClientRegistry.rate_limited(self.api_rate_limiter, self.exec_rate_limiter):
+                    result, error = operation.fn(*operation.args, **operation.kwargs), None
+            except Exception as e:
+                logging.debug(f"Operation {operation.name} in namespace {operation.namespace} failed: {e}")
+                result, error = None, e
+            with self._condition:
+                self.completed += int(error is None)
+                self.failed += int(error is not None)
+                self._run_seconds[operation.name].append(time.monotonic() - start_time)
+                self._running_per_namespace[operation.namespace] -= 1
+                # A slot in this namespace is free, operations skipped for it may now run
+                self._condition.notify_all()
+            # Resolved after the counters, so whoever waits on the future sees them updated
+            if error is None:
+                operation.future.set_result(result)
+            else:
+                operation.future.set_exception(error)
@@ -0,0 +1,53 @@
+import hashlib
+import logging
+import os
+import subprocess
+
+
+# Image builder using the local docker CLI. Any object with the same build/push methods can be used instead,
+# e.g. a stand-in that only records the tags in tests
+class DockerImageBuilder:
+    def __init__(self, docker_binary="docker"):
+        self.docker_binary = docker_binary
+
+    def build(self, context_dir, tag) -> bool:
+        result = subprocess.run([self.docker_binary, "build", "-t", tag, context_dir], capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.debug(f"Image build of {tag} failed: {result.stderr}")
+        return result.returncode == 0
+
+    def push(self, tag) -> bool:
+        result = subprocess.run([self.docker_binary, "push", tag], capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.debug(f"Image push of {tag} failed: {result.stderr}")
+        return result.returncode == 0
+
+
+# Function to get a deterministic image tag for a base image and package set, so identical freezes reuse the image
+def get_frozen_image_tag(repository, base_image, packages_list) -> str:
+    digest = hashlib.sha256("\n".join([base_image] + sorted(packages_list)).encode()).hexdigest()[:12]
+    return f"{repository}:frozen-{digest}"
+
+
+# Function to render a docker build context installing the package set on top of the base image
+def render_build_context(base_image, packages_list, context_dir) -> str:
+    os.makedirs(context_dir, exist_ok=True)
+    with open(os.path.join(context_dir, "requirements.txt"), "w") as f:
+        f.write("\n".join(sorted(packages_list)) + "\n")
+    with open(os.path.join(context_dir, "Dockerfile"), "w") as f:
+        f.write(f"FROM {base_image}\n"
+                f"COPY requirements.txt /tmp/requirements.txt\n"
+                f"RUN pip3 install --no-cache-dir -r /tmp/requirements.txt && rm /tmp/requirements.txt\n")
+    return context_dir
+
+
+# Function to build and push an image derived from base_image with the package set already installed
+def freeze_image(image_builder, repository, base_image, packages_list, context_dir):
+    tag = get_frozen_image_tag(repository, base_image, packages_list)
+    render_build_context(base_image, packages_list, context_dir)
+    logging.debug(f"Building frozen image {tag} from {base_image} with {len(packages_list)} packages")
+    if not image_builder.build(context_dir, tag):
+        return None
+    if not image_builder.push(tag):
+        return None
+    return tag
@@ -1,13 +1,22 @@
 import json
+import logging
+import os
+import threading
 import time
-from datetime import datetime
 
 import yaml
-from kubernetes import client, config, utils
+from kubernetes import utils, watch
+from kubernetes.client.rest import ApiException
 
+import ClientRegistry
+import PodInformer
 from Automation.Constant.Constant import *
 
 
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+
 def create_props_dic(properties_map):
     prop_dic = {}
     for key, value in properties_map.items():
@@ -15,48 +24,102 @@ def create_props_dic(properties_map):
     return prop_dic
 
 
-# Function to create kubernetes yaml, using template yaml file & properties map
-def create_k8s_yaml(yaml_template_file=None, properties_map=None):
-    props_dict = create_props_dic(properties_map=properties_map)
-    with open(yaml_template_file) as f:
-        data = f.read()
-        if props_dict:
-            for key, value in props_dict.items():
-                data = data.replace(key, value)
-        return yaml.safe_load_all(data)
+# Function to get the parsed objects of a template file, parsed once and re-read only when the file changes
+def load_k8s_template(yaml_template_file) -> list:
+    mtime = os.path.getmtime(yaml_template_file)
+    with _template_cache_lock:
+        cached = _template_cache.get(yaml_template_file)
+        if cached is None or cached[0] != mtime:
+            with open(yaml_template_file) as f:
+                cached = (mtime, [obj for obj in yaml.safe_load_all(f) if obj is not None])
+            _template_cache[yaml_template_file] = cached
+        return cached[1]
+
+
+# Function to substitute ${placeholders} in a parsed template. A value that is exactly one placeholder is
+# parsed as YAML, so it gets the same type as with a textual replacement (e.g. replicas stays an integer)
+def substitute_properties(node, props_dict):
+    if isinstance(node, dict):
+        return {substitute_properties(k, props_dict): substitute_properties(v, props_dict) for k, v in node.items()}
+    if isinstance(node, list):
+        return [substitute_properties(item, props_dict) for item in node]
+    if isinstance(node, str) and "${" in node:
+        if node in props_dict:
+            return yaml.safe_load(props_dict[node])
+        for key, value in props_dict.items():
+            node = node.replace(key, value)
+    return node
+
+
+# Function to create kubernetes objects, using template yaml file & properties map
+def create_k8s_yaml(yaml_template_file=None, properties_map=None) -> list:
+    props_dict = create_props_dic(properties_map=properties_map or {})
+    return [substitute_properties(obj, props_dict) for obj in load_k8s_template(yaml_template_file)]
+
+
+# Function to get the API path of a namespaced object, e.g. /apis/apps/v1/namespaces/poc/deployments/jupyterlab
+def get_resource_path(k8s_object, namespace) -> str:
+    api_version = k8s_object['apiVersion']
+    prefix = "/api/v1" if api_version == "v1" else f"/apis/{api_version}"
+    return f"{prefix}/namespaces/{namespace}/{k8s_object['kind'].lower()}s/{k8s_object['metadata']['name']}"
 
 
-# Function to create a kubernetes resource using yaml file
-def create_using_yaml(yaml_obj, namespace) -> bool:
+# Function to get the call_api arguments of a server-side apply of one object, shared by the sync and the
+# asyncio clients (which only differ in how they type the response)
+def get_apply_request(k8s_object, namespace) -> dict:
+    return {'resource_path': get_resource_path(k8s_object, namespace), 'method': 'PATCH',
+            'query_params': [('fieldManager', FIELD_MANAGER), ('force', 'true')],
+            'header_params': {'Content-Type': 'application/apply-patch+yaml', 'Accept': 'application/json'},
+            # JSON is valid YAML, and both clients send bytes bodies as they are
+            'body': json.dumps(k8s_object).encode(),
+            'auth_settings': ['BearerToken'], '_return_http_data_only': True}
+
+
+# Function to set the requirements file of the packages ConfigMap among rendered cluster objects (see
+# PACKAGES_REQUIREMENTS_KEY), returns the ConfigMap
+def set_packages_requirements(k8s_objects, requirements) -> dict:
+    configmap = next(obj for obj in k8s_objects if obj['kind'] == "ConfigMap")
+    configmap['data'] = {PACKAGES_REQUIREMENTS_KEY: requirements}
+    return configmap
+
+
+# Function to create or update kubernetes resources with server-side apply, one request per object
+def create_using_yaml(k8s_objects, namespace) -> bool:
     try:
-        config.load_kube_config()
-        k8s_client = client.ApiClient()
-        utils.create_from_yaml(k8s_client=k8s_client, yaml_objects=yaml_obj, verbose=True, namespace=namespace)
+        k8s_client = ClientRegistry.get_api_client()
+        for k8s_object in k8s_objects:
+            k8s_client.call_api(response_type='object', **get_apply_request(k8s_object, namespace))
+            logging.debug(f"{k8s_object['kind']} {k8s_object['metadata']['name']} applied")
         return True
     except Exception as e:
-        if "AlreadyExists" in str(e):
-            print(f"ERROR: Cluster with same name already exists\n{e}\n")
-        else:
-            print(f"ERROR: Exception when calling kubectl apply: {e}\n")
+        print(f"ERROR: Exception when calling kubectl apply: {e}\n")
         return False
 
 
 # Function to delete a kubernetes service
 def delete_service(service_name, namespace) -> bool:
     try:
-        config.load_kube_config()
-        k8s_client = client.CoreV1Api()
+        k8s_client = ClientRegistry.get_core_v1()
         k8s_client.delete_namespaced_service(name=service_name, namespace=namespace)
         return True
     except Exception as e:
         raise Exception(f"ERROR: Exception when calling delete service operation: {e}\n")
 
 
+# Function to delete a kubernetes config map
+def delete_config_map(config_map_name, namespace) -> bool:
+    try:
+        k8s_client = ClientRegistry.get_core_v1()
+        k8s_client.delete_namespaced_config_map(name=config_map_name, namespace=namespace)
+        return True
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling delete config map operation: {e}\n")
+
+
 # Function to delete a kubernetes deployment
 def delete_deployment(deployment_name, namespace) -> bool:
     try:
-        config.load_kube_config()
-        k8s_client = client.AppsV1Api()
+        k8s_client = ClientRegistry.get_apps_v1()
         k8s_client.delete_namespaced_deployment(name=deployment_name, namespace=namespace)
         return True
     except Exception as e:
@@ -66,25 +129,172 @@ def delete_deployment(deployment_name, namespace) -> bool:
 # Function to scale a kubernetes deployment
 def scale_deployment(deployment_name, namespace, new_replica_count) -> bool:
     try:
-        apps_v1 = client.AppsV1Api()
+        apps_v1 = ClientRegistry.get_apps_v1()
         apps_v1.patch_namespaced_deployment_scale(deployment_name, namespace, {"spec": {"replicas": new_replica_count}})
         return True
     except Exception as e:
         raise Exception(f"ERROR: Exception when calling scale operation: {e}\n")
 
-# Function to get newly launched pod in the deployment
-def get_newly_launched_pods(deployment_name, namespace) -> list:
-    newly_launched_pods = []
-    response = client.CoreV1Api().list_namespaced_pod(
-        namespace=namespace,
-        label_selector=f"app={deployment_name}",
-        _preload_content=False
-    )
-    data = json.loads(response.data)
-    for obj in data['items']:
-        name = obj['metadata']['name']
-        creation_time = str(obj['metadata']['creationTimestamp'])
-        format_date = datetime.strptime(creation_time, '%Y-%m-%dT%H:%M:%S%z')
-        minute_diff = int((time.time() - format_date.timestamp()) / 60)
-        if minute_diff < FIVE_MINUTES: newly_launched_pods.append(name)
-    return newly_launched_pods
+
+# Function to create a bare pod, the name is generated from generate_name
+def create_pod(namespace, pod_manifest) -> str:
+    try:
+        pod = ClientRegistry.get_core_v1().create_namespaced_pod(namespace=namespace, body=pod_manifest)
+        return pod.metadata.name
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling create pod operation: {e}\n")
+
+
+# Function to delete a kubernetes pod
+def delete_pod(pod_name, namespace) -> bool:
+    try:
+        ClientRegistry.get_core_v1().delete_namespaced_pod(name=pod_name, namespace=namespace)
+        return True
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling delete pod operation: {e}\n")
+
+
+# Function to make the deployment own bare pods, so they are garbage collected with it. The reference is not a
+# controller reference and the pods lack the pod-template-hash label, so the ReplicaSet never adopts them
+def set_pods_owner_to_deployment(deployment_name, namespace, pod_names) -> bool:
+    try:
+        deployment = ClientRegistry.get_apps_v1().read_namespaced_deployment(deployment_name, namespace)
+        owner_reference = {"apiVersion": "apps/v1", "kind": "Deployment", "name": deployment_name,
+                           "uid": deployment.metadata.uid}
+        for pod_name in pod_names:
+            ClientRegistry.get_core_v1().patch_namespaced_pod(pod_name, namespace, {
+                "metadata": {"ownerReferences": [owner_reference]}})
+        return True
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling pod owner patch operation: {e}\n")
+
+
+# Function to set the pod-deletion-cost of a pod, the ReplicaSet removes pods of lower cost first on scale-down
+def set_pod_deletion_cost(pod_name, namespace, cost) -> bool:
+    try:
+        ClientRegistry.get_core_v1().patch_namespaced_pod(pod_name, namespace, {
+            "metadata": {"annotations": {POD_DELETION_COST_ANNOTATION: str(cost)}}})
+        return True
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling pod deletion cost patch operation: {e}\n")
+
+
+# Function to get the CPU (millicores) and memory (bytes) usage of the pods matching a label selector, from
+# metrics.k8s.io. Returns pod name -> (cpu, memory), empty if the metrics API is not available
+def get_pod_usage(namespace, label_selector) -> dict:
+    try:
+        metrics = ClientRegistry.get_custom_objects().list_namespaced_custom_object(
+            "metrics.k8s.io", "v1beta1", namespace, "pods", label_selector=label_selector)
+    except ApiException as e:
+        logging.debug(f"Pod metrics of {namespace}/{label_selector} unavailable: {e.status} {e.reason}")
+        return {}
+    usage = {}
+    for item in metrics.get('items', []):
+        containers = item.get('containers') or []
+        usage[item['metadata']['name']] = (
+            float(sum(utils.parse_quantity(c['usage'].get('cpu', "0")) for c in containers) * 1000),
+            int(sum(utils.parse_quantity(c['usage'].get('memory', "0")) for c in containers)))
+    return usage
+
+
+# Function to read a kubernetes deployment, as the dict returned by the API server
+def read_deployment(deployment_name, namespace) -> dict:
+    try:
+        response = ClientRegistry.get_apps_v1().read_namespaced_deployment(deployment_name, namespace,
+                                                                           _preload_content=False)
+        return json.loads(response.data)
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling read deployment operation: {e}\n")
+
+
+# Function to get the deployment patch of a rolling update of its container image. container_fields (e.g. its
+# command) and volumes, if given, are rolled out with it
+def get_rollout_patch(container_name, image, replicas, max_surge, max_unavailable, progress_deadline_seconds,
+                      container_fields=None, volumes=None) -> dict:
+    pod_spec = {"containers": [dict(container_fields or {}, name=container_name, image=image)]}
+    if volumes is not None:
+        pod_spec["volumes"] = volumes
+    return {"spec": {"replicas": replicas, "progressDeadlineSeconds": progress_deadline_seconds,
+                     "strategy": {"type": "RollingUpdate",
+                                  "rollingUpdate": {"maxSurge": max_surge, "maxUnavailable": max_unavailable}},
+                     "template": {"spec": pod_spec}}}
+
+
+# Function to start a rolling update of the container image of a kubernetes deployment, see get_rollout_patch
+def patch_deployment_rollout(deployment_name, namespace, container_name, image, replicas, max_surge,
+                             max_unavailable, progress_deadline_seconds, container_fields=None, volumes=None) -> bool:
+    body = get_rollout_patch(container_name, image, replicas, max_surge, max_unavailable, progress_deadline_seconds,
+                             container_fields=container_fields, volumes=volumes)
+    try:
+        apps_v1 = ClientRegistry.get_apps_v1()
+        apps_v1.patch_namespaced_deployment(deployment_name, namespace, body)
+        return True
+    except Exception as e:
+        raise Exception(f"ERROR: Exception when calling rollout patch operation: {e}\n")
+
+
+# Function to get the rollout state of a deployment, as kubectl rollout status sees it: "complete",
+# "progressing" or "deadline_exceeded"
+def get_rollout_state(deployment) -> str:
+    status = deployment.get('status') or {}
+    if status.get('observedGeneration', 0) < deployment['metadata'].get('generation', 0):
+        return "progressing"
+    for condition in status.get('conditions') or []:
+        if condition.get('type') == "Progressing" and condition.get('reason') == "ProgressDeadlineExceeded":
+            return "deadline_exceeded"
+    replicas = deployment['spec'].get('replicas', 1)
+    if status.get('updatedReplicas', 0) == status.get('replicas', 0) == status.get('availableReplicas', 0) == replicas:
+        return "complete"
+    return "progressing"
+
+
+# Function to yield a deployment every time it changes until the deadline, from a single watch resumed at the
+# last seen resourceVersion
+def watch_deployment(deployment_name, namespace, deadline):
+    apps_v1 = ClientRegistry.get_apps_v1()
+    deployment = read_deployment(deployment_name, namespace)
+    yield deployment
+    while time.monotonic() < deadline:
+        remaining = deadline - time.monotonic()
+        w = watch.Watch()
+        try:
+            for event in w.stream(apps_v1.list_namespaced_deployment, namespace=namespace,
+                                  field_selector=f"metadata.name={deployment_name}",
+                                  resource_version=deployment['metadata']['resourceVersion'],
+                                  allow_watch_bookmarks=True, timeout_seconds=max(1, int(remaining)),
+                                  _request_timeout=remaining + 10):
+                if event['type'] == "DELETED":
+                    raise Exception(f"ERROR: Deployment {deployment_name} was deleted\n")
+                if event['type'] == "BOOKMARK":
+                    deployment['metadata']['resourceVersion'] = event['raw_object']['metadata']['resourceVersion']
+                    continue
+                deployment = event['raw_object']
+                yield deployment
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            # The resourceVersion is too old, start over from a fresh read
+            deployment = read_deployment(deployment_name, namespace)
+            yield deployment
+        finally:
+            w.stop()
+
+
+# Function to follow a deployment rollout through watch events, on_update(deployment) is called on every change.
+# Returns the final rollout state, or "timeout"
+def wait_for_deployment_rollout(deployment_name, namespace, timeout_seconds, on_update=None) -> str:
+    for deployment in watch_deployment(deployment_name, namespace, time.monotonic() + timeout_seconds):
+        if on_update is not None:
+            on_update(deployment)
+        state = get_rollout_state(deployment)
+        if state != "progressing":
+            return state
+    return "timeout"
+
+
+# Function to wait until the deployment has exactly target_count Running/Ready pods, using the shared pod informer
+def wait_for_ready_pods(deployment_name, namespace, target_count, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS) -> bool:
+    informer = PodInformer.get_pod_informer(namespace=namespace, label_selector=f"app={deployment_name}")
+    return informer.wait_for(
+        lambda pods: sum(1 for pod in pods if PodInformer.is_pod_ready(pod)) == int(target_count),
+        timeout_seconds=timeout_seconds)
@@ -0,0 +1,126 @@
+import logging
+import threading
+
+import ClientRegistry
+import ExecEngine
+import StateStore
+import Telemetry
+import Utils
+
+
+# In-memory index of the python packages installed in each pod, read once per pod with pip list --format=json.
+# Entries are keyed by pod UID and image, and dropped when the pod's containers restart or after an install.
+# With a state store, inventories are shared with other processes: an entry is only used while the stored one
+# has the same stamp, so an install from another process invalidates it here too. Stored inventories are keyed by
+# the API server the pods run on
+class PackageInventory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (pod uid, image) -> (restart count, {canonical name: (name, version)}, state store stamp)
+        self._entries = {}
+        # pod name -> (pod uid, image), to invalidate by name after an install
+        self._keys = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def _api_server() -> str:
+        return ClientRegistry.get_configuration().host
+
+    @staticmethod
+    def _pod_key(pod) -> tuple:
+        return pod['metadata']['uid'], pod['spec']['containers'][0]['image']
+
+    @staticmethod
+    def _restart_count(pod) -> int:
+        return sum(status.get('restartCount', 0) for status in pod['status'].get('containerStatuses') or [])
+
+    # Function to get {name: version} of every package in the pod, from cache when still valid
+    def get_packages(self, pod, namespace) -> dict:
+        return {name: version for name, version in self._get_index(pod, namespace).values()}
+
+    # Function to get the version of a package in the pod, None if it is not installed
+    def get_package_version(self, pod, namespace, name):
+        entry = self._get_index(pod, namespace).get(Utils.Utils.canonicalize_package_name(name))
+        return entry[1] if entry else None
+
+    # Function to get {name: version} of the packages in the pod whose name starts with prefix
+    def find_packages(self, pod, namespace, prefix) -> dict:
+        prefix = Utils.Utils.canonicalize_package_name(prefix)
+        return {name: version for canonical_name, (name, version) in self._get_index(pod, namespace).items()
+                if canonical_name.startswith(prefix)}
+
+    # Function to drop the inventory of a pod, e.g. after an install or once the pod is gone
+    def invalidate(self, pod_name, namespace=None):
+        with self._lock:
+            key = self._keys.pop(pod_name, None)
+            if key is not None:
+                self._entries.pop(key, None)
+        store = StateStore.get_state_store()
+        if store is not None and namespace is not None:
+            store.delete_inventory(self._api_server(), namespace, pod_name)
+
+    def stats(self) -> dict:
+        return {'pods': len(self._entries), 'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+    def _get_index(self, pod, namespace) -> dict:
+        key = self._pod_key(pod)
+        restart_count = self._restart_count(pod)
+        store = StateStore.get_state_store()
+        api_server = self._api_server() if store is not None else None
+        stamp = store.get_inventory_stamp(api_server, *key) if store is not None else None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == restart_count and entry[2] == stamp:
+                self.cache_hits += 1
+                return entry[1]
+
+        pod_name = pod['metadata']['name']
+        stored = store.get_inventory(api_server, *key) if stamp is not None else None
+        if stored is not None and stored['restart_count'] == restart_count:
+            python_package_map, stamp = stored['packages'], stored['updated_at']
+            with self._lock:
+                self.cache_hits += 1
+        else:
+            with self._lock:
+                self.cache_misses += 1
+            with Telemetry.span("pod_inventory", pod=pod_name):
+                python_package_map = self._read_packages(pod_name, namespace, pod['spec']['containers'][0]['name'])
+            if store is not None:
+                stamp = store.save_inventory(api_server, *key, restart_count, namespace, pod_name,
+                                             python_package_map)
+        index = {Utils.Utils.canonicalize_package_name(name): (name, version)
+                 for name, version in python_package_map.items()}
+        with self._lock:
+            previous_key = self._keys.get(pod_name)
+            if previous_key is not None and previous_key != key:
+                self._entries.pop(previous_key, None)
+            self._entries[key] = (restart_count, index, stamp)
+            self._keys[pod_name] = key
+        return index
+
+    @staticmethod
+    def _read_packages(pod_name, namespace, container) -> dict:
+        logging.debug(f"Reading python package inventory of pod {pod_name}")
+        stdout, stderr, returncode = ExecEngine.exec_in_pod(
+            pod_name, namespace, ["/bin/sh", "-c", "pip3 list --format=json --disable-pip-version-check"],
+            container=container)
+        if stderr:
+            logging.debug(stderr)
+        if returncode != 0:
+            raise Exception(f"ERROR: pip3 list failed inside the pod {pod_name}\n")
+        return Utils.Utils.extract_python_packages_from_json(stdout)
+
+
+_package_inventory = PackageInventory()
+
+
+# Function to get the process-wide package inventory
+def get_package_inventory() -> PackageInventory:
+    return _package_inventory
+
+
+Telemetry.metrics.gauge("jupyterlab_package_inventory_cache_hits", "Package lookups answered from the inventory",
+                        lambda: _package_inventory.cache_hits)
+Telemetry.metrics.gauge("jupyterlab_package_inventory_cache_misses", "Package lookups that ran pip list in the pod",
+                        lambda: _package_inventory.cache_misses)
@@ -0,0 +1,275 @@
+import json
+import logging
+import threading
+import time
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+import ClientRegistry
+import StateStore
+import Telemetry
+from Automation.Constant.Constant import *
+
+
+# Function to check if a pod (as returned by the API server) is Running and Ready
+def is_pod_ready(pod) -> bool:
+    if pod['metadata'].get('deletionTimestamp'):
+        return False
+    status = pod.get('status') or {}
+    if status.get('phase') != "Running":
+        return False
+    for condition in status.get('conditions') or []:
+        if condition.get('type') == "Ready":
+            return condition.get('status') == "True"
+    return False
+
+
+# Function to check if a pod (as returned by the API server) terminated, e.g. evicted. Its containers never
+# start again
+def is_pod_terminated(pod) -> bool:
+    return (pod.get('status') or {}).get('phase') in ("Failed", "Succeeded")
+
+
+# In-memory cache of the pods matching a namespace/label selector, kept up to date by one list-then-watch. With
+# a state store the cache is snapshotted periodically, and a new process starts from a recent snapshot and
+# watches from its resourceVersion instead of listing again. Restored pods are served right away, but the cache
+# only turns live, for waits and ready counts, once the watch has caught up with the API server
+class PodInformer:
+    def __init__(self, namespace, label_selector):
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.resource_version = None
+        self._pods = {}
+        self._condition = threading.Condition()
+        self._synced = threading.Event()
+        self._live = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_sync = 0.0
+        self._last_snapshot = 0.0
+        self.restored = False
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.relist_count = 0
+        self.watch_event_count = 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name=f"informer-{self.namespace}-{self.label_selector}")
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    # Seconds since the cache last heard from the API server
+    def staleness(self) -> float:
+        if not self._synced.is_set():
+            return float("inf")
+        return time.monotonic() - self._last_sync
+
+    def stats(self) -> dict:
+        return {'namespace': self.namespace, 'label_selector': self.label_selector, 'pods': len(self._pods),
+                'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses,
+                'relist_count': self.relist_count, 'watch_event_count': self.watch_event_count,
+                'restored': self.restored, 'live': self._live.is_set(),
+                'staleness_seconds': self.staleness(), 'resource_version': self.resource_version}
+
+    # Function to get a snapshot of the cached pods, waiting for the first list if the cache is cold. With live,
+    # pods restored from a snapshot are only served once the watch caught up
+    def get_pods(self, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS, live=False) -> list:
+        self.start()
+        synced = self._live if live else self._synced
+        if synced.is_set() and self.staleness() < INFORMER_STALE_SECONDS:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            if not synced.wait(timeout_seconds):
+                raise Exception(f"ERROR: Pod cache for {self.namespace}/{self.label_selector} did not sync\n")
+        with self._condition:
+            return list(self._pods.values())
+
+    def get_pod(self, name):
+        for pod in self.get_pods():
+            if pod['metadata']['name'] == name:
+                return pod
+        return None
+
+    def get_pod_phases(self) -> dict:
+        return {pod['metadata']['name']: pod['status'].get('phase') for pod in self.get_pods()}
+
+    def get_ready_pod_count(self) -> int:
+        return sum(1 for pod in self.get_pods(live=True) if is_pod_ready(pod))
+
+    def get_pod_nodes(self) -> dict:
+        return {pod['metadata']['name']: pod['spec'].get('nodeName') for pod in self.get_pods()}
+
+    # Function to block until predicate(pods) is true on the cache, woken up by watch events
+    def wait_for(self, predicate, timeout_seconds) -> bool:
+        self.start()
+        deadline = time.monotonic() + timeout_seconds
+        if not self._live.wait(timeout_seconds):
+            return False
+        with self._condition:
+            while not predicate(list(self._pods.values())):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    # Function to load the stored snapshot if it is recent enough, the watch then replays what changed since
+    def _restore(self, store):
+        snapshot = store.get_pod_snapshot(ClientRegistry.get_configuration().host, self.namespace,
+                                          self.label_selector)
+        if snapshot is None:
+            return
+        age = time.time() - snapshot['updated_at']
+        if age > INFORMER_SNAPSHOT_MAX_AGE_SECONDS:
+            return
+        with self._condition:
+            self._pods = {obj['metadata']['name']: obj for obj in snapshot['pods']}
+            self.resource_version = snapshot['resource_version']
+            self._last_sync = time.monotonic() - age
+            self.restored = True
+            self._synced.set()
+            self._condition.notify_all()
+        logging.debug(f"Pod cache for {self.namespace}/{self.label_selector} restored with {len(self._pods)} pods "
+                      f"at resourceVersion {self.resource_version}")
+
+    def _save_snapshot(self, force=False):
+        store = StateStore.get_state_store()
+        if store is None or (not force and time.monotonic() - self._last_snapshot < INFORMER_SNAPSHOT_INTERVAL_SECONDS):
+            return
+        with self._condition:
+            pods, resource_version = list(self._pods.values()), self.resource_version
+        if resource_version is None:
+            return
+        self._last_snapshot = time.monotonic()
+        try:
+            store.save_pod_snapshot(ClientRegistry.get_configuration().host, self.namespace, self.label_selector,
+                                    resource_version, pods)
+        except Exception as e:
+            logging.debug(f"Snapshot of pod cache {self.namespace}/{self.label_selector} failed: {e}")
+
+    def _list(self, v1):
+        response = v1.list_namespaced_pod(namespace=self.namespace, label_selector=self.label_selector,
+                                          _preload_content=False)
+        data = json.loads(response.data)
+        with self._condition:
+            self._pods = {obj['metadata']['name']: obj for obj in data['items']}
+            self.resource_version = data['metadata']['resourceVersion']
+            self.relist_count += 1
+            self._last_sync = time.monotonic()
+            self._synced.set()
+            self._live.set()
+            self._condition.notify_all()
+        self._save_snapshot(force=True)
+
+    def _watch(self, v1):
+        # Until live, a short watch: the events it replays may be a backlog, only a bookmark or its clean end
+        # tell it caught up with the API server
+        timeout_seconds = INFORMER_WATCH_TIMEOUT_SECONDS if self._live.is_set() else INFORMER_RESTORE_CATCHUP_SECONDS
+        w = watch.Watch()
+        try:
+            for event in w.stream(v1.list_namespaced_pod, namespace=self.namespace,
+                                  label_selector=self.label_selector, resource_version=self.resource_version,
+                                  allow_watch_bookmarks=True, timeout_seconds=timeout_seconds,
+                                  _request_timeout=timeout_seconds + 10):
+                if self._stopped.is_set():
+                    return
+                obj = event['raw_object']
+                if event['type'] == "ERROR":
+                    # 410 Gone: the resourceVersion is too old, fall back to a fresh list
+                    self.resource_version = None
+                    return
+                with self._condition:
+                    self.resource_version = obj['metadata'].get('resourceVersion', self.resource_version)
+                    self._last_sync = time.monotonic()
+                    self.watch_event_count += 1
+                    if event['type'] == "DELETED":
+                        self._pods.pop(obj['metadata']['name'], None)
+                    elif event['type'] != "BOOKMARK":
+                        self._pods[obj['metadata']['name']] = obj
+                    else:
+                        self._live.set()
+                    self._condition.notify_all()
+                self._save_snapshot()
+            # Watch closed by the server timeout, the resume point is still valid
+            with self._condition:
+                self._last_sync = time.monotonic()
+                self._live.set()
+                self._condition.notify_all()
+            self._save_snapshot(force=True)
+        finally:
+            w.stop()
+
+    def _run(self):
+        v1 = ClientRegistry.get_core_v1()
+        store = StateStore.get_state_store()
+        if store is not None:
+            try:
+                self._restore(store)
+            except Exception as e:
+                logging.debug(f"Restoring pod cache {self.namespace}/{self.label_selector} failed: {e}")
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self._list(v1)
+                self._watch(v1)
+            except ApiException as e:
+                if e.status == 410:
+                    self.resource_version = None
+                else:
+                    logging.debug(f"Pod watch for {self.namespace}/{self.label_selector} failed: {e}")
+                    time.sleep(INFORMER_RETRY_SECONDS)
+            except Exception as e:
+                logging.debug(f"Pod watch for {self.namespace}/{self.label_selector} failed: {e}")
+                self.resource_version = None
+                time.sleep(INFORMER_RETRY_SECONDS)
+
+
+_informers = {}
+_informers_lock = threading.Lock()
+
+
+# Function to get the process-wide informer for a namespace/label selector, starting it on first use
+def get_pod_informer(namespace, label_selector) -> PodInformer:
+    key = (namespace, label_selector)
+    with _informers_lock:
+        informer = _informers.get(key)
+        if informer is None:
+            informer = PodInformer(namespace=namespace, label_selector=label_selector)
+            _informers[key] = informer
+    return informer.start()
+
+
+# Function to stop the process-wide informer for a namespace/label selector and forget it, the next
+# get_pod_informer starts a fresh one
+def remove_pod_informer(namespace, label_selector):
+    with _informers_lock:
+        informer = _informers.pop((namespace, label_selector), None)
+    if informer is not None:
+        informer.stop()
+
+
+# Function to get hit/miss and staleness counters of every informer in the process
+def get_informer_stats() -> list:
+    with _informers_lock:
+        return [informer.stats() for informer in _informers.values()]
+
+
+def _informer_gauge(stat):
+    return lambda: [({'namespace': s['namespace'], 'selector': s['label_selector']}, s[stat])
+                    for s in get_informer_stats()]
+
+
+Telemetry.metrics.gauge("jupyterlab_pod_cache_hits", "Pod queries answered from the informer cache",
+                        _informer_gauge('cache_hits'))
+Telemetry.metrics.gauge("jupyterlab_pod_cache_misses", "Pod queries that waited for the informer to sync",
+                        _informer_gauge('cache_misses'))
+Telemetry.metrics.gauge("jupyterlab_pod_cache_staleness_seconds", "Seconds since the informer heard from the API server",
+                        _informer_gauge('staleness_seconds'))
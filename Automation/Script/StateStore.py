@@ -0,0 +1,192 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from Automation.Constant.Constant import *
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS clusters (
+        api_server TEXT NOT NULL, namespace TEXT NOT NULL, deployment_name TEXT NOT NULL,
+        replica_count INTEGER, image TEXT, frozen_image TEXT, frozen_packages TEXT, desired_packages TEXT,
+        is_active INTEGER, updated_at REAL NOT NULL,
+        PRIMARY KEY (api_server, namespace, deployment_name))""",
+    """CREATE TABLE IF NOT EXISTS pod_inventories (
+        api_server TEXT NOT NULL, pod_uid TEXT NOT NULL, image TEXT NOT NULL, restart_count INTEGER NOT NULL,
+        namespace TEXT NOT NULL, pod_name TEXT NOT NULL, packages TEXT NOT NULL, updated_at REAL NOT NULL,
+        PRIMARY KEY (api_server, pod_uid, image))""",
+    "CREATE INDEX IF NOT EXISTS pod_inventories_pod ON pod_inventories (api_server, namespace, pod_name)",
+    """CREATE TABLE IF NOT EXISTS pod_snapshots (
+        api_server TEXT NOT NULL, namespace TEXT NOT NULL, label_selector TEXT NOT NULL,
+        resource_version TEXT NOT NULL, pods TEXT NOT NULL, updated_at REAL NOT NULL,
+        PRIMARY KEY (api_server, namespace, label_selector))""",
+]
+CLUSTER_FIELDS = ('replica_count', 'image', 'frozen_image', 'frozen_packages', 'desired_packages', 'is_active')
+JSON_FIELDS = ('frozen_packages', 'desired_packages')
+
+
+# SQLite store of the state a process would otherwise rediscover from the cluster: each cluster's spec and
+# desired packages, pod package inventories and the pod informers' last snapshot with its resourceVersion.
+# The database runs in WAL mode with a busy timeout, every thread uses its own connection, and read-modify-write
+# updates run in BEGIN IMMEDIATE transactions, so several worker processes can share one file
+class StateStore:
+    def __init__(self, path=STATE_STORE_PATH, busy_timeout_seconds=STATE_STORE_BUSY_TIMEOUT_SECONDS):
+        self.path = path
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self._local = threading.local()
+        with self._transaction() as connection:
+            # Inventories stored before they were keyed by API server are dropped, they are only a cache
+            columns = [row['name'] for row in connection.execute("PRAGMA table_info(pod_inventories)")]
+            if columns and 'api_server' not in columns:
+                connection.execute("DROP TABLE pod_inventories")
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        # A connection must not be used across a fork, the child opens its own
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_seconds, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_seconds * 1000)}")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    # ---- clusters ----
+
+    # Function to get the stored state of a cluster, None if the cluster was never stored
+    def get_cluster(self, api_server, namespace, deployment_name):
+        row = self._connection().execute(
+            "SELECT * FROM clusters WHERE api_server = ? AND namespace = ? AND deployment_name = ?",
+            (api_server, namespace, deployment_name)).fetchone()
+        if row is None:
+            return None
+        cluster = {field: row[field] for field in CLUSTER_FIELDS + ('updated_at',)}
+        for field in JSON_FIELDS:
+            cluster[field] = None if cluster[field] is None else json.loads(cluster[field])
+        cluster['is_active'] = bool(cluster['is_active'])
+        return cluster
+
+    # Function to store the given fields of a cluster (see CLUSTER_FIELDS), the other fields keep their value
+    def save_cluster(self, api_server, namespace, deployment_name, **fields):
+        with self._transaction() as connection:
+            self._save_cluster(connection, api_server, namespace, deployment_name, fields)
+
+    @staticmethod
+    def _save_cluster(connection, api_server, namespace, deployment_name, fields):
+        unknown = set(fields) - set(CLUSTER_FIELDS)
+        if unknown:
+            raise Exception(f"ERROR: Unknown cluster fields {sorted(unknown)}\n")
+        values = {field: json.dumps(value) if field in JSON_FIELDS and value is not None else value
+                  for field, value in fields.items()}
+        if 'is_active' in values:
+            values['is_active'] = int(bool(values['is_active']))
+        columns = list(values) + ['updated_at']
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        connection.execute(
+            f"INSERT INTO clusters (api_server, namespace, deployment_name, {', '.join(columns)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT (api_server, namespace, deployment_name) DO UPDATE SET {updates}",
+            (api_server, namespace, deployment_name, *values.values(), time.time()))
+
+    # Function to atomically replace a cluster's desired packages with fn(current desired packages), so
+    # concurrent updates from several processes are not lost. Returns the new list
+    def update_desired_packages(self, api_server, namespace, deployment_name, fn) -> list:
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT desired_packages FROM clusters WHERE api_server = ? AND namespace = ? AND deployment_name = ?",
+                (api_server, namespace, deployment_name)).fetchone()
+            current = None if row is None or row['desired_packages'] is None else json.loads(row['desired_packages'])
+            desired_packages = fn(current)
+            self._save_cluster(connection, api_server, namespace, deployment_name,
+                               {'desired_packages': desired_packages})
+        return desired_packages
+
+    # ---- pod package inventories ----
+
+    # Function to get the stored inventory of a pod: restart_count, packages and updated_at, or None
+    def get_inventory(self, api_server, pod_uid, image):
+        row = self._connection().execute(
+            "SELECT restart_count, packages, updated_at FROM pod_inventories "
+            "WHERE api_server = ? AND pod_uid = ? AND image = ?", (api_server, pod_uid, image)).fetchone()
+        if row is None:
+            return None
+        return {'restart_count': row['restart_count'], 'packages': json.loads(row['packages']),
+                'updated_at': row['updated_at']}
+
+    # Function to get when the inventory of a pod was stored, None if it is not stored
+    def get_inventory_stamp(self, api_server, pod_uid, image):
+        row = self._connection().execute(
+            "SELECT updated_at FROM pod_inventories WHERE api_server = ? AND pod_uid = ? AND image = ?",
+            (api_server, pod_uid, image)).fetchone()
+        return None if row is None else row['updated_at']
+
+    # Function to store the inventory of a pod, returns its updated_at stamp
+    def save_inventory(self, api_server, pod_uid, image, restart_count, namespace, pod_name, packages) -> float:
+        updated_at = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO pod_inventories "
+                "(api_server, pod_uid, image, restart_count, namespace, pod_name, packages, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (api_server, pod_uid, image, restart_count, namespace, pod_name, json.dumps(packages), updated_at))
+        return updated_at
+
+    # Function to delete the stored inventories of a pod, of every image it ran
+    def delete_inventory(self, api_server, namespace, pod_name):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM pod_inventories WHERE api_server = ? AND namespace = ? AND pod_name = ?",
+                               (api_server, namespace, pod_name))
+
+    # ---- pod informer snapshots ----
+
+    # Function to get the last stored pod snapshot of an informer: resource_version, pods and updated_at, or None
+    def get_pod_snapshot(self, api_server, namespace, label_selector):
+        row = self._connection().execute(
+            "SELECT resource_version, pods, updated_at FROM pod_snapshots "
+            "WHERE api_server = ? AND namespace = ? AND label_selector = ?",
+            (api_server, namespace, label_selector)).fetchone()
+        if row is None:
+            return None
+        return {'resource_version': row['resource_version'], 'pods': json.loads(row['pods']),
+                'updated_at': row['updated_at']}
+
+    def save_pod_snapshot(self, api_server, namespace, label_selector, resource_version, pods):
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO pod_snapshots "
+                "(api_server, namespace, label_selector, resource_version, pods, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (api_server, namespace, label_selector, resource_version, json.dumps(pods), time.time()))
+
+
+_state_store = None
+
+
+# Function to open the process-wide state store. Without it clients, informers and the package inventory keep
+# their state in memory only
+def configure_state_store(path=STATE_STORE_PATH) -> StateStore:
+    global _state_store
+    _state_store = StateStore(path)
+    return _state_store
+
+
+# Function to get the process-wide state store, None when none is configured
+def get_state_store():
+    return _state_store
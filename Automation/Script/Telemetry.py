@@ -0,0 +1,217 @@
+import bisect
+import collections
+import contextlib
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Automation.Constant.Constant import *
+
+LOG_FORMAT = '%(asctime)s %(lineno)d [%(threadName)s] %(levelname)s %(filename)s [%(funcName)s] %(message)s'
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RECENT_SPANS = 1000
+
+
+def _label_key(labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+# Function to escape a label value as the text exposition format requires: backslash, double quote and newline
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_key, extra=()) -> str:
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# Process-wide metrics, rendered in the Prometheus text exposition format
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    # Function to register a gauge read at scrape time, fn returns a number or a list of (labels, number)
+    def gauge(self, name, help_text, fn):
+        with self._lock:
+            self._gauges[name] = (help_text, fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            gauges = list(self._gauges.items())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        for name, (help_text, fn) in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            try:
+                values = fn()
+            except Exception as e:
+                logging.debug(f"Gauge {name} failed: {e}")
+                continue
+            for labels, value in values if isinstance(values, list) else [({}, values)]:
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+phase_duration_seconds = metrics.histogram("jupyterlab_phase_duration_seconds",
+                                           "Duration of cluster lifecycle phases")
+phase_total = metrics.counter("jupyterlab_phase_total", "Cluster lifecycle phases by result")
+
+_spans = collections.deque(maxlen=RECENT_SPANS)
+_local = threading.local()
+
+
+# Context manager timing one lifecycle phase. The duration is recorded in the phase histogram (labeled by
+# phase only, to keep the cardinality low) and the span with its attributes is kept for get_recent_spans
+@contextlib.contextmanager
+def span(phase, **attributes):
+    parent = getattr(_local, 'phase', None)
+    _local.phase = phase if parent is None else f"{parent}/{phase}"
+    start_time = time.perf_counter()
+    result = "ok"
+    try:
+        yield attributes
+    except Exception:
+        result = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start_time
+        if attributes.get('result') is False:
+            result = "failed"
+        phase_duration_seconds.observe(elapsed, phase=phase)
+        phase_total.inc(phase=phase, result=result)
+        _spans.append({'name': _local.phase, 'seconds': elapsed, 'result': result, 'attributes': dict(attributes)})
+        logging.debug(f"span {_local.phase} {result} in {elapsed:.3f}s {attributes}")
+        _local.phase = parent
+
+
+def get_recent_spans() -> list:
+    return list(_spans)
+
+
+# Serves the metrics on /metrics, returns the server (call shutdown() to stop it)
+def start_metrics_server(port, address="0.0.0.0") -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
+
+
+# Drops the given share of records below INFO, so DEBUG chatter can be kept at a fraction of its volume
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record) -> bool:
+        return record.levelno >= logging.INFO or random.random() < self.sample_rate
+
+
+_listener = None
+
+
+# Function to send log records through a queue to a background writer, so callers never block on file I/O.
+# The kubernetes client and urllib3 loggers are capped at WARNING, they would otherwise log full response bodies
+def configure_logging(level=logging.INFO, filename=LOG_OUTPUT_PATH, debug_sample_rate=1.0,
+                      library_level=logging.WARNING):
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    if debug_sample_rate < 1.0:
+        queue_handler.addFilter(SamplingFilter(debug_sample_rate))
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name in ("kubernetes", "urllib3", "websocket"):
+        logging.getLogger(name).setLevel(library_level)
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
@@ -1,7 +1,13 @@
+import logging
+
 import DeploymentClient
 import KubernetesHelper
+import StateStore
+import Telemetry
 
 if __name__ == "__main__":
+    Telemetry.configure_logging(level=logging.DEBUG)
+    StateStore.configure_state_store()
     obj = DeploymentClient.DeploymentClient("jupyterlab", "poc", "1", "jupyterlab:3.2")
 
 
@@ -30,9 +36,6 @@ if __name__ == "__main__":
 
     # print(f"State: {obj.is_active}")
 
-    # u = KubernetesHelper.get_newly_launched_pods("jupyterlab", "poc")
-    # print(u)
-
     # m = obj.get_python_package_present_in_cluster("pan")
     # print(m)
 
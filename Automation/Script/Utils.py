@@ -1,4 +1,7 @@
+import json
 import os
+import re
+
 import yaml
 
 class Utils:
@@ -14,16 +17,34 @@ class Utils:
         output_file.write(data)
         output_file.close()
 
-    # Function to extract python package and version from complex object
+    # Function to extract python package and version from the output of pip list --format=json
+    @staticmethod
+    def extract_python_packages_from_json(data):
+        return {package['name']: package['version'] for package in json.loads(data)}
+
+    # Function to normalize a python package name, as pip compares them (PEP 503)
+    @staticmethod
+    def canonicalize_package_name(name):
+        return re.sub(r"[-_.]+", "-", name).lower()
+
+    # Function to get the package name from a requirement specifier like "pandas==1.5.1"
+    @staticmethod
+    def requirement_name(requirement):
+        match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+        return Utils.canonicalize_package_name(match.group(1)) if match else ""
+
+    # Function to map each requirement to whether pip's output shows it installed or already satisfied
     @staticmethod
-    def extract_python_packages_details(data, python_package_map):
-        packages_version_list = data.split("\n")
-        for ctr, temp in enumerate(packages_version_list):
-            package_version_list = temp.split(" ")
-            package_name = str(package_version_list[0])
-            package_version = str(package_version_list[len(package_version_list) - 1])
-            if package_name != "Package" and package_name != "" and package_name.isalpha() and package_version != "":
-                python_package_map[package_name] = package_version
+    def extract_pip_install_results(packages_list, pip_output):
+        present = set()
+        for line in pip_output.split("\n"):
+            line = line.strip()
+            if line.startswith("Requirement already satisfied:"):
+                present.add(Utils.requirement_name(line[len("Requirement already satisfied:"):]))
+            elif line.startswith("Successfully installed "):
+                for name_version in line[len("Successfully installed "):].split():
+                    present.add(Utils.canonicalize_package_name(name_version.rsplit("-", 1)[0]))
+        return {package: Utils.requirement_name(package) in present for package in packages_list}
 
     @staticmethod
     def write_to_yaml_file(output_path, output_file_name, k8s_object_yaml):
@@ -0,0 +1,129 @@
+import collections
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from kubernetes.client.rest import ApiException
+
+import ClientRegistry
+import KubernetesHelper
+import PodInformer
+from Automation.Constant.Constant import *
+
+CLAIM_LATENCY_SAMPLES = 1000
+
+
+# Pre-started JupyterLab pods of one image, without the app label of any cluster. A cluster claims pods by
+# relabeling them into its selector, and the pool refills in the background to a size following recent demand
+class WarmPool:
+    def __init__(self, namespace, image, min_size=WARM_POOL_MIN_SIZE, max_size=WARM_POOL_MAX_SIZE,
+                 demand_window_seconds=WARM_POOL_DEMAND_WINDOW_SECONDS):
+        self.namespace = namespace
+        self.image = image
+        self.min_size = min_size
+        self.max_size = max_size
+        self.demand_window_seconds = demand_window_seconds
+        self.pool_key = hashlib.sha256(image.encode()).hexdigest()[:16]
+        self.informer = PodInformer.get_pod_informer(namespace=namespace,
+                                                     label_selector=f"{WARM_POOL_LABEL}={self.pool_key}")
+        self._lock = threading.Lock()
+        self._claims = collections.deque()
+        self._claim_latency_seconds = collections.deque(maxlen=CLAIM_LATENCY_SAMPLES)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    # Function to get the pool size to keep, the number of pods claimed within the demand window
+    def target_size(self) -> int:
+        with self._lock:
+            cutoff = time.monotonic() - self.demand_window_seconds
+            while self._claims and self._claims[0][0] < cutoff:
+                self._claims.popleft()
+            demand = sum(count for _, count in self._claims)
+        return max(self.min_size, min(self.max_size, demand))
+
+    # Function to render the pool pod from the cluster template, so pool pods match cluster pods. The packages
+    # ConfigMap it mounts never exists, pool pods start with the image's packages only
+    def _pod_manifest(self) -> dict:
+        properties_map = {'deployment_name': f"warm-{self.pool_key}", 'namespace': str(self.namespace),
+                          'replica_count': '1', 'image': str(self.image)}
+        k8s_objects = KubernetesHelper.create_k8s_yaml(yaml_template_file=YAML_FILE_TEMPLATE,
+                                                       properties_map=properties_map)
+        deployment = next(obj for obj in k8s_objects if obj['kind'] == "Deployment")
+        return {"apiVersion": "v1", "kind": "Pod",
+                "metadata": {"generateName": f"warm-{self.pool_key}-", "labels": {WARM_POOL_LABEL: self.pool_key}},
+                "spec": deployment['spec']['template']['spec']}
+
+    # Function to create pool pods until the pool reaches its target size, returns the number created. Pool pods
+    # that terminated (e.g. evicted) never start again, they are deleted and replaced
+    def refill(self) -> int:
+        pods = [pod for pod in self.informer.get_pods() if not pod['metadata'].get('deletionTimestamp')]
+        for pod in pods:
+            if PodInformer.is_pod_terminated(pod):
+                KubernetesHelper.delete_pod(pod['metadata']['name'], self.namespace)
+        pods = [pod for pod in pods if not PodInformer.is_pod_terminated(pod)]
+        missing = self.target_size() - len(pods)
+        for _ in range(max(0, missing)):
+            KubernetesHelper.create_pod(self.namespace, self._pod_manifest())
+        if missing > 0:
+            logging.debug(f"Warm pool {self.pool_key} refilled with {missing} pods")
+        return max(0, missing)
+
+    # Function to claim up to count ready pods for a cluster, returns the names of the claimed pods
+    def claim(self, deployment_name, count) -> list:
+        start_time = time.perf_counter()
+        core_v1 = ClientRegistry.get_core_v1()
+        claimed = []
+        with self._lock:
+            self._claims.append((time.monotonic(), count))
+            for pod in self.informer.get_pods():
+                if len(claimed) == count:
+                    break
+                if not PodInformer.is_pod_ready(pod):
+                    continue
+                # The resourceVersion precondition makes concurrent claims of the same pod fail with a conflict
+                body = {"metadata": {"resourceVersion": pod['metadata']['resourceVersion'],
+                                     "labels": {WARM_POOL_LABEL: None, "app": deployment_name,
+                                                WARM_POOL_CLAIMED_LABEL: deployment_name}}}
+                try:
+                    core_v1.patch_namespaced_pod(pod['metadata']['name'], self.namespace, body)
+                    claimed.append(pod['metadata']['name'])
+                except ApiException as e:
+                    if e.status not in (404, 409):
+                        raise
+            self.hits += len(claimed)
+            self.misses += count - len(claimed)
+            self._claim_latency_seconds.append(time.perf_counter() - start_time)
+        logging.debug(f"Claimed {len(claimed)}/{count} warm pods for cluster {deployment_name}")
+        return claimed
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._claim_latency_seconds)
+        p95 = latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.95) - 1)] if latencies else 0.0
+        ready = sum(1 for pod in self.informer.get_pods() if PodInformer.is_pod_ready(pod))
+        return {'image': self.image, 'ready_pods': ready, 'target_size': self.target_size(), 'hits': self.hits,
+                'misses': self.misses, 'claim_latency_p95_seconds': p95}
+
+    def start(self, interval_seconds=WARM_POOL_REFILL_INTERVAL_SECONDS):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, args=[interval_seconds], daemon=True,
+                                            name=f"warm-pool-{self.pool_key}")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def _run(self, interval_seconds):
+        while not self._stopped.is_set():
+            try:
+                self.refill()
+            except Exception as e:
+                logging.debug(f"Warm pool {self.pool_key} refill failed: {e}")
+            self._stopped.wait(interval_seconds)
@@ -0,0 +1,160 @@
+import hashlib
+import io
+import logging
+import os
+import shlex
+import tarfile
+import threading
+
+import ExecEngine
+import KubernetesHelper
+import PodInformer
+from Automation.Constant.Constant import *
+
+
+# Function to get the sha256 digest of a file, as pip --require-hashes expects it
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Cluster-local wheelhouse: wheels are built once, in the cluster, and every pod of the namespace installs them
+# offline from one shared copy, served by a small index (a Deployment and ClusterIP Service named name, see
+# Template/wheelhouse.yaml). Wheels are built by pip in the wheelhouse pod, which runs image: use the clusters'
+# image so the wheels match their platform and Python version. Wheels found in local_dir are uploaded to it once,
+# with offline the wheelhouse only resolves from those, which works without network access. Notebook pods only
+# read the index, so their users cannot plant wheels other pods install, and installs are pinned to the sha256
+# of the wheels built here
+class Wheelhouse:
+    def __init__(self, namespace, image, local_dir=None, name=WHEELHOUSE_NAME, pod_path=WHEELHOUSE_POD_PATH,
+                 pip_args=None, offline=False):
+        self.namespace = namespace
+        self.image = image
+        self.local_dir = local_dir
+        self.name = name
+        self.pod_path = pod_path
+        self.pip_args = pip_args or []
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._started = False
+        # sorted requirements -> hash-pinned requirements of every wheel they resolved to
+        self._pinned_requirements = {}
+
+    # Function to get the host name pods reach the wheelhouse index at
+    def get_host(self) -> str:
+        return f"{self.name}.{self.namespace}.svc"
+
+    def get_index_url(self) -> str:
+        return f"http://{self.get_host()}:{WHEELHOUSE_PORT}/"
+
+    def local_wheel_files(self) -> list:
+        if self.local_dir is None:
+            return []
+        return sorted(f for f in os.listdir(self.local_dir) if f.endswith(".whl"))
+
+    # Function to deploy the wheelhouse index if it is not running yet, and wait for its pod
+    def start(self, timeout_seconds=CLUSTER_READY_TIMEOUT_SECONDS) -> bool:
+        with self._lock:
+            if self._started:
+                return True
+            k8s_objects = KubernetesHelper.create_k8s_yaml(yaml_template_file=WHEELHOUSE_TEMPLATE, properties_map={
+                'name': self.name, 'image': str(self.image), 'port': str(WHEELHOUSE_PORT), 'pod_path': self.pod_path})
+            if not KubernetesHelper.create_using_yaml(k8s_objects, self.namespace):
+                return False
+            self._started = KubernetesHelper.wait_for_ready_pods(deployment_name=self.name, namespace=self.namespace,
+                                                                 target_count=1, timeout_seconds=timeout_seconds)
+            if not self._started:
+                logging.debug(f"Wheelhouse {self.name} did not get ready within {timeout_seconds} second(s)")
+            return self._started
+
+    # Function to delete the wheelhouse index, with every wheel it holds
+    def delete(self) -> bool:
+        with self._lock:
+            KubernetesHelper.delete_deployment(self.name, self.namespace)
+            KubernetesHelper.delete_service(self.name, self.namespace)
+            PodInformer.remove_pod_informer(namespace=self.namespace, label_selector=f"app={self.name}")
+            self._started = False
+            self._pinned_requirements = {}
+            return True
+
+    def _get_server_pod(self) -> str:
+        informer = PodInformer.get_pod_informer(namespace=self.namespace, label_selector=f"app={self.name}")
+        for pod in informer.get_pods():
+            if PodInformer.is_pod_ready(pod):
+                return pod['metadata']['name']
+        raise Exception(f"ERROR: Wheelhouse {self.name} has no ready pod\n")
+
+    def _run_in_pod(self, command, stdin=None) -> tuple:
+        stdout, stderr, returncode = ExecEngine.exec_in_pod(self._get_server_pod(), self.namespace,
+                                                            ["/bin/sh", "-c", command], stdin=stdin)
+        if stderr:
+            logging.debug(stderr)
+        return returncode, stdout
+
+    # Function to copy the local wheels the wheelhouse does not have yet, as one tar archive over exec stdin
+    def upload_local_wheels(self) -> bool:
+        returncode, stdout = self._run_in_pod(f"ls {self.pod_path}")
+        missing = [f for f in self.local_wheel_files() if f not in set(stdout.split())]
+        if returncode != 0 or not missing:
+            return returncode == 0
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for wheel in missing:
+                tar.add(os.path.join(self.local_dir, wheel), arcname=wheel)
+        archive = buffer.getvalue()
+        logging.debug(f"Uploading {len(missing)} wheels ({len(archive)} bytes) to wheelhouse {self.name}")
+        returncode, _ = self._run_in_pod(f"head -c {len(archive)} | tar xf - -C {self.pod_path}", stdin=archive)
+        return returncode == 0
+
+    # Function to resolve and build wheels for the packages (and their dependencies) in the wheelhouse pod. Wheels
+    # already in the wheelhouse are reused, with offline they are the only ones the packages resolve from
+    def build(self, packages_list, offline=None) -> bool:
+        offline = self.offline if offline is None else offline
+        if not self.start() or not self.upload_local_wheels():
+            logging.debug(f"Wheelhouse {self.name} is not available")
+            return False
+        requirements = "\n".join(packages_list) + "\n"
+        options = " ".join([f"--find-links {self.pod_path}"] + (["--no-index"] if offline else [])
+                           + [shlex.quote(arg) for arg in self.pip_args])
+        # Building into an empty directory leaves exactly the wheels the packages resolve to, their digests are
+        # printed before they move into the served directory
+        command = (f"build_dir=$(mktemp -d) && head -c {len(requirements.encode())} > \"$build_dir/requirements.txt\" && "
+                   f"pip3 wheel --disable-pip-version-check --wheel-dir \"$build_dir/wheels\" {options} "
+                   f"-r \"$build_dir/requirements.txt\" && cd \"$build_dir/wheels\" && sha256sum *.whl && "
+                   f"mv *.whl {self.pod_path}/; status=$?; rm -rf \"$build_dir\"; exit $status")
+        logging.debug(f"Building wheels for {packages_list} in wheelhouse {self.name}")
+        returncode, stdout = self._run_in_pod(command, stdin=requirements)
+        if returncode != 0:
+            logging.debug(f"Wheel build failed for {packages_list}")
+            return False
+        pinned_requirements = []
+        for line in stdout.splitlines():
+            digest, _, wheel = line.partition("  ")
+            if wheel.endswith(".whl"):
+                name, version = os.path.basename(wheel).split("-")[:2]
+                pinned_requirements.append(f"{name}=={version} --hash=sha256:{digest}")
+        with self._lock:
+            self._pinned_requirements[tuple(sorted(packages_list))] = "\n".join(sorted(pinned_requirements)) + "\n"
+        return True
+
+    # Function to get the requirements file installing the packages from the wheelhouse index only, every wheel
+    # pinned to its hash. Packages not built yet are resolved from the wheels already in the wheelhouse
+    def requirements_for(self, packages_list):
+        key = tuple(sorted(packages_list))
+        with self._lock:
+            pinned_requirements = self._pinned_requirements.get(key)
+        if pinned_requirements is None and self.build(packages_list, offline=True):
+            with self._lock:
+                pinned_requirements = self._pinned_requirements.get(key)
+        if pinned_requirements is None:
+            return None
+        return (f"--no-index\n--find-links {self.get_index_url()}\n--trusted-host {self.get_host()}\n"
+                f"{pinned_requirements}")
+
+    # Function to get the pip install command for a requirements_for file
+    def pip_install_command(self) -> str:
+        return "pip3 install --require-hashes"
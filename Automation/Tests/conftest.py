@@ -0,0 +1,36 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "Automation", "Script")]
+
+import ClientRegistry
+import FakeApiServer
+
+
+# One stand-in API server for the whole run, every test works in its own namespace
+@pytest.fixture(scope="session")
+def api_server():
+    server = FakeApiServer.FakeApiServer(pending_seconds=0.1).start()
+    ClientRegistry.set_configuration(server.client_configuration())
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def namespace():
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+# Where clients of a test write cluster yaml files, instead of the repository's Output directory
+@pytest.fixture
+def output_path(tmp_path):
+    return str(tmp_path)
+
+
+def pod_packages(server, namespace) -> dict:
+    return {name: server.pod_packages[pod['metadata']['uid']]
+            for (pod_namespace, name), pod in list(server.pods.items()) if pod_namespace == namespace}
@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+from kubernetes_asyncio import client
+
+import AsyncDeploymentClient
+import StateStore
+import Wheelhouse
+from Automation.Constant.Constant import *
+from conftest import pod_packages
+
+
+@pytest.fixture
+def async_configuration(api_server):
+    configuration = client.Configuration()
+    configuration.host = api_server.url
+    AsyncDeploymentClient.set_configuration(configuration)
+
+
+@pytest.fixture
+def async_client(async_configuration, namespace):
+    return AsyncDeploymentClient.AsyncDeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.mark.parametrize("output, expected", [
+    ("Successfully installed\n__exit_code=0\n", (0, "Successfully installed\n")),
+    ("ERROR: No matching distribution\n__exit_code=1\n", (1, "ERROR: No matching distribution\n")),
+    ("__exit_code=0 in the output\n__exit_code=2\n", (2, "__exit_code=0 in the output\n")),
+    ("stream cut before the marker", (1, "stream cut before the marker")),
+    ("", (1, "")),
+    ("garbled\n__exit_code=\n", (1, "garbled\n__exit_code=\n")),
+])
+def test_parse_exec_output(output, expected):
+    assert AsyncDeploymentClient.parse_exec_output(output) == expected
+
+
+def test_create_uses_server_side_apply(api_server, async_client):
+    applied_before = api_server.request_counts["apply deployments"]
+
+    async def scenario():
+        try:
+            assert await async_client.create_cluster(timeout_seconds=30)
+            # Applying the same objects again updates them instead of failing on AlreadyExists
+            assert await async_client.create_cluster(timeout_seconds=30)
+            return await async_client.get_pods_and_status_of_deployment()
+        finally:
+            await async_client.delete_cluster(skip_is_active_check=True)
+            await async_client.close()
+
+    assert list(run(scenario()).values()) == ["Running", "Running"]
+    assert api_server.request_counts["apply deployments"] - applied_before == 2
+
+
+def test_scale_installs_only_the_delta(api_server, namespace, async_client):
+    async def scenario():
+        try:
+            assert await async_client.create_cluster(timeout_seconds=30)
+            assert await async_client.install_python_package_in_cluster("pandas>=1.5") == (2, 2)
+            assert await async_client.scale_cluster(3, timeout_seconds=30)
+            assert async_client.desired_packages[-1] == "pandas>=1.5"
+            # The specifier is honoured: every pod, the new one included, has a pandas it allows
+            assert {packages.get("pandas") for packages in pod_packages(api_server, namespace).values()} == {"1.5"}
+            # Every pod converged, a second pass has nothing to check
+            return await async_client.reconcile_once()
+        finally:
+            await async_client.delete_cluster(skip_is_active_check=True)
+            await async_client.close()
+
+    assert run(scenario()) == {}
+
+
+def test_requirements_are_quoted(async_client, monkeypatch):
+    commands = []
+
+    async def exec_in_pod(pod_name, command):
+        commands.append(command)
+        return 0, "Successfully installed numpy-1.5 pandas-1.0\n"
+
+    monkeypatch.setattr(async_client, "exec_in_pod", exec_in_pod)
+    assert run(async_client.install_python_package_in_pod("pod", "numpy>=1.5"))
+    run(async_client.install_python_packages_in_pod("pod", ["numpy>=1.5", "pandas<2"]))
+    # Unquoted, the shell would redirect pip's output to a file named "=1.5"
+    assert commands == ["pip3 install 'numpy>=1.5'", "pip3 install 'numpy>=1.5' 'pandas<2'"]
+
+
+def test_empty_cluster_has_no_desired_packages(async_client):
+    async def scenario():
+        try:
+            return await async_client.get_desired_packages()
+        finally:
+            await async_client.close()
+
+    assert run(scenario()) == []
+
+
+def test_cluster_install_counts_out_pods_that_fail(async_client, monkeypatch):
+    async def get_pods_and_status_of_deployment():
+        return {"pod-0": "Running", "pod-1": "Running", "pod-2": "Pending"}
+
+    async def install_python_package_in_pod(pod_name, package):
+        if pod_name == "pod-0":
+            raise Exception("ERROR: exec stream closed\n")
+        return True
+
+    async def save_packages_configmap():
+        return True
+
+    async_client.desired_packages = []
+    monkeypatch.setattr(async_client, "get_pods_and_status_of_deployment", get_pods_and_status_of_deployment)
+    monkeypatch.setattr(async_client, "install_python_package_in_pod", install_python_package_in_pod)
+    monkeypatch.setattr(async_client, "save_packages_configmap", save_packages_configmap)
+    # The failing pod does not take the other pod's result down with it
+    assert run(async_client.install_python_package_in_cluster("pandas")) == (1, 3)
+    assert async_client.desired_packages == ["pandas"]
+
+
+def test_wheelhouse_installs_and_stored_state(api_server, namespace, async_configuration, tmp_path):
+    (tmp_path / "pandas-1.5.3-py3-none-any.whl").write_bytes(b"pandas 1.5.3 wheel")
+    wheelhouse = Wheelhouse.Wheelhouse(namespace, "jupyterlab:3.4", local_dir=str(tmp_path), offline=True)
+    store = StateStore.StateStore(str(tmp_path / "state.db"))
+    async_client = AsyncDeploymentClient.AsyncDeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4",
+                                                               wheelhouse=wheelhouse, state_store=store)
+
+    async def scenario():
+        try:
+            assert await async_client.create_cluster(timeout_seconds=30)
+            assert await async_client.install_python_package_in_cluster("pandas==1.5.3") == (2, 2)
+            # A client started later picks the cluster up from the store
+            restored = AsyncDeploymentClient.AsyncDeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4",
+                                                                   state_store=store)
+            assert (restored.is_active, restored.replica_count, restored.desired_packages) == (
+                True, 2, ["pandas==1.5.3"])
+            # Installs went through the hash-pinned wheelhouse index
+            assert api_server.request_counts["wheelhouse index"] >= 2
+            assert all(packages['pandas'] == "1.5.3" for name, packages in pod_packages(api_server, namespace).items()
+                       if not name.startswith(WHEELHOUSE_NAME))
+        finally:
+            await async_client.delete_cluster()
+            await async_client.close()
+            wheelhouse.delete()
+
+    run(scenario())
+    assert not store.get_cluster(async_client.api_server, namespace, "jupyterlab")['is_active']
+
+
+def test_update_image_rolls_out_with_the_packages(api_server, namespace, async_client):
+    async def scenario():
+        try:
+            assert await async_client.create_cluster(timeout_seconds=30)
+            assert await async_client.install_python_package_in_cluster("pandas==1.5.3") == (2, 2)
+            assert await async_client.update_image("jupyterlab:3.5", timeout_seconds=60)
+            assert {pod['spec']['containers'][0]['image'] for pod in await async_client.get_pods()} == {
+                "jupyterlab:3.5"}
+            # The new pods installed the cluster's packages before they turned ready
+            assert {packages.get("pandas") for packages in pod_packages(api_server, namespace).values()} == {"1.5.3"}
+            assert async_client.image == "jupyterlab:3.5"
+        finally:
+            await async_client.delete_cluster(skip_is_active_check=True)
+            await async_client.close()
+
+    run(scenario())
@@ -0,0 +1,144 @@
+import logging
+
+import pytest
+
+import Autoscaler
+import DeploymentClient
+import FakeApiServer
+import KubernetesHelper
+import PodInformer
+
+
+# JupyterLab of every pod, reached directly through its endpoint function or through the API server's pod proxy
+@pytest.fixture(scope="module")
+def jupyterlab(api_server):
+    server = FakeApiServer.FakeJupyterLabServer().start()
+    api_server.jupyterlab = server
+    yield server
+    api_server.jupyterlab = None
+    server.stop()
+
+
+def sample(active, kernels=0, last_activity=None, memory_bytes=0) -> dict:
+    return {'active': active, 'kernels': kernels, 'sessions': kernels, 'last_activity': last_activity,
+            'memory_bytes': memory_bytes}
+
+
+def test_target_keeps_active_pods_at_target_utilization():
+    autoscaler = Autoscaler.Autoscaler(None, min_replicas=0, max_replicas=5, target_utilization=0.5,
+                                       scale_to_zero_seconds=60)
+    assert autoscaler.compute_target({'a': sample(True), 'b': sample(True), 'c': sample(False)}, 1000.0) == 4
+    assert autoscaler.compute_target({name: sample(True) for name in "abc"}, 1000.0) == 5
+    # Idle, but not for scale_to_zero_seconds yet
+    assert autoscaler.compute_target({'a': sample(False)}, 1030.0) == 1
+    assert autoscaler.compute_target({'a': sample(False)}, 1061.0) == 0
+    autoscaler.min_replicas = 1
+    assert autoscaler.compute_target({}, 2000.0) == 1
+
+
+def test_idle_pods_without_kernels_are_removed_first():
+    samples = {'active': sample(True), 'idle-kernel': sample(False, kernels=1, last_activity=100.0),
+               'empty-large': sample(False, memory_bytes=500), 'empty-small': sample(False, memory_bytes=100)}
+    assert Autoscaler.Autoscaler.get_pods_to_remove(samples, 2) == ['empty-small', 'empty-large']
+    assert Autoscaler.Autoscaler.get_pods_to_remove(samples, 4) == ['empty-small', 'empty-large', 'idle-kernel']
+
+
+def test_scale_down_waits_for_stabilization_and_cooldown(api_server, namespace, jupyterlab, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    autoscaler = Autoscaler.Autoscaler(dc, min_replicas=1, max_replicas=4, target_utilization=0.5,
+                                       scale_up_cooldown_seconds=0, scale_down_cooldown_seconds=0,
+                                       scale_down_stabilization_seconds=60, endpoint_fn=jupyterlab.endpoint)
+    informer = PodInformer.get_pod_informer(namespace, "app=jupyterlab")
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        [first_pod] = informer.get_pod_phases()
+        jupyterlab.set_kernels(first_pod, busy=1)
+        assert autoscaler.evaluate_once() == 2
+        assert autoscaler.scale_ups == 1
+        [second_pod] = set(informer.get_pod_phases()) - {first_pod}
+
+        # Both busy calls for 4 replicas, but the last scale-up was too recent
+        autoscaler.scale_up_cooldown_seconds = 3600
+        jupyterlab.set_kernels(second_pod, busy=1)
+        assert autoscaler.evaluate_once() == 2
+
+        # Both idle: the higher targets of the stabilization window hold the replicas
+        jupyterlab.set_kernels(first_pod, idle=1, idle_seconds=3600)
+        jupyterlab.set_kernels(second_pod)
+        assert autoscaler.evaluate_once() == 2
+        autoscaler.scale_down_stabilization_seconds = 0
+        autoscaler.scale_down_cooldown_seconds = 3600
+        assert autoscaler.evaluate_once() == 2
+
+        # The pod without kernels goes first
+        autoscaler.scale_down_cooldown_seconds = 0
+        assert autoscaler.evaluate_once() == 1
+        assert autoscaler.scale_downs == 1
+        assert informer.wait_for(lambda pods: [pod['metadata']['name'] for pod in pods] == [first_pod], 30)
+    finally:
+        dc.delete_cluster()
+
+
+def test_active_pods_are_never_removed(api_server, namespace, jupyterlab, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4", output_path=output_path)
+    autoscaler = Autoscaler.Autoscaler(dc, min_replicas=0, target_utilization=1.0, scale_down_cooldown_seconds=0,
+                                       scale_down_stabilization_seconds=0, scale_to_zero_seconds=0,
+                                       endpoint_fn=jupyterlab.endpoint)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        for pod_name in PodInformer.get_pod_informer(namespace, "app=jupyterlab").get_pod_phases():
+            jupyterlab.set_kernels(pod_name, busy=1)
+        assert autoscaler.evaluate_once() == 2
+        assert autoscaler.scale_downs == 0
+    finally:
+        dc.delete_cluster()
+
+
+def test_resume_brings_back_a_cluster_scaled_to_zero(api_server, namespace, jupyterlab, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    autoscaler = Autoscaler.Autoscaler(dc, min_replicas=0, scale_down_cooldown_seconds=0,
+                                       scale_down_stabilization_seconds=0, scale_to_zero_seconds=0,
+                                       endpoint_fn=jupyterlab.endpoint)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert autoscaler.evaluate_once() == 0
+        assert autoscaler.evaluate_once() == 0
+        # As a client that never saw the cluster's packages: there is no ready pod left to read them from
+        dc.desired_packages = None
+        assert dc.get_python_package_present_in_cluster() == {}
+        assert autoscaler.resume()
+        assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 1, timeout_seconds=30)
+    finally:
+        dc.delete_cluster()
+
+
+def test_pods_are_sampled_through_the_pod_proxy(api_server, namespace, jupyterlab, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4", output_path=output_path)
+    autoscaler = Autoscaler.Autoscaler(dc)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        busy_pod, idle_pod = PodInformer.get_pod_informer(namespace, "app=jupyterlab").get_pod_phases()
+        jupyterlab.set_kernels(busy_pod, busy=1)
+        jupyterlab.set_kernels(idle_pod, idle=1, idle_seconds=3600)
+        proxied_before = api_server.request_counts["proxy Pod"]
+        samples = autoscaler.collect()
+        assert api_server.request_counts["proxy Pod"] - proxied_before == 4
+        assert {name: (sample['reachable'], sample['kernels'], sample['active']) for name, sample in samples.items()} == {
+            busy_pod: (True, 1, True), idle_pod: (True, 1, False)}
+    finally:
+        dc.delete_cluster()
+
+
+def test_unreachable_pods_count_as_active(api_server, namespace, jupyterlab, output_path, monkeypatch, caplog):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    autoscaler = Autoscaler.Autoscaler(dc)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        monkeypatch.setattr(api_server, "jupyterlab", None)
+        with caplog.at_level(logging.WARNING):
+            [(name, pod_sample)] = autoscaler.collect().items()
+        assert (pod_sample['reachable'], pod_sample['active']) == (False, True)
+        assert f"Pod {name} of cluster jupyterlab counts as active only because its JupyterLab API is unreachable" \
+               in caplog.text
+    finally:
+        dc.delete_cluster()
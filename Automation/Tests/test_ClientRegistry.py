@@ -0,0 +1,80 @@
+import concurrent.futures
+import contextvars
+import threading
+
+from kubernetes import client
+
+import ClientRegistry
+from Automation.Constant.Constant import *
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.acquired += 1
+
+
+def test_pool_stats_report_the_shared_client_pool(api_server, namespace):
+    # Every API shares the one client, and its pool
+    assert ClientRegistry.get_apps_v1().api_client is ClientRegistry.get_core_v1().api_client
+    requests = {(pool['host'], pool['port']): pool['requests'] for pool in ClientRegistry.get_pool_stats()['pools']}
+    ClientRegistry.get_core_v1().list_namespaced_pod(namespace)
+    ClientRegistry.get_core_v1().list_namespaced_pod(namespace)
+    stats = ClientRegistry.get_pool_stats()
+    assert stats['pool_maxsize'] == API_CONNECTION_POOL_MAXSIZE
+    [pool] = [pool for pool in stats['pools'] if f"http://{pool['host']}:{pool['port']}" == api_server.url]
+    assert pool['maxsize'] == API_CONNECTION_POOL_MAXSIZE
+    assert pool['requests'] - requests.get((pool['host'], pool['port']), 0) == 2
+    assert 1 <= pool['connections_opened'] <= API_CONNECTION_POOL_MAXSIZE
+
+
+def test_exec_clients_are_per_thread_and_follow_the_configuration(api_server):
+    core_v1 = ClientRegistry.get_exec_core_v1()
+    exec_client_count = ClientRegistry.get_pool_stats()['exec_clients']
+    assert ClientRegistry.get_exec_core_v1() is core_v1
+    assert core_v1.api_client is not ClientRegistry.get_api_client()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        barrier = threading.Barrier(2)
+
+        def get_exec_client():
+            barrier.wait()
+            return ClientRegistry.get_exec_core_v1()
+
+        thread_clients = [future.result() for future in [executor.submit(get_exec_client) for _ in range(2)]]
+    assert len({id(core_v1)} | {id(thread_client) for thread_client in thread_clients}) == 3
+    assert ClientRegistry.get_pool_stats()['exec_clients'] == exec_client_count + 2
+
+    # A new configuration replaces the client of every thread on its next call
+    ClientRegistry.set_configuration(api_server.client_configuration())
+    assert ClientRegistry.get_exec_core_v1() is not core_v1
+    assert ClientRegistry.get_pool_stats()['exec_clients'] == exec_client_count + 3
+
+
+def test_rate_limiters_apply_to_the_current_context_only(monkeypatch):
+    paths = []
+    monkeypatch.setattr(client.ApiClient, "call_api", lambda self, resource_path, method, *args, **kwargs:
+                        paths.append(resource_path))
+    api_client = ClientRegistry.RateLimitedApiClient(client.Configuration())
+    api_limiter, exec_limiter = CountingLimiter(), CountingLimiter()
+
+    with ClientRegistry.rate_limited(api_rate_limiter=api_limiter, exec_rate_limiter=exec_limiter):
+        api_client.call_api("/api/v1/namespaces/test/pods", "GET")
+        api_client.call_api("/api/v1/namespaces/test/pods/pod-0/exec", "GET")
+        # Threads started with a copy of the context are limited, other threads are not
+        context = contextvars.copy_context()
+        copied = threading.Thread(target=context.run, args=[api_client.call_api, "/api/v1/namespaces", "GET"])
+        plain = threading.Thread(target=api_client.call_api, args=["/api/v1/namespaces", "GET"])
+        for thread in (copied, plain):
+            thread.start()
+            thread.join()
+    assert (api_limiter.acquired, exec_limiter.acquired) == (2, 1)
+
+    # Nothing is limited once the block is left
+    api_client.call_api("/api/v1/namespaces/test/pods", "GET")
+    assert (api_limiter.acquired, exec_limiter.acquired) == (2, 1)
+    assert len(paths) == 5
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import DeploymentClient
+import EnvironmentReconciler
+import FakeApiServer
+import KubernetesHelper
+import PodInformer
+from conftest import pod_packages
+
+
+def ready_pods_without(api_server, namespace, package) -> list:
+    with api_server._lock:
+        return [name for (pod_namespace, name), pod in api_server.pods.items()
+                if pod_namespace == namespace and FakeApiServer._is_ready(pod)
+                and package not in api_server.pod_packages[pod['metadata']['uid']]]
+
+
+def test_restarted_pod_is_unready_until_it_has_its_packages_again(api_server, namespace, output_path, monkeypatch):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4", output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert dc.install_python_package_in_cluster("pandas==1.5.3") == (2, 2)
+        pod_name = sorted(pod_packages(api_server, namespace))[0]
+        # Slow enough for the unready pod to be seen
+        monkeypatch.setattr(api_server, "pip_seconds_per_package", 0.5)
+        api_server.restart_pod(namespace, pod_name)
+        informer = PodInformer.get_pod_informer(namespace, "app=jupyterlab")
+        assert informer.wait_for(lambda pods: not all(map(PodInformer.is_pod_ready, pods)), 10)
+        # The pod reinstalls the packages on its own, no reconciler runs in this process
+        assert not any(thread.name.startswith("reconciler-") for thread in threading.enumerate())
+        assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 2, timeout_seconds=30)
+        assert pod_packages(api_server, namespace)[pod_name]['pandas'] == "1.5.3"
+    finally:
+        dc.delete_cluster()
+
+
+def test_rollout_only_sends_traffic_to_pods_with_the_packages(api_server, namespace, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 3, "jupyterlab:3.4", output_path=output_path)
+    violations = []
+    stopped = threading.Event()
+
+    def watch_ready_pods():
+        while not stopped.is_set():
+            violations.extend(ready_pods_without(api_server, namespace, "pandas"))
+            time.sleep(0.005)
+
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert dc.install_python_package_in_cluster("pandas==1.5.3") == (3, 3)
+        watcher = threading.Thread(target=watch_ready_pods, daemon=True)
+        watcher.start()
+        assert dc.update_image("jupyterlab:3.5", timeout_seconds=60)
+        stopped.set()
+        watcher.join()
+        assert violations == []
+        assert set(dc.last_rollout['pod_ready_seconds']) == set(pod_packages(api_server, namespace))
+    finally:
+        stopped.set()
+        dc.delete_cluster()
+
+
+def test_compute_package_delta():
+    installed = {'Pandas': "1.5.3", 'numpy': "1.24.0", 'scikit_learn': "1.2.0"}
+    assert EnvironmentReconciler.compute_package_delta(
+        ["pandas==1.5.3", "numpy==1.25.0", "scikit-learn>=1.0", "requests"], installed) == ["numpy==1.25.0",
+                                                                                          "requests"]
+    assert EnvironmentReconciler.compute_package_delta([], installed) == []
+    assert EnvironmentReconciler.compute_package_delta(["pandas"], {}) == ["pandas"]
+    # Specifiers are compared as versions, not as strings
+    assert EnvironmentReconciler.compute_package_delta(["pandas>=1.5"], {'pandas': "1.0"}) == ["pandas>=1.5"]
+    assert EnvironmentReconciler.compute_package_delta(["pandas==1.5"], {'pandas': "1.5.0"}) == []
+    assert EnvironmentReconciler.compute_package_delta(["pandas~=1.5.0", "numpy<2"],
+                                                       {'pandas': "1.5.3", 'numpy': "2.0.0rc1"}) == ["numpy<2"]
+    assert EnvironmentReconciler.compute_package_delta(["pandas @ https://host/pandas.whl", "git+https://host/x"],
+                                                       {'pandas': "1.5.3"}) == ["git+https://host/x"]
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import ExecEngine
+
+
+class ConcurrencyTracker:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, pod):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.running -= 1
+        return pod
+
+
+def test_per_node_limit_only_applies_to_known_nodes():
+    engine = ExecEngine.ExecEngine(max_workers=4, max_per_node=1)
+    pods = [f"pod-{index}" for index in range(4)]
+
+    tracker = ConcurrencyTracker(0.1)
+    assert sorted(result.value for result in engine.run(tracker, pods)) == pods
+    assert tracker.peak == 4
+
+    tracker = ConcurrencyTracker(0.05)
+    results = list(engine.run(tracker, pods, pod_nodes={pod: "node-a" for pod in pods}))
+    assert all(result.ok for result in results)
+    assert tracker.peak == 1
+
+
+def test_timed_out_task_is_retried_only_once_it_finished():
+    engine = ExecEngine.ExecEngine(timeout_seconds=0.1, retries=1, backoff_seconds=0)
+    started = []
+
+    def fn(pod):
+        started.append(time.monotonic())
+        if len(started) == 1:
+            time.sleep(0.3)
+        return pod
+
+    [result] = engine.run(fn, ["pod-0"])
+    assert result.ok and result.attempts == 2
+    # The retry started after the first attempt's 0.3s, not right after its 0.1s timeout
+    assert started[1] - started[0] >= 0.3
+    assert engine.stats()['timed_out'] == 1
+
+
+def test_in_flight_tasks_are_bounded_by_max_workers():
+    engine = ExecEngine.ExecEngine(max_workers=2, max_per_node=8)
+    tracker = ConcurrencyTracker(0.05)
+    results = list(engine.run(tracker, [f"pod-{index}" for index in range(6)]))
+    assert len(results) == 6 and all(result.ok for result in results)
+    assert tracker.peak == 2
+    assert engine.stats()['peak_in_flight'] == 2
+
+
+def test_failed_tasks_are_retried_until_retries_run_out():
+    engine = ExecEngine.ExecEngine(retries=2, backoff_seconds=0.01)
+    attempts = {}
+
+    def flaky(pod):
+        attempts[pod] = attempts.get(pod, 0) + 1
+        if pod == "broken" or attempts[pod] < 3:
+            raise ConnectionError(f"attempt {attempts[pod]}")
+        return pod
+
+    results = {result.pod: result for result in engine.run(flaky, ["flaky", "broken"])}
+    assert results["flaky"].ok and results["flaky"].attempts == 3
+    assert not results["broken"].ok and results["broken"].attempts == 3
+    assert isinstance(results["broken"].error, ConnectionError)
+    assert engine.stats()['retried'] == 4 and engine.stats()['failed'] == 1
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import ClientRegistry
+import ExecEngine
+import FleetManager
+from Automation.Constant.Constant import *
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.acquired += 1
+
+
+def test_rate_limits_apply_only_to_the_managers_operations(api_server, namespace):
+    fleet = FleetManager.FleetManager(global_concurrency=2)
+    other_fleet = FleetManager.FleetManager(global_concurrency=1)
+    fleet.api_rate_limiter = CountingLimiter()
+    other_fleet.api_rate_limiter = CountingLimiter()
+    core_v1 = ClientRegistry.get_core_v1()
+
+    def list_pods(count):
+        for _ in range(count):
+            core_v1.list_namespaced_pod(namespace)
+
+    try:
+        fleet.submit("list", namespace, list_pods, 3).result(timeout=10)
+        other_fleet.submit("list", namespace, list_pods, 2).result(timeout=10)
+        # Tasks an operation fans out through the exec engine keep its limiters
+        fleet.submit("fan_out", namespace, lambda: list(ExecEngine.get_exec_engine().run(
+            lambda pod: list_pods(1), ["a", "b"]))).result(timeout=10)
+        list_pods(4)
+    finally:
+        fleet.shutdown()
+        other_fleet.shutdown()
+    assert fleet.api_rate_limiter.acquired == 5
+    assert other_fleet.api_rate_limiter.acquired == 2
+    # A shut down manager leaves the rest of the process unlimited
+    list_pods(1)
+    assert fleet.api_rate_limiter.acquired == 5
+
+
+def test_counters_are_updated_before_the_future_resolves(api_server, namespace):
+    fleet = FleetManager.FleetManager(global_concurrency=4)
+
+    def fail():
+        raise ValueError("boom")
+
+    try:
+        futures = [fleet.submit("ok", namespace, lambda: 1) for _ in range(20)]
+        futures += [fleet.submit("fail", namespace, fail) for _ in range(10)]
+        for future in futures:
+            future.exception(timeout=10)
+        stats = fleet.stats()
+    finally:
+        fleet.shutdown()
+    assert (stats['completed'], stats['failed']) == (20, 10)
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = FleetManager.TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(2):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.04
+    for _ in range(2):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+    assert bucket.throttled_seconds > 0
+
+
+def test_higher_priority_operations_run_first(api_server, namespace):
+    fleet = FleetManager.FleetManager(global_concurrency=1)
+    release = threading.Event()
+    order = []
+    try:
+        blocker = fleet.submit("blocker", namespace, release.wait, 10)
+        futures = [fleet.submit(name, namespace, order.append, name, priority=priority) for name, priority in [
+            ("background", PRIORITY_BACKGROUND), ("default", PRIORITY_DEFAULT), ("interactive", PRIORITY_INTERACTIVE),
+            ("interactive-2", PRIORITY_INTERACTIVE)]]
+        release.set()
+        for future in [blocker] + futures:
+            future.result(timeout=10)
+    finally:
+        fleet.shutdown()
+    assert order == ["interactive", "interactive-2", "default", "background"]
+
+
+def test_busy_namespace_does_not_hold_up_others(api_server, namespace):
+    fleet = FleetManager.FleetManager(global_concurrency=2, namespace_concurrency=1)
+    started, release = threading.Event(), threading.Event()
+    try:
+        blocker = fleet.submit("blocker", namespace, lambda: started.set() or release.wait(10))
+        assert started.wait(10)
+        same_namespace = fleet.submit("same", namespace, lambda: "same", priority=PRIORITY_INTERACTIVE)
+        other_namespace = fleet.submit("other", f"{namespace}-other", lambda: "other")
+        assert other_namespace.result(timeout=10) == "other"
+        assert not same_namespace.done()
+        release.set()
+        assert same_namespace.result(timeout=10) == "same"
+        assert blocker.result(timeout=10)
+    finally:
+        release.set()
+        fleet.shutdown()
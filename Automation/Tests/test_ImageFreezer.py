@@ -0,0 +1,77 @@
+import os
+
+import DeploymentClient
+import ImageFreezer
+import KubernetesHelper
+from conftest import pod_packages
+
+
+# Image builder that records the build contexts, pushed images get the frozen packages in the fake API server
+class RecordingImageBuilder:
+    def __init__(self, api_server):
+        self.api_server = api_server
+        self.builds = []
+        self.pushed = []
+
+    def build(self, context_dir, tag) -> bool:
+        with open(os.path.join(context_dir, "Dockerfile")) as f:
+            dockerfile = f.read()
+        with open(os.path.join(context_dir, "requirements.txt")) as f:
+            requirements = f.read()
+        self.builds.append((tag, dockerfile, requirements))
+        return True
+
+    def push(self, tag) -> bool:
+        self.pushed.append(tag)
+        requirements = next(build[2] for build in self.builds if build[0] == tag)
+        with self.api_server._lock:
+            self.api_server.image_packages[tag] = dict(line.split("==") for line in requirements.split())
+        return True
+
+
+def test_frozen_image_tag_only_depends_on_base_image_and_package_set():
+    tag = ImageFreezer.get_frozen_image_tag("registry.local/jupyterlab", "jupyterlab:3.4",
+                                            ["pandas==1.5.3", "numpy==1.24.0"])
+    assert tag.startswith("registry.local/jupyterlab:frozen-")
+    assert tag == ImageFreezer.get_frozen_image_tag("registry.local/jupyterlab", "jupyterlab:3.4",
+                                                    ["numpy==1.24.0", "pandas==1.5.3"])
+    assert tag != ImageFreezer.get_frozen_image_tag("registry.local/jupyterlab", "jupyterlab:3.5",
+                                                    ["numpy==1.24.0", "pandas==1.5.3"])
+
+
+def test_frozen_cluster_rolls_onto_an_image_with_its_packages(api_server, namespace, output_path, tmp_path,
+                                                              monkeypatch):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4", output_path=output_path)
+    builder = RecordingImageBuilder(api_server)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert dc.install_python_package_in_cluster("pandas==1.5.3") == (2, 2)
+        packages_list = dc.get_all_python_package_present_in_cluster()
+
+        tag = dc.freeze_cluster(builder, "registry.local/jupyterlab", str(tmp_path / "context"))
+        assert tag == ImageFreezer.get_frozen_image_tag("registry.local/jupyterlab", "jupyterlab:3.4", packages_list)
+        [(built_tag, dockerfile, requirements)] = builder.builds
+        assert built_tag == tag and builder.pushed == [tag]
+        assert dockerfile.splitlines() == [
+            "FROM jupyterlab:3.4", "COPY requirements.txt /tmp/requirements.txt",
+            "RUN pip3 install --no-cache-dir -r /tmp/requirements.txt && rm /tmp/requirements.txt"]
+        assert requirements == "\n".join(sorted(packages_list)) + "\n"
+        assert "pandas==1.5.3" in requirements.split("\n")
+        assert (dc.frozen_image, dc.frozen_packages) == (tag, packages_list)
+
+        # Freezing leaves the deployment alone, update_image switches it. Pods of the frozen image start with the
+        # packages, the reconciler does not collect their inventory
+        deployment = KubernetesHelper.read_deployment("jupyterlab", namespace)
+        assert deployment['spec']['template']['spec']['containers'][0]['image'] == "jupyterlab:3.4"
+        inventories = []
+        get_packages = dc.get_python_package_present_in_pod
+        monkeypatch.setattr(dc, "get_python_package_present_in_pod",
+                            lambda pod_name, package="": inventories.append(pod_name) or get_packages(pod_name, package))
+        assert dc.update_image(tag, timeout_seconds=60)
+        deployment = KubernetesHelper.read_deployment("jupyterlab", namespace)
+        assert deployment['spec']['template']['spec']['containers'][0]['image'] == tag
+        assert dc.image == tag and dc.frozen_image == tag
+        assert inventories == []
+        assert all(packages['pandas'] == "1.5.3" for packages in pod_packages(api_server, namespace).values())
+    finally:
+        dc.delete_cluster()
@@ -0,0 +1,28 @@
+import DeploymentClient
+import KubernetesHelper
+
+
+def test_substitute_properties():
+    props_dict = KubernetesHelper.create_props_dic({'replica_count': "3", 'image': "jupyterlab:3.4",
+                                                    'deployment_name': "jupyterlab"})
+    template = {'metadata': {'name': "${deployment_name}", 'labels': {'app': "${deployment_name}"}},
+                'spec': {'replicas': "${replica_count}",
+                         'containers': [{'image': "registry.local/${image}", 'args': ["${unknown}"]}]}}
+    assert KubernetesHelper.substitute_properties(template, props_dict) == {
+        'metadata': {'name': "jupyterlab", 'labels': {'app': "jupyterlab"}},
+        # A value that is exactly one placeholder keeps the YAML type of the property
+        'spec': {'replicas': 3, 'containers': [{'image': "registry.local/jupyterlab:3.4", 'args': ["${unknown}"]}]}}
+
+
+def test_wait_for_ready_pods(api_server, namespace, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 2, "jupyterlab:3.4", output_path=output_path)
+    assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 0, timeout_seconds=10)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 2, timeout_seconds=10)
+        # Exactly the target count: more or fewer ready pods time out
+        assert not KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 3, timeout_seconds=0.2)
+        assert not KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 1, timeout_seconds=0.2)
+    finally:
+        dc.delete_cluster()
+    assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 0, timeout_seconds=30)
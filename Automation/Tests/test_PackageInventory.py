@@ -0,0 +1,97 @@
+import pytest
+
+import ClientRegistry
+import DeploymentClient
+import PackageInventory
+import StateStore
+import Utils
+
+
+def make_pod(uid="uid-1", image="jupyterlab:3.4", restart_count=0, name="pod-1") -> dict:
+    return {'metadata': {'name': name, 'uid': uid},
+            'spec': {'containers': [{'name': "jupyterlab", 'image': image}]},
+            'status': {'containerStatuses': [{'name': "jupyterlab", 'restartCount': restart_count}]}}
+
+
+@pytest.fixture
+def inventory(monkeypatch):
+    monkeypatch.setattr(StateStore, "_state_store", None)
+    inventory = PackageInventory.PackageInventory()
+    reads = []
+
+    def read_packages(pod_name, namespace, container):
+        reads.append(pod_name)
+        return {'Pandas': "1.5.3", 'scikit_learn': "1.2.0", 'numpy': "1.24.0"}
+
+    monkeypatch.setattr(inventory, "_read_packages", read_packages)
+    inventory.reads = reads
+    return inventory
+
+
+def test_entries_are_keyed_by_pod_uid_and_image(inventory):
+    assert inventory.get_packages(make_pod(), "poc")['Pandas'] == "1.5.3"
+    assert inventory.get_package_version(make_pod(), "poc", "pandas") == "1.5.3"
+    assert (inventory.cache_misses, inventory.cache_hits) == (1, 1)
+
+    # A new pod of the same name, or the same pod on another image, is read again
+    inventory.get_packages(make_pod(uid="uid-2"), "poc")
+    inventory.get_packages(make_pod(uid="uid-2", image="jupyterlab:3.5"), "poc")
+    assert inventory.cache_misses == 3
+    # Entries of the previous pod of a name are dropped
+    assert inventory.stats()['pods'] == 1
+
+
+def test_container_restart_and_invalidate_drop_the_entry(inventory):
+    inventory.get_packages(make_pod(), "poc")
+    inventory.get_packages(make_pod(restart_count=1), "poc")
+    assert inventory.cache_misses == 2
+    inventory.get_packages(make_pod(restart_count=1), "poc")
+    assert inventory.cache_misses == 2
+
+    inventory.invalidate("pod-1", "poc")
+    inventory.get_packages(make_pod(restart_count=1), "poc")
+    assert inventory.reads == ["pod-1"] * 3
+
+
+def test_lookups_use_canonical_package_names(inventory):
+    pod = make_pod()
+    assert inventory.get_package_version(pod, "poc", "Scikit-Learn") == "1.2.0"
+    assert inventory.get_package_version(pod, "poc", "requests") is None
+    assert inventory.find_packages(pod, "poc", "scikit_") == {'scikit_learn': "1.2.0"}
+    assert inventory.find_packages(pod, "poc", "") == {'Pandas': "1.5.3", 'scikit_learn': "1.2.0", 'numpy': "1.24.0"}
+
+
+def test_pip_list_json_is_parsed():
+    data = '[{"name": "Pandas", "version": "1.5.3"}, {"name": "jupyter-server", "version": "1.23.0"}]'
+    assert Utils.Utils.extract_python_packages_from_json(data) == {'Pandas': "1.5.3", 'jupyter-server': "1.23.0"}
+    assert Utils.Utils.extract_python_packages_from_json("[]") == {}
+
+
+def test_install_invalidates_the_pods_inventory(api_server, namespace, output_path, monkeypatch):
+    monkeypatch.setattr(StateStore, "_state_store", None)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        [pod_name] = dc.get_pods_and_status_of_deployment()
+        assert dc.get_python_package_present_in_pod(pod_name, "pandas") == {}
+        assert dc.install_python_package_in_cluster("pandas==1.5.3") == (1, 1)
+        assert dc.get_python_package_present_in_pod(pod_name, "pandas") == {'pandas': "1.5.3"}
+    finally:
+        dc.delete_cluster()
+
+
+def test_deleting_a_cluster_drops_the_stored_inventories_of_its_pods(api_server, namespace, output_path, tmp_path,
+                                                                      monkeypatch):
+    store = StateStore.StateStore(str(tmp_path / "state.db"))
+    monkeypatch.setattr(StateStore, "_state_store", store)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        [pod_name] = dc.get_pods_and_status_of_deployment()
+        assert dc.get_python_package_present_in_pod(pod_name, "pandas") == {}
+        uid = api_server.pods[(namespace, pod_name)]['metadata']['uid']
+        host = ClientRegistry.get_configuration().host
+        assert store.get_inventory(host, uid, "jupyterlab:3.4") is not None
+    finally:
+        assert dc.delete_cluster()
+    assert store.get_inventory(host, uid, "jupyterlab:3.4") is None
@@ -0,0 +1,79 @@
+import pytest
+
+import DeploymentClient
+import PodInformer
+import StateStore
+from Automation.Constant.Constant import *
+
+
+@pytest.fixture
+def state_store(tmp_path, monkeypatch):
+    store = StateStore.StateStore(str(tmp_path / "state.db"))
+    monkeypatch.setattr(StateStore, "_state_store", store)
+    return store
+
+
+def test_restored_pods_are_not_counted_until_the_watch_caught_up(api_server, namespace, state_store, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        first = PodInformer.PodInformer(namespace, "app=jupyterlab").start()
+        assert first.get_ready_pod_count() == 1
+        first.stop()
+        first._save_snapshot(force=True)
+
+        # The snapshot still has the ready pod, the watch from its resourceVersion replays the deletion
+        assert dc.scale_cluster(0, timeout_seconds=30)
+        second = PodInformer.PodInformer(namespace, "app=jupyterlab").start()
+        assert second.get_ready_pod_count() == 0
+        assert second.stats()['restored']
+        second.stop()
+    finally:
+        dc.delete_cluster()
+
+
+def test_restored_informer_turns_live_after_a_quiet_watch(api_server, namespace, state_store):
+    first = PodInformer.PodInformer(namespace, "app=jupyterlab").start()
+    assert first.wait_for(lambda pods: True, 10)
+    first.stop()
+    first._save_snapshot(force=True)
+
+    second = PodInformer.PodInformer(namespace, "app=jupyterlab")
+    second._restore(state_store)
+    assert second.stats()['restored'] and not second.stats()['live']
+    # Restored pods are served, but waits hold until the catch-up watch ended cleanly
+    assert second.get_pods(timeout_seconds=0) == []
+    assert not second.wait_for(lambda pods: True, 0.1)
+    assert second.wait_for(lambda pods: True, 10)
+    assert second.stats()['live']
+    second.stop()
+
+
+def test_queries_count_cache_hits_misses_and_staleness(api_server, namespace):
+    informer = PodInformer.PodInformer(namespace, "app=jupyterlab")
+    assert informer.staleness() == float("inf")
+    try:
+        # The first query waits for the list, the next one is served from the cache
+        assert informer.get_pods(timeout_seconds=10) == []
+        assert informer.get_pods(timeout_seconds=10) == []
+        assert (informer.cache_misses, informer.cache_hits) == (1, 1)
+        assert informer.staleness() < INFORMER_STALE_SECONDS
+
+        # A cache that has not heard from the API server for too long counts as a miss
+        informer._last_sync -= INFORMER_STALE_SECONDS + 1
+        assert informer.staleness() > INFORMER_STALE_SECONDS
+        informer.get_pods(timeout_seconds=10)
+        assert informer.stats()['cache_misses'] == 2
+    finally:
+        informer.stop()
+
+
+def test_deleting_a_cluster_stops_and_forgets_its_informer(api_server, namespace, output_path):
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", output_path=output_path)
+    assert dc.create_cluster(timeout_seconds=30)
+    informer = PodInformer.get_pod_informer(namespace, "app=jupyterlab")
+    assert dc.delete_cluster()
+    assert informer._stopped.is_set()
+    assert (namespace, "app=jupyterlab") not in PodInformer._informers
+    assert PodInformer.get_pod_informer(namespace, "app=jupyterlab") is not informer
+    PodInformer.remove_pod_informer(namespace, "app=jupyterlab")
@@ -0,0 +1,49 @@
+import threading
+
+import DeploymentClient
+import StateStore
+
+
+def test_concurrent_desired_package_updates_are_not_lost(tmp_path):
+    path = str(tmp_path / "state.db")
+    # Two stores on one file, as two processes would open it
+    stores = [StateStore.StateStore(path), StateStore.StateStore(path)]
+    packages = [f"package-{index}==1.0" for index in range(16)]
+
+    def add(store, package):
+        store.update_desired_packages("https://api", "poc", "jupyterlab", lambda current: (current or []) + [package])
+
+    threads = [threading.Thread(target=add, args=[stores[index % 2], package])
+               for index, package in enumerate(packages)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(stores[0].get_cluster("https://api", "poc", "jupyterlab")['desired_packages']) == sorted(packages)
+
+
+def test_inventories_are_kept_per_api_server(tmp_path):
+    store = StateStore.StateStore(str(tmp_path / "state.db"))
+    for api_server in ("https://api-1", "https://api-2"):
+        store.save_inventory(api_server, "uid-1", "jupyterlab:3.4", 0, "poc", "pod-1", {'pandas': "1.5.3"})
+    store.delete_inventory("https://api-1", "poc", "pod-1")
+    assert store.get_inventory("https://api-1", "uid-1", "jupyterlab:3.4") is None
+    assert store.get_inventory("https://api-2", "uid-1", "jupyterlab:3.4")['packages'] == {'pandas': "1.5.3"}
+
+
+def test_long_lived_clients_pick_up_the_stored_state(api_server, namespace, output_path, tmp_path):
+    store = StateStore.StateStore(str(tmp_path / "state.db"))
+    first = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", state_store=store,
+                                              output_path=output_path)
+    try:
+        assert first.create_cluster(timeout_seconds=30)
+        second = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", state_store=store,
+                                                   output_path=output_path)
+        assert second.get_desired_packages() == []
+
+        assert first.scale_cluster(2, timeout_seconds=30)
+        assert first.install_python_package_in_cluster("pandas==1.5.3") == (2, 2)
+        assert second.get_desired_packages() == ["pandas==1.5.3"]
+        assert int(second.replica_count) == 2
+    finally:
+        first.delete_cluster()
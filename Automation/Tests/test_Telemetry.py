@@ -0,0 +1,70 @@
+import logging
+
+import pytest
+
+import Telemetry
+
+
+def test_spans_nest_and_record_their_result():
+    with Telemetry.span("scale_cluster", cluster="jupyterlab") as outer:
+        with Telemetry.span("inventory"):
+            pass
+        with pytest.raises(ValueError):
+            with Telemetry.span("apply"):
+                raise ValueError("apply failed")
+        with Telemetry.span("wait_for_ready") as inner:
+            inner['result'] = False
+        outer['result'] = True
+    with Telemetry.span("delete_cluster"):
+        pass
+
+    spans = Telemetry.get_recent_spans()[-5:]
+    assert [(span['name'], span['result']) for span in spans] == [
+        ("scale_cluster/inventory", "ok"), ("scale_cluster/apply", "error"),
+        ("scale_cluster/wait_for_ready", "failed"), ("scale_cluster", "ok"), ("delete_cluster", "ok")]
+    assert spans[3]['attributes'] == {'cluster': "jupyterlab", 'result': True}
+    assert spans[0]['seconds'] <= spans[3]['seconds']
+
+
+def test_metrics_render_in_the_text_exposition_format():
+    registry = Telemetry.MetricsRegistry()
+    counter = registry.counter("phase_total", "Phases by result")
+    counter.inc(phase="create", result="ok")
+    counter.inc(2, phase="create", result="ok")
+    histogram = registry.histogram("phase_seconds", "Phase durations", buckets=(0.1, 1))
+    histogram.observe(0.05, phase="create")
+    histogram.observe(0.5, phase="create")
+    histogram.observe(5, phase="create")
+    registry.gauge("pool_size", "Pods in the pool", lambda: [({'image': 'jupyter"lab\\3.4\n'}, 2)])
+    registry.gauge("broken", "Failing gauge", lambda: 1 / 0)
+    # The same name gives back the same metric
+    assert registry.counter("phase_total", "Phases by result") is counter
+
+    assert registry.render().split("\n") == [
+        "# HELP phase_total Phases by result",
+        "# TYPE phase_total counter",
+        'phase_total{phase="create",result="ok"} 3.0',
+        "# HELP phase_seconds Phase durations",
+        "# TYPE phase_seconds histogram",
+        'phase_seconds_bucket{phase="create",le="0.1"} 1',
+        'phase_seconds_bucket{phase="create",le="1"} 2',
+        'phase_seconds_bucket{phase="create",le="+Inf"} 3',
+        'phase_seconds_sum{phase="create"} 5.55',
+        'phase_seconds_count{phase="create"} 3',
+        "# HELP pool_size Pods in the pool",
+        "# TYPE pool_size gauge",
+        'pool_size{image="jupyter\\"lab\\\\3.4\\n"} 2',
+        "# HELP broken Failing gauge",
+        "# TYPE broken gauge",
+        "",
+    ]
+
+
+@pytest.mark.parametrize("sample, kept", [(0.1, True), (0.9, False)])
+def test_sampling_filter_drops_a_share_of_debug_records_only(monkeypatch, sample, kept):
+    monkeypatch.setattr(Telemetry.random, "random", lambda: sample)
+    sampling_filter = Telemetry.SamplingFilter(0.5)
+    records = [logging.LogRecord("test", level, __file__, 1, "message", None, None)
+               for level in (logging.WARNING, logging.INFO, logging.DEBUG)]
+    # Records at INFO and above are always kept
+    assert [sampling_filter.filter(record) for record in records] == [True, True, kept]
@@ -0,0 +1,18 @@
+import Utils
+
+
+def test_extract_pip_install_results():
+    pip_output = "\n".join([
+        "Collecting scikit_learn==1.1.3",
+        "Requirement already satisfied: numpy>=1.17.3 in /usr/local/lib/python3.10/site-packages (1.23.4)",
+        "Installing collected packages: scikit-learn, Jinja2",
+        "Successfully installed Jinja2-3.1.2 scikit-learn-1.1.3",
+    ])
+    assert Utils.Utils.extract_pip_install_results(
+        ["scikit_learn==1.1.3", "numpy", "jinja2>=3", "pandas==1.5.3"], pip_output) == {
+        "scikit_learn==1.1.3": True, "numpy": True, "jinja2>=3": True, "pandas==1.5.3": False}
+
+
+def test_extract_pip_install_results_of_a_failed_install():
+    pip_output = "ERROR: Could not find a version that satisfies the requirement pandas==0.0.1"
+    assert Utils.Utils.extract_pip_install_results(["pandas==0.0.1"], pip_output) == {"pandas==0.0.1": False}
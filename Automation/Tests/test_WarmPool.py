@@ -0,0 +1,68 @@
+import DeploymentClient
+import KubernetesHelper
+import PodInformer
+import WarmPool
+
+
+def test_lost_claimed_pods_are_replaced_by_the_deployment(api_server, namespace, output_path):
+    warm_pool = WarmPool.WarmPool(namespace, "jupyterlab:3.4", min_size=2, max_size=2)
+    assert warm_pool.refill() == 2
+    assert warm_pool.informer.wait_for(lambda pods: sum(map(PodInformer.is_pod_ready, pods)) == 2, 30)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 3, "jupyterlab:3.4", warm_pool=warm_pool,
+                                           output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        claimed_pods = dc.get_claimed_pods()
+        assert len(claimed_pods) == 2
+        assert KubernetesHelper.read_deployment("jupyterlab", namespace)['spec']['replicas'] == 1
+
+        api_server.evict_pod(namespace, claimed_pods[0])
+        informer = PodInformer.get_pod_informer(namespace, "app=jupyterlab")
+        assert informer.wait_for(lambda pods: any(pod['status']['phase'] == "Failed" for pod in pods), 10)
+        assert dc.get_claimed_pods() == claimed_pods[1:]
+        dc.reconciler.reconcile_once()
+        assert KubernetesHelper.read_deployment("jupyterlab", namespace)['spec']['replicas'] == 2
+        assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 3, timeout_seconds=30)
+        assert claimed_pods[0] not in informer.get_pod_phases()
+        # Nothing more is missing
+        assert dc.replace_lost_claimed_pods() == 0
+    finally:
+        dc.delete_cluster()
+        warm_pool.stop()
+
+
+def test_warm_pool_of_another_namespace_is_not_claimed(api_server, namespace, output_path):
+    warm_pool = WarmPool.WarmPool(f"{namespace}-pool", "jupyterlab:3.4", min_size=1, max_size=1)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", warm_pool=warm_pool,
+                                           output_path=output_path)
+    assert dc.claim_warm_pods(1) == []
+
+
+def test_external_scale_down_is_not_reverted(api_server, namespace, output_path):
+    # An empty pool, the deployment launches every pod
+    warm_pool = WarmPool.WarmPool(namespace, "jupyterlab:3.4", min_size=0, max_size=0)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 3, "jupyterlab:3.4", warm_pool=warm_pool,
+                                           output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert KubernetesHelper.scale_deployment("jupyterlab", namespace, 1)
+        assert KubernetesHelper.wait_for_ready_pods("jupyterlab", namespace, 1, timeout_seconds=30)
+        dc.reconciler.reconcile_once()
+        # No claimed pod went away, the replica count of the client is not the source of truth
+        assert KubernetesHelper.read_deployment("jupyterlab", namespace)['spec']['replicas'] == 1
+    finally:
+        dc.delete_cluster()
+
+
+def test_refill_replaces_terminated_pool_pods(api_server, namespace):
+    warm_pool = WarmPool.WarmPool(namespace, "jupyterlab:3.4", min_size=1, max_size=1)
+    assert warm_pool.refill() == 1
+    assert warm_pool.informer.wait_for(lambda pods: sum(map(PodInformer.is_pod_ready, pods)) == 1, 30)
+    [evicted_pod] = [pod['metadata']['name'] for pod in warm_pool.informer.get_pods()]
+    api_server.evict_pod(namespace, evicted_pod)
+    assert warm_pool.informer.wait_for(lambda pods: all(map(PodInformer.is_pod_terminated, pods)), 10)
+    assert warm_pool.refill() == 1
+    assert warm_pool.informer.wait_for(
+        lambda pods: [pod['metadata']['name'] != evicted_pod and PodInformer.is_pod_ready(pod) for pod in pods] == [True],
+        30)
+    assert warm_pool.refill() == 0
@@ -0,0 +1,69 @@
+import hashlib
+
+import pytest
+
+import DeploymentClient
+import Wheelhouse
+from Automation.Constant.Constant import *
+from conftest import pod_packages
+
+
+@pytest.fixture
+def local_dir(tmp_path):
+    wheel_dir = tmp_path / "wheels"
+    wheel_dir.mkdir()
+    (wheel_dir / "pandas-1.5.3-py3-none-any.whl").write_bytes(b"pandas 1.5.3 wheel")
+    return str(wheel_dir)
+
+
+def wheelhouse_files(api_server, namespace) -> dict:
+    with api_server._lock:
+        return {path: content for (pod_namespace, name), pod in api_server.pods.items()
+                if pod_namespace == namespace and name.startswith(WHEELHOUSE_NAME)
+                for path, content in api_server.pod_files[pod['metadata']['uid']].items()}
+
+
+def test_pods_install_hash_pinned_wheels_from_one_in_cluster_copy(api_server, namespace, output_path, local_dir):
+    wheelhouse = Wheelhouse.Wheelhouse(namespace, "jupyterlab:3.4", local_dir=local_dir, offline=True)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 3, "jupyterlab:3.4", wheelhouse=wheelhouse,
+                                           output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert dc.install_python_package_in_cluster("pandas==1.5.3") == (3, 3)
+        assert all(packages['pandas'] == "1.5.3" for name, packages in pod_packages(api_server, namespace).items()
+                   if not name.startswith(WHEELHOUSE_NAME))
+
+        # The local wheel was uploaded once, to the wheelhouse pod, and installs are pinned to its digest
+        digest = hashlib.sha256(b"pandas 1.5.3 wheel").hexdigest()
+        assert wheelhouse_files(api_server, namespace) == {
+            f"{WHEELHOUSE_POD_PATH}/pandas-1.5.3-py3-none-any.whl": b"pandas 1.5.3 wheel"}
+        requirements = wheelhouse.requirements_for(["pandas==1.5.3"])
+        assert f"pandas==1.5.3 --hash=sha256:{digest}" in requirements.split("\n")
+        assert f"--find-links {wheelhouse.get_index_url()}" in requirements.split("\n")
+
+        # Offline, packages without a local wheel cannot be built
+        assert dc.install_python_package_in_cluster("numpy==1.24.0") == (0, 3)
+    finally:
+        dc.delete_cluster()
+        wheelhouse.delete()
+
+
+def test_installs_fail_when_the_served_wheel_does_not_match_its_hash(api_server, namespace, output_path, local_dir):
+    wheelhouse = Wheelhouse.Wheelhouse(namespace, "jupyterlab:3.4", local_dir=local_dir, offline=True)
+    dc = DeploymentClient.DeploymentClient("jupyterlab", namespace, 1, "jupyterlab:3.4", wheelhouse=wheelhouse,
+                                           output_path=output_path)
+    try:
+        assert dc.create_cluster(timeout_seconds=30)
+        assert wheelhouse.requirements_for(["pandas==1.5.3"]) is not None
+        [pod_name] = dc.get_pods_and_status_of_deployment()
+        # Swapped after the wheel was pinned
+        with api_server._lock:
+            for (pod_namespace, name), pod in api_server.pods.items():
+                if pod_namespace == namespace and name.startswith(WHEELHOUSE_NAME):
+                    api_server.pod_files[pod['metadata']['uid']][
+                        f"{WHEELHOUSE_POD_PATH}/pandas-1.5.3-py3-none-any.whl"] = b"tampered"
+        assert dc.install_python_packages_in_pod(pod_name, ["pandas==1.5.3"]) == 0
+        assert 'pandas' not in pod_packages(api_server, namespace)[pod_name]
+    finally:
+        dc.delete_cluster()
+        wheelhouse.delete()